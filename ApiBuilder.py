@@ -1,8 +1,9 @@
 import importlib
-import json
 import os
+import threading
 
 import Settings
+from Codec import codec
 from Logger import logger
 
 
@@ -22,6 +23,9 @@ class ApiBuilder:
     def __init__(self):
         self.modules = dict()
         self.apis = dict()
+        # 每个交易所第一个创建的 api， 后面的账户共用它的行情 ws 和 K 线缓存
+        self.market_data_apis = dict()
+        self._lock = threading.RLock()
         self.config = Settings.configs.copy()
         self._initialize_config(self.config)
 
@@ -29,14 +33,45 @@ class ApiBuilder:
         self.exchange = self.config['exchange']
         self.symbol = self.config['symbol']
         self.keys_path = self.config['key_path']
+        # 交易所连接参数， 比如 rest_url 指向本地替身服务器: python -m Exchanges.Huobi.LocalServer
+        self.exchange_options = self._get_exchange_options(self.config)
+
+    @staticmethod
+    def _get_exchange_options(config):
+        keys = ('testnet', 'rest_url', 'market_ws_url', 'account_ws_url', 'http_pool_size', 'rate_limits', 'rate_limit_burst',
+                'cache_path', 'cache_ttl', 'kline_store_path', 'kline_store_sync_period',
+                'order_reconcile_period')
+        return {k: config[k] for k in keys if k in config}
 
     def get_api(self, exchange_name: str, symbol: str, key_path: str, name: str = "", **kwargs):
-        if key_path not in self.apis:
-            self.apis[key_path] = self._build_api(exchange_name.lower(), symbol, key_path, name=name, **kwargs)
-        return self.apis[key_path]
+        """
+        按账户（exchange, key_path）缓存， 同一账户的所有交易对共用一个 api： http 连接池、 symbol details、 私有 ws 和限频额度。
+        symbol 只是这个 api 的默认交易对。
+        """
+        exchange_name = exchange_name.lower()
+        key = (exchange_name, key_path)
+        with self._lock:
+            if key not in self.apis:
+                market_data_api = self.market_data_apis.get(exchange_name)
+                if not name and market_data_api:
+                    name = f"{exchange_name}_{os.path.splitext(os.path.basename(key_path))[0]}"
+                api = self._build_api(exchange_name, symbol, key_path, name=name, **kwargs)
+                if market_data_api:
+                    api.share_market_data(market_data_api)
+                else:
+                    self.market_data_apis[exchange_name] = api
+                self.apis[key] = api
+            return self.apis[key]
 
     def get_default_api(self, **kwargs):
-        return self.get_api(self.exchange, self.symbol, self.keys_path, **kwargs)
+        return self.get_api(self.exchange, self.symbol, self.keys_path, **dict(self.exchange_options, **kwargs))
+
+    def get_config_api(self, config: dict):
+        """
+        策略配置对应的 api， 配置中没有的项（exchange, key_path 等）用全局配置
+        """
+        config = dict(self.config, **config)
+        return self.get_api(config['exchange'], config['symbol'], config['key_path'], **self._get_exchange_options(config))
 
     def _build_api(self, exchange_name: str, symbol: str, key_path: str, name: str = "", **kwargs):
         if exchange_name not in self.modules:
@@ -49,8 +84,8 @@ class ApiBuilder:
 
     def _read_key_file(self, key_path):
         if key_path and os.path.exists(key_path):
-            with open(key_path) as f:
-                keys = json.load(f)
+            with open(key_path, 'rb') as f:
+                keys = codec.loads(f.read())
             return keys
         raise FileNotFoundError(f'({self.__class__.__name__}) {key_path} file not found')
 
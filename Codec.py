@@ -0,0 +1,102 @@
+"""
+JSON 编解码： 装了 msgspec / orjson 就用， 都没装用标准库 json， 可以用配置 json_codec 指定。
+所有 codec 的接口相同：
+    loads(data)            bytes 或 str， 直接从响应的 bytes 解码， 不用先转成 str
+    dumps(obj) -> bytes    紧凑格式， 可以直接作为 POST body / ws 消息发送
+    decoder(schema)        返回 bytes -> 对象 的函数； 只有 msgspec 会按 schema（msgspec.Struct）解码成紧凑结构，
+                           其他 codec 忽略 schema， 解码成 dict / list
+"""
+import json
+
+import Settings
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import msgspec
+except ImportError:
+    msgspec = None
+
+
+class JsonCodec(object):
+    name = 'json'
+
+    @staticmethod
+    def loads(data):
+        return json.loads(data)
+
+    @staticmethod
+    def dumps(obj):
+        return json.dumps(obj, separators=(',', ':'), ensure_ascii=False).encode('utf-8')
+
+    def decoder(self, schema=None):
+        return self.loads
+
+
+class OrjsonCodec(JsonCodec):
+    name = 'orjson'
+
+    @staticmethod
+    def loads(data):
+        return orjson.loads(data)
+
+    @staticmethod
+    def dumps(obj):
+        return orjson.dumps(obj)
+
+
+class MsgspecCodec(JsonCodec):
+    name = 'msgspec'
+
+    def __init__(self):
+        self._encoder = msgspec.json.Encoder()
+        self._decoder = msgspec.json.Decoder()
+        self._decoders = dict()
+
+    def loads(self, data):
+        return self._decoder.decode(data)
+
+    def dumps(self, obj):
+        return self._encoder.encode(obj)
+
+    def decoder(self, schema=None):
+        if schema is None: return self.loads
+        decoder = self._decoders.get(schema)
+        if decoder is None:
+            # strict=False: 交易所把数字放在字符串里返回， 按 schema 的类型转换
+            typed_decode = msgspec.json.Decoder(schema, strict=False).decode
+
+            def decoder(data):
+                # 返回结构和 schema 不一致（比如交易所改了字段类型）时退回普通解码
+                try:
+                    return typed_decode(data)
+                except msgspec.ValidationError:
+                    return self.loads(data)
+
+            self._decoders[schema] = decoder
+        return decoder
+
+
+CODECS = {
+    'msgspec': (MsgspecCodec, msgspec),
+    'orjson': (OrjsonCodec, orjson),
+    'json': (JsonCodec, json),
+}
+
+
+def get_codec(name=None):
+    """
+    name: msgspec / orjson / json， 为空或 auto 时按这个顺序选第一个已安装的
+    """
+    if name and name != 'auto':
+        cls, module = CODECS[name]
+        if module is None: raise ImportError(f"json codec {name} is not installed")
+        return cls()
+    for cls, module in CODECS.values():
+        if module is not None: return cls()
+
+
+codec = get_codec(Settings.configs.get('json_codec', 'auto'))
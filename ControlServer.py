@@ -0,0 +1,84 @@
+import json
+import os
+import socket
+import socketserver
+import sys
+import threading
+import traceback
+
+from Logger import logger
+
+
+def _to_json(value):
+    # Order / Balance 等记录转成 dict， 其他不能序列化的转成字符串
+    return value.to_dict() if hasattr(value, 'to_dict') else str(value)
+
+
+class ControlHandler(socketserver.StreamRequestHandler):
+    server: 'ControlServer'
+
+    def handle(self):
+        # 每行一条命令， 每条命令回一行 json
+        for line in self.rfile:
+            commands = line.decode('utf-8').split()
+            if not commands: continue
+            try:
+                result = {'status': 'ok', 'data': self.server.callback(commands)}
+            except Exception as e:
+                logger.info(f"(ControlServer) command {commands} error: {traceback.format_exc()}")
+                result = {'status': 'error', 'err-msg': str(e)}
+            self.wfile.write(json.dumps(result, default=_to_json).encode('utf-8') + b'\n')
+            self.wfile.flush()
+
+
+class ControlServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    """
+    Unix domain socket 控制通道， 收到命令立即在连接线程里执行， 不经过轮询。
+    callback(commands: list) -> 可 json 序列化的结果， 抛出异常时返回 {'status': 'error'}
+
+        python ControlServer.py status
+        echo "set spread_rate 0.002" | socat - UNIX-CONNECT:./Command.sock
+    """
+    daemon_threads = True
+
+    def __init__(self, path, callback):
+        if os.path.exists(path): os.remove(path)
+        super().__init__(path, ControlHandler)
+        os.chmod(path, 0o600)
+        self.path = path
+        self.callback = callback
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self.serve_forever)
+        self._thread.daemon = True
+        self._thread.start()
+        logger.info(f"(ControlServer) listening on {self.path}")
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+        if os.path.exists(self.path): os.remove(self.path)
+        logger.info("(ControlServer) stopped")
+
+
+def is_supported():
+    return hasattr(socket, 'AF_UNIX')
+
+
+def send_command(path, command, timeout=10):
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        sock.settimeout(timeout)
+        sock.connect(path)
+        sock.sendall(command.strip().encode('utf-8') + b'\n')
+        with sock.makefile('rb') as f:
+            return json.loads(f.readline())
+
+
+if __name__ == '__main__':
+    import Settings
+
+    if len(sys.argv) < 2:
+        print("usage: python ControlServer.py <exit|stop|pause|resume|status|cancel_all|set <param> <value>>")
+        sys.exit(1)
+    print(json.dumps(send_command(Settings.configs.get('control_socket_path', './Command.sock'), ' '.join(sys.argv[1:])), indent=2))
@@ -1,9 +1,9 @@
 import threading
 import time
-import traceback
-import pandas as pd
+from collections import deque, Counter
 
 from Logger import logger
+from Worker import Worker
 
 
 def single(cls):
@@ -18,23 +18,48 @@ def single(cls):
 
 
 class ErrorManager(object):
+    """
+    滑动窗口错误计数： 错误按时间顺序进入 deque， 过期的从队头弹出，
+    add 为 O(1)， 过期清理均摊 O(1)， 同时维护按 exchange 和 (exchange, info) 的计数。
+    """
+
     def __init__(self, error_limit, error_expired):
         self.error_limit = error_limit
         self.error_expired = error_expired
-        self.error_info_df = pd.DataFrame(columns=['time', 'exchange', 'info'])
+        self.error_infos = deque()
+        self.exchange_counter = Counter()
+        self.info_counter = Counter()
+        self._lock = threading.Lock()
 
     def add_error_info(self, exchange, info):
-        self.error_info_df.loc[self.error_info_df.shape[0]] = [time.time(), exchange, info]
+        with self._lock:
+            self.error_infos.append((time.time(), exchange, info))
+            self.exchange_counter[exchange] += 1
+            self.info_counter[(exchange, info)] += 1
 
     def delete_expired_error_info(self):
         expired_time = time.time() - self.error_expired
-        self.error_info_df = self.error_info_df.loc[self.error_info_df['time'] > expired_time].reset_index(drop=True)
+        with self._lock:
+            while self.error_infos and self.error_infos[0][0] <= expired_time:
+                _, exchange, info = self.error_infos.popleft()
+                self._decrease(self.exchange_counter, exchange)
+                self._decrease(self.info_counter, (exchange, info))
+
+    @staticmethod
+    def _decrease(counter, key):
+        counter[key] -= 1
+        if counter[key] <= 0: del counter[key]
+
+    def count(self, exchange=None, info=None):
+        if exchange is None: return len(self.error_infos)
+        if info is None: return self.exchange_counter.get(exchange, 0)
+        return self.info_counter.get((exchange, info), 0)
 
     def is_error_exceeds_limit(self):
-        return self.error_info_df['info'].count() > self.error_limit
+        return len(self.error_infos) > self.error_limit
 
     def status(self):
-        error_total_count = self.error_info_df['info'].count()
+        error_total_count = len(self.error_infos)
         status_info = f"error_total_count: {error_total_count}, error_limit: {self.error_limit}, error_expired: {self.error_expired}"
         return status_info
 
@@ -44,8 +69,9 @@ class ExchangeFailureManager(object):
     def __init__(self):
         self.command_file = './Command.txt'
 
-        self.thread = threading.Thread(target=self.on_timer)
-        self.thread.daemon = True
+        self.worker = None
+        # TradeSystem 注册的命令处理函数， 有则直接在进程内执行， 没有才写 Command.txt
+        self.command_handler = None
         self.working = False
 
         self.request_error = ErrorManager(60, 60)
@@ -64,26 +90,27 @@ class ExchangeFailureManager(object):
         else:
             logger.info('Unsupported type: {}, The types of support are: {}'.format(error_type, list(self.error_type_map.keys())))
 
-    def on_timer(self):
-        while self.working:
-            try:
-                self.process_failure()
-                time.sleep(1)
-            except Exception as e:
-                s = traceback.format_exc()
-                logger.info('(ExchangeFailureManager) process_failure error: {}'.format(s))
-                time.sleep(10)
-
     def process_failure(self):
         for error_type, error_manager in self.error_type_map.items():
             error_manager.delete_expired_error_info()
             if error_manager.is_error_exceeds_limit():
                 warning_info = '(ExchangeFailureManager) {} error status: {}'.format(error_type, error_manager.status())
                 logger.warning(warning_info)
-                self.write_command('exit')
                 self.stop()
+                self.send_command('exit')
                 break
 
+    def set_command_handler(self, handler):
+        self.command_handler = handler
+
+    def send_command(self, command):
+        handler = self.command_handler
+        if handler is None:
+            self.write_command(command)
+            return
+        logger.info('(ExchangeFailureManager) send command: {}'.format(command))
+        handler(command.split())
+
     def write_command(self, command):
         logger.info('(ExchangeFailureManager) write command: {} to {}'.format(command, self.command_file))
         with open(self.command_file, 'w') as f:
@@ -91,11 +118,14 @@ class ExchangeFailureManager(object):
 
     def start(self):
         self.working = True
-        self.thread.start()
+        if self.worker is None:
+            self.worker = Worker(name='ExchangeFailureManager', callback=self.process_failure, period=1)
+        self.worker.start()
         logger.info("Started exchange failure manager ")
 
     def stop(self):
         self.working = False
+        if self.worker: self.worker.stop()
         logger.info("Stopped exchange failure manager ")
 
 
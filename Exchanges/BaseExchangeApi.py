@@ -1,12 +1,63 @@
+import asyncio
+import functools
+import itertools
+import threading
 import time
+import numpy as np
 import pandas as pd
 from abc import abstractmethod, ABCMeta
 
 from Logger import logger
-from .BaseRest import BaseRest
+from Worker import Worker
+from .BaseRest import BaseRest, BaseAsyncRest
+from .BaseWs import BaseWs
+from .KlineCache import KlineCache
+from .KlineStore import KlineStore
+from .LocalAccount import LocalAccount
+from .OrderBook import OrderBook
+from .OrderManager import OrderManager
+
+
+class SymbolDetails(dict):
+    """
+    格式化后的交易对信息， 第一次用到某个交易对时才格式化， 没用到的交易对只保留原始数据。
+    key: 从原始数据里取交易对名
+    """
+
+    def __init__(self, raw_details, formatter, key=lambda detail: detail['symbol'].upper()):
+        super().__init__()
+        self._formatter = formatter
+        self._key = key
+        self._raw = dict()
+        self.load(raw_details)
+
+    def load(self, raw_details):
+        # 交易对信息刷新后， 已经格式化过的交易对按新数据重新格式化
+        raw = {self._key(detail): detail for detail in raw_details or ()}
+        formatted = {symbol: self._formatter(raw[symbol]) for symbol in list(self) if symbol in raw}
+        self._raw = raw
+        self.update(formatted)
+
+    def __missing__(self, symbol):
+        detail = self._formatter(self._raw[symbol])
+        self[symbol] = detail
+        return detail
+
+    def __contains__(self, symbol):
+        return symbol in self._raw or super().__contains__(symbol)
+
+    def __bool__(self):
+        return bool(self._raw) or super().__len__() > 0
+
+    def get(self, symbol, default=None):
+        return self[symbol] if symbol in self else default
 
 
 class BaseExchangeApi(metaclass=ABCMeta):
+    # 可以存入本地 K 线库的周期 {period: 秒}， 长度不固定的周期（月、 年）不存
+    kline_periods = dict()
+    _client_order_ids = itertools.count()
+
     def __init__(self, key=None, secret=None, name=None, symbol=None, **kwargs):
         self.name = name
         self.symbol_details = None
@@ -15,14 +66,39 @@ class BaseExchangeApi(metaclass=ABCMeta):
 
         self.symbol = symbol
         self.rest: BaseRest = None
+        self.async_rest: BaseAsyncRest = None
+        self.market_ws: BaseWs = None
+        self.account_ws: BaseWs = None
+        self.kline_caches = dict()
+        # 本地 K 线库， kline_store_path 为空时不存， get_kline / get_ma 每次都从 REST 全量拉取
+        self.kline_stores = dict()
+        self.kline_store_path = kwargs.get('kline_store_path', './Cache/Klines')
+        self.kline_store_sync_period = kwargs.get('kline_store_sync_period', 60)
+        self.worker_kline_store = None
+        self._kline_store_lock = threading.Lock()
+        self.local_account = LocalAccount()
+        # 本地下单记录， 没有私有 ws 时活跃订单也不用每轮查询
+        self.order_manager = OrderManager(reconcile_period=kwargs.get('order_reconcile_period', 30), name=name)
+        self.worker_reconcile = None
+
+        self._account_symbols = set()
+        self._order_listeners = list()
+        self._loop = None
+        self._loop_lock = threading.Lock()
 
     def _initialize(self):
-        self.symbol_details = self.format_symbol_details(self.rest.get_symbol_details())
+        self.symbol_details = SymbolDetails(self.rest.symbol_details, self.format_symbol_detail)
         if not self.symbol_details: raise Exception(f"({self.name}) get_symbol_details failed")
+        self.rest.symbol_details_listeners.append(self.symbol_details.load)
 
     @staticmethod
     def generate_client_order_id(side):
-        return f"{side}_{int(time.time()*1000)}"
+        # 批量下单时同一毫秒内有多个单， 加序号区分
+        return f"{side}_{int(time.time()*1000)}_{next(BaseExchangeApi._client_order_ids) % 1000}"
+
+    def now(self):
+        # 当前时间 ms， 本地下单的 created_at 用它， 和 created_at 比较时也用它， 保证是同一个时钟
+        return time.time() * 1000
 
     def dict_value_to_float(self, data: dict):
         return {k: self.value_to_float(v) for k, v in data.items()}
@@ -53,9 +129,14 @@ class BaseExchangeApi(metaclass=ABCMeta):
         """
         pass
 
+    def format_symbol_detail(self, detail) -> dict:
+        # 单个交易对， 格式同 format_symbol_details 中的一项
+        return next(iter(self.format_symbol_details([detail]).values()))
+
     @abstractmethod
     def format_ticker(self, ticker) -> dict:
         """
+        可以返回 Records.Ticker， 字段相同， 兼容 dict 访问
         {
             'ask_price': float(tick['ask'][0]),
             'bid_price': float(tick['bid'][0]),
@@ -66,6 +147,20 @@ class BaseExchangeApi(metaclass=ABCMeta):
         }
         """
 
+    @abstractmethod
+    def format_depth(self, depth) -> dict:
+        """
+        REST 深度快照
+        :return:
+            {'bids': [[price, size], ...], 'asks': [[price, size], ...]}
+        """
+
+    @abstractmethod
+    def format_ws_ticker(self, ticker) -> dict:
+        """
+        ws 推送的 ticker， 返回格式同 format_ticker
+        """
+
     @abstractmethod
     def format_kline(self, data) -> pd.DataFrame:
         """
@@ -74,9 +169,24 @@ class BaseExchangeApi(metaclass=ABCMeta):
             columns: ['timestamp', 'open', 'high', 'low', 'close', 'volume']  # timestamp 单位 秒。
         """
 
+    @abstractmethod
+    def format_kline_bar(self, bar) -> dict:
+        """
+        :return:
+            {
+                'timestamp': 1609459200,  # 秒
+                'open': 1.0,
+                'high': 1.0,
+                'low': 1.0,
+                'close': 1.0,
+                'volume': 1.0
+            }
+        """
+
     @abstractmethod
     def format_balance(self, balance) -> dict:
         """
+        单个币种可以是 Records.Balance
         :return:
              {
                 'btc': {
@@ -91,6 +201,7 @@ class BaseExchangeApi(metaclass=ABCMeta):
     @abstractmethod
     def format_order(self, order) -> dict:
         """
+        可以返回 Records.Order， 字段相同， 兼容 dict 访问
         :return:
             {
             'symbol': symbol,
@@ -112,6 +223,25 @@ class BaseExchangeApi(metaclass=ABCMeta):
     def format_active_orders(self, orders) -> list:
         pass
 
+    @abstractmethod
+    def format_ws_order(self, order) -> dict:
+        """
+        私有 ws 推送的订单， 返回格式同 format_order
+        """
+
+    @abstractmethod
+    def format_ws_balance(self, balance) -> dict:
+        """
+        私有 ws 推送的单个币种余额， 返回格式同 format_balance 中的单个币种
+        """
+
+    def format_placed_order(self, res, symbol, side, size, order_type, price, client_order_id=None) -> dict:
+        """
+        用下单请求和下单接口返回结果直接构造订单， 省掉下单后的 get_order， 返回格式同 format_order。
+        可选， 子类没有实现时 _can_format_placed_order 为 False， 下单结果走 format_active_place_order_res
+        """
+        return None
+
     @abstractmethod
     def format_active_place_order_res(self, res) -> dict:
         """
@@ -137,10 +267,160 @@ class BaseExchangeApi(metaclass=ABCMeta):
     def format_cancel_all_res(self, res):
         return res
 
+    @abstractmethod
+    def format_place_orders_res(self, res, orders) -> list:
+        """
+        :param orders: 本批次的下单请求
+        :return: 与 orders 一一对应的订单（格式同 format_order）， 下单失败的位置为 None
+        """
+
+    @abstractmethod
+    def format_cancel_orders_res(self, res) -> dict:
+        """
+        :return: {order_id: True / False}  # 撤单请求是否被交易所接受
+        """
+
+    def subscribe_market_data(self, symbol, kline_periods=()):
+        if not self.market_ws: return False
+        self.market_ws.subscribe_ticker(symbol)
+        for period in kline_periods:
+            self.market_ws.subscribe_kline(symbol, period)
+        self.market_ws.start()
+        return True
+
+    def on_market_ws_kline(self, symbol, period, bar):
+        caches = list(self.kline_caches.get((symbol.upper(), period.lower()), dict()).values())
+        if not caches: return
+        bar = self.format_kline_bar(bar)
+        for cache in caches:
+            cache.push(bar)
+
+    def on_market_ws_connected(self):
+        # 断线期间丢失的推送无法补齐， 清空缓存， 下一次 get_ma 通过 REST 重新预热
+        for caches in list(self.kline_caches.values()):
+            for cache in list(caches.values()):
+                cache.invalidate()
+
+    def share_market_data(self, api):
+        """
+        同一交易所的多个账户共用一个行情 ws 和 K 线缓存， 每个交易对只订阅、 缓存一份
+        """
+        self.market_ws = api.market_ws
+        self.kline_caches = api.kline_caches
+        self.kline_stores = api.kline_stores
+
+    def subscribe_account_data(self, symbol, on_order=None, reconcile_period=30):
+        """
+        on_order: callback(order)， 私有 ws 每次推送订单变化时调用
+        reconcile_period: 用 REST 校正本地订单和余额的周期（秒）
+        """
+        if not self.account_ws: return False
+        self._account_symbols.add(symbol.upper())
+        if on_order and on_order not in self._order_listeners: self._order_listeners.append(on_order)
+        self.account_ws.subscribe_orders(symbol)
+        if self.worker_reconcile is None:
+            self.worker_reconcile = Worker(name=f"{self.name}_reconcile", callback=self.reconcile_account, period=reconcile_period)
+            self.worker_reconcile.start()
+        self.account_ws.start()
+        return True
+
+    def on_account_ws_connected(self):
+        # 断线期间的推送已丢失， 本地状态在下一次 REST 校正前不可用
+        self.local_account.invalidate()
+        if self.worker_reconcile: self.worker_reconcile.wake()
+
+    def on_account_ws_order(self, data):
+        order = self.format_ws_order(data)
+        self.local_account.update_order(order)
+        self.order_manager.update(order)
+        for listener in self._order_listeners:
+            listener(order)
+
+    def on_account_ws_balance(self, data):
+        self.local_account.update_balance(self.format_ws_balance(data))
+
+    def reconcile_account(self):
+        since = time.time()
+        balances = self.rest.get_balances()
+        if balances is not None:
+            drift = self.local_account.reset_balances(self.format_balance(balances), since)
+            if drift: logger.info(f"({self.name}) reconcile balances drift: {drift}")
+        for symbol in list(self._account_symbols):
+            since = time.time()
+            orders = self.rest.get_active_orders(symbol=symbol)
+            if orders is None: continue
+            orders = self.format_active_orders(orders)
+            self.order_manager.reset(symbol, orders, since)
+            drift = self.local_account.reset_orders(symbol, orders, since)
+            if drift: logger.info(f"({self.name}) reconcile {symbol} orders drift: {drift}")
+
+    def _is_account_ws_ready(self, symbol=None):
+        return self.account_ws is not None and self.account_ws.is_fresh() and self.local_account.is_synced(symbol)
+
+    def is_order_state_synced(self, symbol):
+        """
+        本地的活跃订单是否可信， False 时 get_active_orders 会查询交易所
+        """
+        return self._is_account_ws_ready(symbol) or self.order_manager.is_synced(symbol)
+
+    def _is_market_ws_kline_fresh(self, symbol, period):
+        return self.market_ws is not None and self.market_ws.is_kline_fresh(symbol, period)
+
+    def _get_ws_ticker(self, symbol):
+        ticker = self.market_ws.get_ticker(symbol) if self.market_ws else None
+        return self.format_ws_ticker(ticker) if ticker else None
+
     def get_ticker(self, symbol):
-        return self.format_ticker(self.rest.get_ticker(symbol.upper()))
+        return self._get_ws_ticker(symbol) or self.format_ticker(self.rest.get_ticker(symbol.upper()))
+
+    def subscribe_order_book(self, symbol, levels=150):
+        if not self.market_ws: return False
+        self.market_ws.subscribe_order_book(symbol, levels)
+        self.market_ws.start()
+        return True
+
+    def _get_ws_order_book(self, symbol):
+        return self.market_ws.get_order_book(symbol) if self.market_ws else None
+
+    def _build_order_book(self, symbol, depth, size):
+        if not depth: raise Exception(f"({self.name}) get_depth({symbol}, {size}) failed")
+        book = OrderBook(symbol, levels=size, name=self.name)
+        book.apply_snapshot(**self.format_depth(depth))
+        return book
+
+    def get_order_book(self, symbol, size=20):
+        """
+        订阅了增量深度且已同步时返回本地订单簿， 否则用 REST 快照临时建一个（每次调用一次请求），
+        需要多个指标时取一次订单簿再分别计算
+        """
+        return self._get_ws_order_book(symbol) or self._build_order_book(symbol, self.rest.get_depth(symbol, size), size)
+
+    def get_best_bid(self, symbol):
+        """
+        (price, size)
+        """
+        return self.get_order_book(symbol, 5).best_bid()
+
+    def get_best_ask(self, symbol):
+        return self.get_order_book(symbol, 5).best_ask()
+
+    def get_depth(self, symbol, size=20):
+        """
+        {'bids': [(price, size), ...], 'asks': [(price, size), ...]}， 从最优价开始各 size 档
+        """
+        return self.get_order_book(symbol, size).depth(size)
+
+    def get_microprice(self, symbol):
+        return self.get_order_book(symbol, 5).microprice()
 
     def get_kline(self, symbol, period, size):
+        caches = [cache for cache in list(self.kline_caches.get((symbol.upper(), period.lower()), dict()).values()) if len(cache.bars) >= size]
+        if caches and self._is_market_ws_kline_fresh(symbol, period):
+            return pd.DataFrame(caches[0].window(size))
+        store = self.get_kline_store(symbol, period)
+        if store is not None:
+            columns = self._read_kline_store(store, self.get_latest_kline_bars(symbol, period, store), size)
+            if columns is not None: return pd.DataFrame(columns)
         return self.format_kline(self.rest.get_kline(symbol=symbol, period=period, size=size))
 
     def check_order_size(self, symbol, size, price):
@@ -154,7 +434,7 @@ class BaseExchangeApi(metaclass=ABCMeta):
         #     return False
         return size >= min_limit_order_size and size * price >= min_order_value
 
-    def place_order(self, symbol, side, size, order_type, price=None, client_order_id=None, time_in_force=None, post_only=False):
+    def _format_order_request(self, symbol, side, size, price):
         symbol = symbol.upper()
         size_precision = self.get_size_precision(symbol)
         tick_size = self.get_tick_size(symbol)
@@ -164,6 +444,31 @@ class BaseExchangeApi(metaclass=ABCMeta):
         size = int(size * 10**size_precision) / 10**size_precision
         price = price - tick_size if side == 'buy' else price + tick_size
         price = round(round(price/tick_size)*tick_size, self.get_price_precision(symbol))
+        return symbol, size, price
+
+    def _can_format_placed_order(self, order_type):
+        # 市价单下单后立即成交， 状态只能查询
+        return order_type == 'limit' and type(self).format_placed_order is not BaseExchangeApi.format_placed_order
+
+    def _add_placed_order(self, order):
+        # 私有 ws 的成交 / 撤单推送可能比下单请求先返回， 这样的单不再作为活跃订单加入， 返回给调用方的状态也改为 closed
+        added = self.order_manager.add(order)
+        if self._is_account_ws_ready(order['symbol']): added = self.local_account.add_order(order) and added
+        if not added: order['status'] = 'closed'
+
+    def _on_order_placed(self, res, symbol, side, size, order_type, price, client_order_id=None):
+        if res and self._can_format_placed_order(order_type):
+            order = self.format_placed_order(res, symbol, side, size, order_type, price, client_order_id=client_order_id)
+        else:
+            order = self.format_active_place_order_res(res)
+        if order: self._add_placed_order(order)
+        return order
+
+    def place_order(self, symbol, side, size, order_type, price=None, client_order_id=None, time_in_force=None, post_only=False):
+        request = self._format_order_request(symbol, side, size, price)
+        if not request: return
+        symbol, size, price = request
+        client_order_id = client_order_id or self.generate_client_order_id(side)
 
         res = self.rest.place_order(
             symbol=symbol,
@@ -175,27 +480,305 @@ class BaseExchangeApi(metaclass=ABCMeta):
             time_in_force=time_in_force,
             post_only=post_only
         )
-        return self.format_active_place_order_res(res)
+        return self._on_order_placed(res, symbol, side, size, order_type, price, client_order_id=client_order_id)
+
+    @staticmethod
+    def _split(items, size):
+        return [items[i:i + size] for i in range(0, len(items), size)]
+
+    def _format_order_requests(self, orders):
+        requests = list()
+        for index, order in enumerate(orders):
+            request = self._format_order_request(order['symbol'], order['side'], order['size'], order.get('price'))
+            if not request: continue
+            symbol, size, price = request
+            requests.append((index, dict(symbol=symbol,
+                                         side=order['side'],
+                                         size=size,
+                                         order_type=order['order_type'],
+                                         price=price,
+                                         client_order_id=order.get('client_order_id') or self.generate_client_order_id(order['side']),
+                                         post_only=order.get('post_only', False))))
+        return requests
+
+    def _on_orders_placed(self, res, batch, results):
+        orders = self.format_place_orders_res(res, [request for _, request in batch]) if res else [None] * len(batch)
+        for (index, _), order in zip(batch, orders):
+            results[index] = order
+            if order: self._add_placed_order(order)
+
+    def place_orders(self, orders):
+        """
+        批量下单， 超过 rest.batch_place_order_limit 的自动拆分成多次请求。
+        :param orders: [dict(symbol, side, size, order_type, price, client_order_id=None, post_only=False), ...]
+        :return: 与 orders 一一对应的订单， 未通过检查或下单失败的位置为 None
+        """
+        results = [None] * len(orders)
+        for batch in self._split(self._format_order_requests(orders), self.rest.batch_place_order_limit):
+            self._on_orders_placed(self.rest.place_orders([request for _, request in batch]), batch, results)
+        return results
+
+    def cancel_orders(self, order_ids, symbol=None):
+        """
+        批量撤单， 超过 rest.batch_cancel_order_limit 的自动拆分成多次请求。
+        :return: {order_id: True / False}
+        """
+        results = dict()
+        for batch in self._split(list(order_ids), self.rest.batch_cancel_order_limit):
+            res = self.rest.cancel_orders(batch, symbol=symbol)
+            results.update(self.format_cancel_orders_res(res) if res else dict.fromkeys(batch, False))
+        self.order_manager.on_cancelled(results, symbol)
+        return results
+
+    def _resolve_order_id(self, order_id, client_order_id):
+        # 交易所只能按 order_id 查询 / 撤单时， 用本地记录找 client_order_id 对应的 order_id
+        if order_id is None and client_order_id:
+            order = self.order_manager.get_order(client_order_id=client_order_id)
+            if order: return order['order_id']
+        return order_id
 
     def get_order(self, order_id=None, client_order_id=None, symbol=None):
         assert any([order_id, client_order_id]), "One and only one of client_order_id and order_id must be provided"
-        return self.format_order(self.rest.get_order(order_id=order_id, client_order_id=client_order_id, symbol=symbol))
+        order_id = self._resolve_order_id(order_id, client_order_id)
+        order = self.format_order(self.rest.get_order(order_id=order_id, client_order_id=client_order_id, symbol=symbol))
+        self.order_manager.update(order)
+        return order
+
+    def _on_balances(self, balances):
+        # 冻结余额和本地挂单对不上时， 下一次 get_active_orders 查询交易所
+        self.order_manager.check_frozen(balances, self.symbol_details)
+        return balances
 
     def get_balances(self):
-        return self.format_balance(self.rest.get_balances())
+        if self._is_account_ws_ready(): return self.local_account.get_balances()
+        return self._on_balances(self.format_balance(self.rest.get_balances()))
+
+    def _on_active_orders(self, symbol, orders, since):
+        drift = self.order_manager.reset(symbol, orders, since)
+        if drift: logger.info(f"({self.name}) {symbol} local orders drift: {drift}")
+        return orders
 
     def get_active_orders(self, symbol):
-        return self.format_active_orders(self.rest.get_active_orders(symbol=symbol))
+        if self._is_account_ws_ready(symbol): return self.local_account.get_active_orders(symbol)
+        if self.order_manager.is_synced(symbol): return self.order_manager.get_active_orders(symbol)
+        since = time.time()
+        return self._on_active_orders(symbol, self.format_active_orders(self.rest.get_active_orders(symbol=symbol)), since)
 
     def cancel_all(self, symbol):
-        return self.format_cancel_all_res(self.rest.cancel_all(symbol=symbol))
+        res = self.rest.cancel_all(symbol=symbol)
+        self.order_manager.clear(symbol)
+        return self.format_cancel_all_res(res)
 
     def cancel_order(self, order_id=None, client_order_id=None, symbol=None):
-        return self.format_cancel_order_res(
-            self.rest.cancel_order(order_id=order_id, client_order_id=client_order_id, symbol=symbol))
+        order_id = self._resolve_order_id(order_id, client_order_id)
+        res = self.rest.cancel_order(order_id=order_id, client_order_id=client_order_id, symbol=symbol)
+        if order_id is not None: self.order_manager.on_cancelled({order_id: bool(res)}, symbol)
+        return self.format_cancel_order_res(res)
+
+    def fetch_kline_bars(self, symbol, period, size):
+        data = self.rest.get_kline(symbol=symbol, period=period, size=size)
+        if not data: raise Exception(f"({self.name}) get_kline({symbol}, {period}, {size}) failed")
+        return [self.format_kline_bar(bar) for bar in data]
+
+    def get_kline_bars(self, symbol, period, size):
+        # 有本地 K 线库时只拉取库里缺的几根， 其余从磁盘读
+        store = self.get_kline_store(symbol, period)
+        if store is not None:
+            columns = self._read_kline_store(store, self.get_latest_kline_bars(symbol, period, store), size)
+            if columns is not None: return KlineStore.to_bars(columns)
+        return self.fetch_kline_bars(symbol, period, size)
+
+    def get_kline_store(self, symbol, period):
+        period = period.lower()
+        if not self.kline_store_path or period not in self.kline_periods: return None
+        key = (symbol.upper(), period)
+        store = self.kline_stores.get(key)
+        if store is None:
+            with self._kline_store_lock:
+                if key not in self.kline_stores:
+                    # 共用行情数据的账户共用一个 kline_stores， 只有第一个库启动同步任务
+                    if not self.kline_stores: self._start_kline_store_worker()
+                    self.kline_stores[key] = KlineStore(self.kline_store_path, self.rest._get_cache_key(f"{key[0]}_{period}"),
+                                                        self.kline_periods[period])
+                store = self.kline_stores[key]
+        return store
+
+    def _start_kline_store_worker(self):
+        self.worker_kline_store = Worker(name=f"{self.name}_kline_store", callback=self.sync_kline_stores,
+                                         period=self.kline_store_sync_period)
+        self.worker_kline_store.start()
+
+    def sync_kline_stores(self):
+        """
+        后台任务： 把每个 K 线库补齐到最新， 启动时补上停机期间的缺口
+        """
+        for (symbol, period), store in list(self.kline_stores.items()):
+            try:
+                store.update(self.get_latest_kline_bars(symbol, period, store))
+            except Exception as e:
+                logger.info(f"({self.name}) sync kline store {symbol} {period} error: {e}")
+
+    def get_latest_kline_bars(self, symbol, period, store):
+        return self.fetch_kline_bars(symbol, period, store.fetch_size(time.time(), self.rest.kline_size_limit))
+
+    @staticmethod
+    def _read_kline_store(store, latest, size):
+        """
+        latest: 刚拉取的最新几根， 已收盘的追加到库里， 最新的一根（未收盘）接在库里最近 size - 1 根后面；
+        库里不够或有缺口时返回 None
+        """
+        store.update(latest)
+        current = max(latest, key=lambda bar: bar['timestamp'])
+        window = store.window(size - 1)
+        if window is None: return None
+        timestamps = window['timestamp']
+        if len(timestamps) and timestamps[-1] + store.seconds != current['timestamp']: return None
+        return {field: np.append(window[field], current[field]) for field in KlineStore.fields}
+
+    def get_kline_cache(self, symbol, period, size):
+        # 多个策略可能对同一个交易对用不同的 MA 长度， 每个长度一个缓存， 互不 resize
+        key = (symbol.upper(), period.lower())
+        caches = self.kline_caches.setdefault(key, dict())
+        if size not in caches:
+            caches.setdefault(size, KlineCache(symbol=key[0], period=key[1], size=size))
+        return caches[size]
 
     def get_ma(self, symbol, period, size, source='close'):
-        return self.get_kline(symbol=symbol, period=period, size=size)[source].mean()
+        cache = self.get_kline_cache(symbol, period, size)
+        if cache.warm and self._is_market_ws_kline_fresh(symbol, period):
+            return cache.mean(source)
+        if not cache.warm or not cache.update(self.get_kline_bars(symbol, period, cache.fetch_size())):
+            cache.reset(self.get_kline_bars(symbol, period, size))
+        return cache.mean(source)
+
+    def stop(self):
+        """
+        停止 ws 和后台任务， 退出前调用； 共用行情 ws 的账户重复 stop 没有影响
+        """
+        for ws in (self.market_ws, self.account_ws):
+            if ws: ws.stop()
+        for worker in (self.worker_reconcile, self.worker_kline_store):
+            if worker: worker.stop()
+        for worker in (self.worker_reconcile, self.worker_kline_store):
+            if worker: worker.join(timeout=5)
+        # aiohttp 的 session 要在创建它的事件循环里关闭， 然后停掉事件循环
+        with self._loop_lock:
+            loop, self._loop = self._loop, None
+        if loop:
+            if self.async_rest: asyncio.run_coroutine_threadsafe(self.async_rest.close(), loop).result(timeout=5)
+            loop.call_soon_threadsafe(loop.stop)
+        logger.info(f"({self.name}) api stopped")
+
+    def _get_loop(self):
+        with self._loop_lock:
+            if self._loop is None:
+                self._loop = asyncio.new_event_loop()
+                thread = threading.Thread(target=self._loop.run_forever, name=f"{self.name}_loop")
+                thread.daemon = True
+                thread.start()
+        return self._loop
+
+    def gather(self, *coros):
+        """
+        在 api 的事件循环中并发执行 coros， 阻塞到全部完成后按顺序返回结果；
+        单个请求失败时对应位置是异常对象， 不影响其他请求。
+        """
+        return asyncio.run_coroutine_threadsafe(self._gather(*coros), self._get_loop()).result()
+
+    @staticmethod
+    async def _gather(*coros):
+        return await asyncio.gather(*coros, return_exceptions=True)
+
+    async def _async_rest(self, method, **kwargs):
+        # 没有 async_rest 的交易所退化为在线程池中执行同步 rest
+        if self.async_rest: return await getattr(self.async_rest, method)(**kwargs)
+        return await asyncio.get_running_loop().run_in_executor(None, functools.partial(getattr(self.rest, method), **kwargs))
+
+    async def async_get_ticker(self, symbol):
+        return self._get_ws_ticker(symbol) or self.format_ticker(await self._async_rest('get_ticker', symbol=symbol.upper()))
+
+    async def async_get_order_book(self, symbol, size=20):
+        book = self._get_ws_order_book(symbol)
+        if book: return book
+        return self._build_order_book(symbol, await self._async_rest('get_depth', symbol=symbol, size=size), size)
+
+    async def async_place_order(self, symbol, side, size, order_type, price=None, client_order_id=None, time_in_force=None, post_only=False):
+        request = self._format_order_request(symbol, side, size, price)
+        if not request: return
+        symbol, size, price = request
+        client_order_id = client_order_id or self.generate_client_order_id(side)
+
+        res = await self._async_rest('place_order',
+                                     symbol=symbol,
+                                     side=side,
+                                     size=size,
+                                     order_type=order_type,
+                                     price=price,
+                                     client_order_id=client_order_id,
+                                     time_in_force=time_in_force,
+                                     post_only=post_only)
+        if res and not self._can_format_placed_order(order_type):
+            # format_active_place_order_res 可能是阻塞的 REST 调用
+            return await asyncio.get_running_loop().run_in_executor(None, functools.partial(
+                self._on_order_placed, res, symbol, side, size, order_type, price, client_order_id=client_order_id))
+        return self._on_order_placed(res, symbol, side, size, order_type, price, client_order_id=client_order_id)
+
+    async def async_get_balances(self):
+        if self._is_account_ws_ready(): return self.local_account.get_balances()
+        return self._on_balances(self.format_balance(await self._async_rest('get_balances')))
+
+    async def async_get_active_orders(self, symbol):
+        if self._is_account_ws_ready(symbol): return self.local_account.get_active_orders(symbol)
+        if self.order_manager.is_synced(symbol): return self.order_manager.get_active_orders(symbol)
+        since = time.time()
+        orders = self.format_active_orders(await self._async_rest('get_active_orders', symbol=symbol))
+        return self._on_active_orders(symbol, orders, since)
+
+    async def async_cancel_order(self, order_id=None, client_order_id=None, symbol=None):
+        order_id = self._resolve_order_id(order_id, client_order_id)
+        res = await self._async_rest('cancel_order', order_id=order_id, client_order_id=client_order_id, symbol=symbol)
+        if order_id is not None: self.order_manager.on_cancelled({order_id: bool(res)}, symbol)
+        return self.format_cancel_order_res(res)
+
+    async def async_place_orders(self, orders):
+        results = [None] * len(orders)
+        batches = self._split(self._format_order_requests(orders), self.rest.batch_place_order_limit)
+        responses = await asyncio.gather(*[self._async_rest('place_orders', orders=[request for _, request in batch])
+                                           for batch in batches])
+        for res, batch in zip(responses, batches):
+            self._on_orders_placed(res, batch, results)
+        return results
+
+    async def async_cancel_orders(self, order_ids, symbol=None):
+        results = dict()
+        batches = self._split(list(order_ids), self.rest.batch_cancel_order_limit)
+        responses = await asyncio.gather(*[self._async_rest('cancel_orders', order_ids=batch, symbol=symbol) for batch in batches])
+        for res, batch in zip(responses, batches):
+            results.update(self.format_cancel_orders_res(res) if res else dict.fromkeys(batch, False))
+        self.order_manager.on_cancelled(results, symbol)
+        return results
+
+    async def async_fetch_kline_bars(self, symbol, period, size):
+        data = await self._async_rest('get_kline', symbol=symbol, period=period, size=size)
+        if not data: raise Exception(f"({self.name}) get_kline({symbol}, {period}, {size}) failed")
+        return [self.format_kline_bar(bar) for bar in data]
+
+    async def async_get_kline_bars(self, symbol, period, size):
+        store = self.get_kline_store(symbol, period)
+        if store is not None:
+            latest = await self.async_fetch_kline_bars(symbol, period, store.fetch_size(time.time(), self.rest.kline_size_limit))
+            # 追加要拿文件的排他锁， 其他进程正在写时会阻塞， 放到线程池里， 不卡住事件循环上的其他请求
+            columns = await asyncio.get_running_loop().run_in_executor(None, self._read_kline_store, store, latest, size)
+            if columns is not None: return KlineStore.to_bars(columns)
+        return await self.async_fetch_kline_bars(symbol, period, size)
+
+    async def async_get_ma(self, symbol, period, size, source='close'):
+        cache = self.get_kline_cache(symbol, period, size)
+        if cache.warm and self._is_market_ws_kline_fresh(symbol, period):
+            return cache.mean(source)
+        if not cache.warm or not cache.update(await self.async_get_kline_bars(symbol, period, cache.fetch_size())):
+            cache.reset(await self.async_get_kline_bars(symbol, period, size))
+        return cache.mean(source)
 
     def get_price_precision(self, symbol) ->int:
         return self.symbol_details[symbol]['price_precision']
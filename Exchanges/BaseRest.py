@@ -1,8 +1,15 @@
+import threading
 import time
+import traceback
+from urllib import parse
 
+import aiohttp
 import requests
 from Logger import logger
+from Metrics import metrics
 from ExchangeFailureManager import exchange_failure_manager
+from Exchanges.DiskCache import DiskCache
+from Exchanges.RateLimiter import RateLimiter, PRIORITY_READ
 
 HTTP_TIMEOUT = 5
 
@@ -27,15 +34,39 @@ def catch_function_error_decorator(func):
     def wrapper(*args, **kwargs):
         name = kwargs['name'] if 'name' in kwargs else args[0].name
         func_name = func.__name__.title()
+        start_time = time.time()
         try:
-            start_time = time.time()
             res = func(*args, **kwargs)
             total_time = time.time() - start_time
+            metrics.observe('rest_latency_seconds', total_time, exchange=name, endpoint=func_name)
             logger.info('({})  {}({}, {}) success({})'.format(name, func_name, args[1:], kwargs.values(), total_time))
             return res
         except Exception as e:
+            metrics.observe('rest_latency_seconds', time.time() - start_time, exchange=name, endpoint=func_name)
+            metrics.inc('rest_errors_total', exchange=name, endpoint=func_name)
             # s = traceback.format_exc()
-            exchange_failure_manager.add_error_info(name)
+            exchange_failure_manager.add_error_info(name, info=func_name)
+            logger.info('({}) {}({}, {}) error: {}'.format(name, func_name, args[1:], kwargs, e))
+            return None
+
+    return wrapper
+
+
+def async_catch_function_error_decorator(func):
+    async def wrapper(*args, **kwargs):
+        name = kwargs['name'] if 'name' in kwargs else args[0].name
+        func_name = func.__name__.title()
+        start_time = time.time()
+        try:
+            res = await func(*args, **kwargs)
+            total_time = time.time() - start_time
+            metrics.observe('rest_latency_seconds', total_time, exchange=name, endpoint=func_name)
+            logger.info('({})  {}({}, {}) success({})'.format(name, func_name, args[1:], kwargs.values(), total_time))
+            return res
+        except Exception as e:
+            metrics.observe('rest_latency_seconds', time.time() - start_time, exchange=name, endpoint=func_name)
+            metrics.inc('rest_errors_total', exchange=name, endpoint=func_name)
+            exchange_failure_manager.add_error_info(name, info=func_name)
             logger.info('({}) {}({}, {}) error: {}'.format(name, func_name, args[1:], kwargs, e))
             return None
 
@@ -45,25 +76,103 @@ def catch_function_error_decorator(func):
 class BaseRest:
     test_url = ""
     real_url = ""
+    # 单次批量下单 / 撤单的最大订单数， 超过的由 BaseExchangeApi 自动拆分
+    batch_place_order_limit = 1
+    batch_cancel_order_limit = 1
+    # 单次 get_kline 最多返回的 K 线数
+    kline_size_limit = 1000
+    # 各接口组的限频 {group: (limit, window)}， 按交易所文档填写， 可以用配置 rate_limits 覆盖
+    rate_limits = dict()
 
     def __init__(self, key=None, secret=None, name=None, testnet=True, **kwargs):
         self._key = key
         self._secret = secret
         self._session = requests.session()
-        self.symbol_details = dict()
+        self.symbol_details = list()
+        # 交易对信息更新后的回调， BaseExchangeApi 用来刷新格式化的交易对信息
+        self.symbol_details_listeners = list()
         self.name = name
         self.testnet = testnet
-        self.url = self.test_url if self.testnet else self.real_url
+        # rest_url: 指向其他地址， 比如本地替身服务器 Exchanges/Huobi/LocalServer.py
+        self.url = kwargs.get('rest_url') or (self.test_url if self.testnet else self.real_url)
+        self.rate_limiter = RateLimiter({**self.rate_limits, **kwargs.get('rate_limits', dict())}, name=name,
+                                        burst=kwargs.get('rate_limit_burst', 0.1))
+
+        # 交易对信息和账户 id 缓存到磁盘， 崩溃重启时直接读文件， cache_path 为空时不缓存
+        self.cache = DiskCache(kwargs.get('cache_path', './Cache'))
+        self.cache_ttl = kwargs.get('cache_ttl', 3600)
 
-        self.symbol_details = self.get_symbol_details()
+        self.symbol_details = self.get_cached('symbol_details', self.get_symbol_details, self._on_symbol_details)
         logger.info(f"({self.name}) used url: {self.url} -->> testnet is {self.testnet}")
 
+    def _get_cache_key(self, name):
+        # 不同的交易所地址（正式 / 测试 / 本地替身）分开缓存
+        return f"{self.__class__.__module__}_{parse.urlparse(self.url).netloc}_{name}"
+
+    def get_cached(self, name, fetch, on_refresh=None):
+        """
+        先读磁盘缓存： 没过期直接用； 过期了先用旧的， 后台线程重新拉取后再回调 on_refresh(value)；
+        没有缓存时才阻塞调用 fetch()
+        """
+        key = self._get_cache_key(name)
+        value, fresh = self.cache.get(key, self.cache_ttl)
+        if value is None:
+            value = fetch()
+            if value: self.cache.set(key, value)
+        elif not fresh:
+            thread = threading.Thread(target=self._refresh_cache, args=(key, fetch, on_refresh))
+            thread.daemon = True
+            thread.start()
+        return value
+
+    def _refresh_cache(self, key, fetch, on_refresh=None):
+        try:
+            value = fetch()
+            if not value: return
+            self.cache.set(key, value)
+            if on_refresh: on_refresh(value)
+            logger.info(f"({self.name}) refreshed cache {key}")
+        except Exception:
+            logger.info(f"({self.name}) refresh cache {key} error: {traceback.format_exc()}")
+
+    def _on_symbol_details(self, symbol_details):
+        self.symbol_details = symbol_details
+        for listener in self.symbol_details_listeners:
+            listener(symbol_details)
+
     def _sign(self, *args, **kwargs):
         pass
 
-    def _http_requests(self, *args, **kwargs):
+    def _get_rate_limit_group(self, method, path, sign=True):
+        """
+        返回 (限频组, 优先级)， 组不在 rate_limits 里时不限频
+        """
+        return None, PRIORITY_READ
+
+    def _get_rate_limit_info(self, headers):
+        """
+        从响应头取 (当前窗口剩余次数, 窗口结束时间戳（秒）)， 交易所不返回时为 None
+        """
+        return None, None
+
+    def _send_http_request(self, path, method, params=None, data=None, sign=True, schema=None):
+        """
+        发出请求， 返回 (status_code, headers, result)
+        schema: 响应的解码 schema， 见 Codec.codec.decoder
+        """
         pass
 
+    @try_n_decorator(1)
+    def _http_requests(self, path, method='GET', params=None, data=None, sign=True, schema=None):
+        # 先排队拿令牌再发， 响应头里的剩余额度再回写给限频器
+        method = method.upper()
+        group, priority = self._get_rate_limit_group(method, path, sign)
+        self.rate_limiter.acquire(group, priority)
+        status_code, headers, res = self._send_http_request(path, method, params, data, sign, schema)
+        remain, expire = self._get_rate_limit_info(headers)
+        self.rate_limiter.update(group, remain, expire, rejected=status_code == 429)
+        return res
+
     def get_symbol_details(self):
         pass
 
@@ -80,6 +189,12 @@ class BaseRest:
     def cancel_order(self, order_id, client_order_id=None, symbol=None):
         pass
 
+    def place_orders(self, orders):
+        pass
+
+    def cancel_orders(self, order_ids, symbol=None):
+        pass
+
     def get_order(self, order_id=None, client_order_id=None, symbol=None):
         pass
 
@@ -91,3 +206,77 @@ class BaseRest:
 
     def get_kline(self, symbol, period, size, *args, **kwargs):
         pass
+
+
+class BaseAsyncRest:
+    """
+    BaseRest 的 asyncio 版本， 共用同步 rest 的密钥、 url、 签名和账户信息， 只负责发请求。
+    所有请求复用一个带连接池的 aiohttp.ClientSession， session 必须在 api 的事件循环中创建和使用。
+    """
+
+    def __init__(self, rest: BaseRest, pool_size=20):
+        self.rest = rest
+        self.name = rest.name
+        self.url = rest.url
+        self.pool_size = pool_size
+        self._session = None
+
+    def _get_session(self):
+        if self._session is None or self._session.closed:
+            self._session = aiohttp.ClientSession(connector=aiohttp.TCPConnector(limit=self.pool_size),
+                                                  timeout=aiohttp.ClientTimeout(total=HTTP_TIMEOUT))
+        return self._session
+
+    async def close(self):
+        if self._session and not self._session.closed:
+            await self._session.close()
+
+    async def _send_http_request(self, path, method, params=None, data=None, sign=True, schema=None):
+        """
+        发出请求， 返回 (status_code, headers, result)
+        """
+        pass
+
+    async def _http_requests(self, path, method='GET', params=None, data=None, sign=True, schema=None):
+        # 和同步 rest 共用一个限频器
+        method = method.upper()
+        group, priority = self.rest._get_rate_limit_group(method, path, sign)
+        await self.rest.rate_limiter.async_acquire(group, priority)
+        status_code, headers, res = await self._send_http_request(path, method, params, data, sign, schema)
+        remain, expire = self.rest._get_rate_limit_info(headers)
+        self.rest.rate_limiter.update(group, remain, expire, rejected=status_code == 429)
+        # 同 try_n_decorator: 返回字符串（非订单 id）说明请求失败
+        if isinstance(res, str) and not res.isalnum():
+            raise Exception('Try ({}, {}) bad returned: {}'.format(path, params, res))
+        return res
+
+    async def get_balances(self):
+        pass
+
+    async def get_ticker(self, symbol):
+        pass
+
+    async def place_order(self, symbol, side, size, order_type, price=None, client_order_id=None, time_in_force=None,
+                          post_only=False, **kwargs):
+        pass
+
+    async def cancel_order(self, order_id, client_order_id=None, symbol=None):
+        pass
+
+    async def place_orders(self, orders):
+        pass
+
+    async def cancel_orders(self, order_ids, symbol=None):
+        pass
+
+    async def get_order(self, order_id=None, client_order_id=None, symbol=None):
+        pass
+
+    async def get_active_orders(self, symbol):
+        pass
+
+    async def cancel_all(self, symbol):
+        pass
+
+    async def get_kline(self, symbol, period, size, *args, **kwargs):
+        pass
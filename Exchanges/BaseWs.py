@@ -0,0 +1,101 @@
+import threading
+import time
+import traceback
+
+import websocket
+
+from Codec import codec
+from Logger import logger
+from ExchangeFailureManager import exchange_failure_manager
+
+
+class BaseWs:
+    test_url = ""
+    real_url = ""
+
+    def __init__(self, name=None, url=None, testnet=True, stale_after=10, reconnect_interval=3, **kwargs):
+        """
+        stale_after: 超过该时间（秒）没有收到任何消息（包括交易所的 ping）则认为本地状态已过期， 调用方应回退到 REST
+        """
+        self.name = name
+        self.testnet = testnet
+        self.url = url or (self.test_url if self.testnet else self.real_url)
+        self.stale_after = stale_after
+        self.reconnect_interval = reconnect_interval
+
+        self.working = False
+        self.connected = False
+        self.last_message_time = 0
+
+        self._ws = None
+        self._thread = threading.Thread(target=self._run)
+        self._thread.daemon = True
+
+    def _run(self):
+        while self.working:
+            try:
+                self._ws = websocket.WebSocketApp(self.url,
+                                                  on_open=self._on_open,
+                                                  on_message=self._on_message,
+                                                  on_error=self._on_error,
+                                                  on_close=self._on_close)
+                self._ws.run_forever(ping_interval=self.stale_after, ping_timeout=self.stale_after / 2)
+            except Exception:
+                s = traceback.format_exc()
+                logger.info(f"({self.name}) ws run error: {s}")
+            self.connected = False
+            if self.working:
+                exchange_failure_manager.add_error_info(self.name, info='disconnected', error_type='ws')
+                logger.info(f"({self.name}) ws disconnected, reconnect after {self.reconnect_interval}s")
+                time.sleep(self.reconnect_interval)
+
+    def _on_open(self, ws):
+        self.connected = True
+        self.last_message_time = time.time()
+        logger.info(f"({self.name}) ws connected: {self.url}")
+        self._on_connected()
+
+    def _on_message(self, ws, message):
+        self.last_message_time = time.time()
+        try:
+            self._handle_message(self._decode(message))
+        except Exception:
+            s = traceback.format_exc()
+            logger.info(f"({self.name}) ws handle message error: {s}")
+
+    def _on_error(self, ws, error):
+        logger.info(f"({self.name}) ws error: {error}")
+
+    def _on_close(self, ws, *args):
+        self.connected = False
+        logger.info(f"({self.name}) ws closed: {args}")
+
+    @staticmethod
+    def _decode(message):
+        return codec.loads(message)
+
+    def _on_connected(self):
+        pass
+
+    def _handle_message(self, msg):
+        pass
+
+    def send(self, data):
+        if self._ws and self.connected:
+            # bytes 按文本帧发送， 省一次 str 编码
+            self._ws.send(codec.dumps(data))
+
+    def is_fresh(self):
+        return self.connected and time.time() - self.last_message_time < self.stale_after
+
+    def start(self):
+        if not self.working:
+            self.working = True
+            self._thread.start()
+            logger.info(f"({self.name}) ws started")
+
+    def stop(self):
+        if self.working:
+            self.working = False
+            if self._ws: self._ws.close()
+            logger.info(f"({self.name}) ws stopped")
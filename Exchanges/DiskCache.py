@@ -0,0 +1,48 @@
+import os
+import re
+import threading
+import time
+
+from Codec import codec
+from Logger import logger
+
+
+class DiskCache(object):
+    """
+    磁盘缓存， 每个 key 一个 json 文件： {"time": 写入时间, "value": ...}
+    先写临时文件再 os.replace， 进程中途退出也不会留下写了一半的文件。
+    path 为空时不缓存， get 总是返回 (None, False)。
+    """
+
+    def __init__(self, path='./Cache'):
+        self.path = path
+
+    def _file(self, key):
+        return os.path.join(self.path, re.sub(r'[^\w.-]', '_', key) + '.json')
+
+    def get(self, key, ttl=None):
+        """
+        返回 (value, fresh)， 没有缓存或读取失败时 value 为 None， fresh 表示没有超过 ttl 秒
+        """
+        if not self.path: return None, False
+        try:
+            with open(self._file(key), 'rb') as f:
+                item = codec.loads(f.read())
+            return item['value'], ttl is None or time.time() - item['time'] < ttl
+        except FileNotFoundError:
+            return None, False
+        except (OSError, ValueError, KeyError, TypeError) as e:
+            logger.info(f"(DiskCache) read {key} failed: {e}")
+            return None, False
+
+    def set(self, key, value):
+        if not self.path: return
+        file_name = self._file(key)
+        tmp_file_name = f"{file_name}.{os.getpid()}.{threading.get_ident()}.tmp"
+        try:
+            os.makedirs(self.path, exist_ok=True)
+            with open(tmp_file_name, 'wb') as f:
+                f.write(codec.dumps({'time': time.time(), 'value': value}))
+            os.replace(tmp_file_name, file_name)
+        except OSError as e:
+            logger.info(f"(DiskCache) write {key} failed: {e}")
@@ -0,0 +1,93 @@
+from yarl import URL
+
+from Codec import codec
+from Exchanges.BaseRest import BaseAsyncRest, async_catch_function_error_decorator
+from Exchanges.Huobi.Schemas import KLINE_SCHEMA, OPEN_ORDERS_SCHEMA
+from Exchanges.Huobi.Rest import Rest
+
+
+class AsyncRest(BaseAsyncRest):
+    rest: Rest
+
+    async def _send_http_request(self, path, method, params=None, data=None, sign=True, schema=None):
+        # query string 已经编码和签名过， 不让 aiohttp 再编码一次
+        url = URL(self.rest._get_request_url(path, method, params, sign), encoded=True)
+        headers = self.rest._get_headers(method)
+        session = self._get_session()
+        if method == 'GET':
+            async with session.get(url, headers=headers) as response:
+                return response.status, response.headers, await self._handle_http_request_result(response, schema)
+        elif method == 'POST':
+            async with session.post(url, data=codec.dumps(data if data else dict()), headers=headers) as response:
+                return response.status, response.headers, await self._handle_http_request_result(response, schema)
+
+    @staticmethod
+    async def _handle_http_request_result(resp, schema=None):
+        body = await resp.read()
+        if resp.status // 100 == 2:
+            result = codec.decoder(schema)(body)
+            if 'status' in result and result['status'] == 'error':
+                return body.decode('utf-8')
+            else:
+                return result['data'] if 'data' in result else result
+        else:
+            return body.decode('utf-8')
+
+    @async_catch_function_error_decorator
+    async def get_balances(self):
+        return (await self._http_requests(path=self.rest.balance_path))['list']
+
+    @async_catch_function_error_decorator
+    async def place_order(self, symbol, side, size, order_type, price=None, client_order_id=None, time_in_force=None, post_only=False, **kwargs):
+        data = self.rest._get_place_order_data(symbol, side, size, order_type, price, client_order_id, post_only)
+        return await self._http_requests(method='post', path='/v1/order/orders/place', data=data)
+
+    @async_catch_function_error_decorator
+    async def place_orders(self, orders):
+        data = [self.rest._get_place_order_data(**order) for order in orders]
+        return await self._http_requests(method='post', path='/v1/order/batch-orders', data=data)
+
+    @async_catch_function_error_decorator
+    async def cancel_orders(self, order_ids, symbol=None):
+        data = {'order-ids': [str(order_id) for order_id in order_ids]}
+        return await self._http_requests(method='post', path='/v1/order/orders/batchcancel', data=data)
+
+    @async_catch_function_error_decorator
+    async def get_order(self, order_id=None, client_order_id=None, symbol=None):
+        return await self._http_requests(path=f'/v1/order/orders/{order_id}')
+
+    @async_catch_function_error_decorator
+    async def cancel_order(self, order_id, client_order_id=None, symbol=None):
+        return await self._http_requests(method='post', path=f'/v1/order/orders/{order_id}/submitcancel')
+
+    @async_catch_function_error_decorator
+    async def get_active_orders(self, symbol):
+        params = {
+            'account-id': self.rest.account_id,
+            'symbol': symbol.lower(),
+            'size': 500  # huobi spot max return size 500
+        }
+        return await self._http_requests(path='/v1/order/openOrders', params=params, schema=OPEN_ORDERS_SCHEMA)
+
+    @async_catch_function_error_decorator
+    async def cancel_all(self, symbol):
+        return await self._http_requests(method='post', path='/v1/order/orders/batchCancelOpenOrders', data={'symbol': symbol.lower()})
+
+    @async_catch_function_error_decorator
+    async def get_ticker(self, symbol):
+        return await self._http_requests(path='/market/detail/merged', sign=False, params={'symbol': symbol.lower()})
+
+    @async_catch_function_error_decorator
+    async def get_depth(self, symbol, size=20):
+        params = {'symbol': symbol.lower(), 'type': 'step0'}
+        if size in (5, 10, 20): params['depth'] = size
+        return await self._http_requests(path='/market/depth', params=params, sign=False)
+
+    @async_catch_function_error_decorator
+    async def get_kline(self, symbol, period, size, *args, **kwargs):
+        params = {
+            'symbol': symbol.lower(),
+            'period': period.lower(),
+            'size': size
+        }
+        return await self._http_requests(path='/market/history/kline', params=params, sign=False, schema=KLINE_SCHEMA)
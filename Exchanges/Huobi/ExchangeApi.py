@@ -3,14 +3,37 @@ import math
 import pandas as pd
 
 from Exchanges.BaseExchangeApi import BaseExchangeApi
+from Exchanges.Records import Order, Ticker, Balance, SymbolDetail
+from Logger import logger
 from Exchanges.Huobi.Rest import Rest
+from Exchanges.Huobi.AsyncRest import AsyncRest
+from Exchanges.Huobi.Ws import MarketWs, AccountWs
 
 
 class ExchangeApi(BaseExchangeApi):
+    kline_periods = {'1min': 60, '5min': 300, '15min': 900, '30min': 1800, '60min': 3600, '4hour': 14400,
+                     '1day': 86400, '1week': 604800}
+
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
 
         self.rest = Rest(*args, **kwargs)
+        self.async_rest = AsyncRest(self.rest, pool_size=kwargs.get('http_pool_size', 20))
+        self.market_ws = MarketWs(name=f"{self.name}_market",
+                                  url=kwargs.get('market_ws_url'),
+                                  testnet=kwargs.get('testnet', True),
+                                  on_kline=self.on_market_ws_kline,
+                                  on_connected=self.on_market_ws_connected)
+        self.account_ws = AccountWs(name=f"{self.name}_account",
+                                    url=kwargs.get('account_ws_url'),
+                                    testnet=kwargs.get('testnet', True),
+                                    stale_after=30,
+                                    key=kwargs.get('key'),
+                                    secret=kwargs.get('secret'),
+                                    account_id=self.rest.account_id,
+                                    on_order=self.on_account_ws_order,
+                                    on_balance=self.on_account_ws_balance,
+                                    on_connected=self.on_account_ws_connected)
 
         self._initialize()
 
@@ -41,53 +64,75 @@ class ExchangeApi(BaseExchangeApi):
         }
         ]
         """
-        res = dict()
-        for detail in symbol_details:
-            res[detail['symbol'].upper()] = {
-                "base_currency": detail['base-currency'],
-                "quote_currency": detail['quote-currency'],
-                "price_precision": detail['price-precision'],
-                "size_precision": detail['amount-precision'],
-                "symbol": detail['symbol'].upper(),
-                "tick_size": math.pow(10, -detail['price-precision']),
-
-                # 交易对 限价单 和 市价买单 最小下单金额 ，以计价币种为单位
-                "min_order_value": detail['min-order-value'],
-                # 交易对限价单最小下单量
-                "min_limit_order_size": detail['limit-order-min-order-amt'],
-            }
-        return res
+        return {detail['symbol'].upper(): self.format_symbol_detail(detail) for detail in symbol_details}
+
+    def format_symbol_detail(self, detail):
+        return SymbolDetail(base_currency=detail['base-currency'],
+                            quote_currency=detail['quote-currency'],
+                            price_precision=detail['price-precision'],
+                            size_precision=detail['amount-precision'],
+                            symbol=detail['symbol'].upper(),
+                            tick_size=math.pow(10, -detail['price-precision']),
+                            min_order_value=detail['min-order-value'],
+                            min_limit_order_size=detail['limit-order-min-order-amt'])
 
     def format_ticker(self, ticker):
         tick = ticker['tick']
-        return {
-            'ask_price': float(tick['ask'][0]),
-            'bid_price': float(tick['bid'][0]),
-            'ask_size': float(tick['ask'][1]),
-            'bid_size': float(tick['bid'][1]),
-            'timestamp': float(ticker['ts']),  # ms
-            'symbol': ticker['ch'].split('.')[1].upper()
-        }
+        ask, bid = tick['ask'], tick['bid']
+        return Ticker(float(ask[0]), float(bid[0]), float(ask[1]), float(bid[1]), float(ticker['ts']), ticker['ch'].split('.')[1].upper())
+
+    def format_ws_ticker(self, ticker):
+        """
+        market.$symbol.bbo:
+        {'seqId': 103273695595, 'ask': 29000.01, 'askSize': 0.25, 'bid': 29000.0, 'bidSize': 1.2,
+        'quoteTime': 1609459200123, 'symbol': 'btcusdt', 'ts': 1609459200130}
+        """
+        return Ticker(float(ticker['ask']), float(ticker['bid']), float(ticker['askSize']), float(ticker['bidSize']),
+                      float(ticker['ts']), ticker['symbol'].upper())
+
+    def format_depth(self, depth):
+        """
+        {'ch': 'market.btcusdt.depth.step0', 'status': 'ok', 'ts': 1609459200130,
+        'tick': {'bids': [[29000.0, 1.2], ...], 'asks': [[29000.01, 0.25], ...], 'version': 103273695595, 'ts': 1609459200123}}
+        """
+        tick = depth['tick']
+        return {'bids': tick.get('bids') or [], 'asks': tick.get('asks') or []}
 
     def format_kline(self, data):
+        if data and not isinstance(data[0], dict):
+            # 按 schema 解码的 KlineBar
+            data = [dict(bar) for bar in data]
         return pd.DataFrame(data).rename(columns={'id': 'timestamp', 'amount': 'volume'})
 
+    def format_kline_bar(self, bar):
+        """
+        {'id': 1609459200, 'open': 29000.0, 'close': 29010.5, 'low': 28990.1, 'high': 29020.0,
+        'amount': 12.3, 'vol': 356789.1, 'count': 420}
+        """
+        if not isinstance(bar, dict):
+            # 按 schema 解码的 KlineBar， 字段已经是数值
+            return {'timestamp': bar.id, 'open': bar.open, 'high': bar.high, 'low': bar.low, 'close': bar.close, 'volume': bar.amount}
+        return {
+            'timestamp': bar['id'],
+            'open': float(bar['open']),
+            'high': float(bar['high']),
+            'low': float(bar['low']),
+            'close': float(bar['close']),
+            'volume': float(bar['amount']),
+        }
+
     def format_balance(self, balance):
         res = dict()
         for b in balance:
-            currency = b['currency']
-            if currency not in res:
-                res[currency] = {
-                    "currency": currency,
-                    "frozen": 0,
-                    "free": 0,
-                    "total": 0
-                }
+            currency, value = b['currency'], float(b['balance'])
+            record = res.get(currency)
+            if record is None:
+                record = res[currency] = Balance(currency)
             if b['type'] == 'trade':
-                res[currency]['free'] += float(b['balance'])
+                record.free += value
             else:
-                res[currency]['frozen'] += float(b['balance'])
-            res[currency]['total'] += float(b['balance'])
+                record.frozen += value
+            record.total += value
         return res
 
     def format_order(self, order):
@@ -102,28 +147,112 @@ class ExchangeApi(BaseExchangeApi):
                      GET /v1/order/openOrders 返回的是 filled-amount；
                     所以将所有的 field 统一成 filled
         """
-        order_id = order['id']
-        order = self.dict_value_to_float(order)
-        order = {k.replace('field', 'filled'): v for k, v in order.items()}
-        return {
-            'symbol': order['symbol'].upper(),
-            'order_id': order_id,
-            'status': 'closed' if order.get('finished-at', 0) - order['created-at'] >= 0 else 'open',
-            'filled_size': order['filled-amount'],
-            'side': order['type'].split('-')[0],
-            'average_price': order['filled-cash-amount'] / order['filled-amount'] if order['filled-amount'] else 0,
-
-            'client_order_id': order['client-order-id'],
-            'order_price': order['price'],
-            'order_size': order['amount'],
-            'created_at': order['created-at'],  # ms
-            'order_type': order['type'].split('-')[1],
-
-        }
+        # 直接按字段解析， openOrders 返回 filled-*， 单个订单接口返回 field-*
+        filled_size = float(order['filled-amount'] if 'filled-amount' in order else order.get('field-amount', 0))
+        filled_cash = float(order['filled-cash-amount'] if 'filled-cash-amount' in order else order.get('field-cash-amount', 0))
+        created_at = float(order['created-at'])
+        side, order_type = order['type'].split('-')[:2]
+        return Order(symbol=order['symbol'].upper(),
+                     order_id=order['id'],
+                     status='closed' if float(order.get('finished-at') or 0) - created_at >= 0 else 'open',
+                     filled_size=filled_size,
+                     side=side,
+                     average_price=filled_cash / filled_size if filled_size else 0,
+                     client_order_id=order.get('client-order-id'),
+                     order_price=float(order['price']),
+                     order_size=float(order['amount']),
+                     created_at=created_at,  # ms
+                     order_type=order_type)
 
     def format_active_orders(self, orders):
+        if orders and not isinstance(orders[0], dict):
+            return [self._format_open_order(order) for order in orders]
         return [self.format_order(order) for order in orders]
 
+    @staticmethod
+    def _format_open_order(order):
+        # 按 schema 解码的 OpenOrder， 字段已经是数值， 结果同 format_order
+        side, order_type = order.type.split('-')[:2]
+        filled_size = order.filled_amount
+        return Order(symbol=order.symbol.upper(),
+                     order_id=order.id,
+                     status='closed' if order.finished_at - order.created_at >= 0 else 'open',
+                     filled_size=filled_size,
+                     side=side,
+                     average_price=order.filled_cash_amount / filled_size if filled_size else 0,
+                     client_order_id=order.client_order_id,
+                     order_price=order.price,
+                     order_size=order.amount,
+                     created_at=float(order.created_at),
+                     order_type=order_type)
+
+    def format_ws_order(self, order):
+        """
+        orders#btcusdt, eventType: creation, trade, cancellation
+        {'eventType': 'trade', 'symbol': 'btcusdt', 'orderId': 180286878676697, 'clientOrderId': 'buy_1609501207342',
+        'type': 'buy-limit', 'orderPrice': '29000', 'orderSize': '0.01', 'orderStatus': 'partial-filled',
+        'tradePrice': '29000', 'tradeVolume': '0.004', 'tradeId': 101, 'tradeTime': 1609501207342,
+        'execAmt': '0.004', 'remainAmt': '0.006', 'aggressor': False}
+
+        creation 事件没有成交字段， 成交均价需要根据本地订单和本次成交累计
+        """
+        previous = self.local_account.get_order(order['orderId']) or dict()
+        filled_size = float(order.get('execAmt', previous.get('filled_size', 0)))
+        average_price = previous.get('average_price', 0)
+        if order['eventType'] == 'trade' and filled_size:
+            trade_size = float(order['tradeVolume'])
+            average_price = (average_price * (filled_size - trade_size) + float(order['tradePrice']) * trade_size) / filled_size
+        side, order_type = order['type'].split('-')[:2]
+        return Order(symbol=order['symbol'].upper(),
+                     order_id=order['orderId'],
+                     status='closed' if order['orderStatus'] in ('filled', 'canceled', 'partial-canceled') else 'open',
+                     filled_size=filled_size,
+                     side=side,
+                     average_price=average_price,
+                     client_order_id=order.get('clientOrderId', previous.get('client_order_id')),
+                     order_price=float(order.get('orderPrice', previous.get('order_price', 0))),
+                     order_size=float(order.get('orderSize', previous.get('order_size', 0))),
+                     created_at=order.get('orderCreateTime', previous.get('created_at', order.get('tradeTime', order.get('lastActTime')))),  # ms
+                     order_type=order_type)
+
+    def format_ws_balance(self, balance):
+        """
+        accounts.update#2
+        {'currency': 'usdt', 'accountId': 17155432, 'balance': '100.5', 'available': '80.5',
+        'changeType': 'order.place', 'accountType': 'trade', 'seqNum': 86872993928, 'changeTime': 1609501207342}
+        """
+        total, free = float(balance['balance']), float(balance['available'])
+        return Balance(balance['currency'], frozen=total - free, free=free, total=total)
+
+    def format_placed_order(self, res, symbol, side, size, order_type, price, client_order_id=None):
+        return Order(symbol=symbol.upper(), order_id=int(res), status='open', filled_size=0.0, side=side, average_price=0,
+                     client_order_id=client_order_id or '', order_price=float(price), order_size=float(size),
+                     created_at=float(int(self.now())), order_type=order_type)
+
     def format_active_place_order_res(self, res):
         if res:
             return self.get_order(order_id=res)
+
+    def format_place_orders_res(self, res, orders):
+        """
+        [{'order-id': 180286878676697, 'client-order-id': 'buy_1609501207342'},
+        {'client-order-id': 'sell_1609501207342', 'err-code': 'order-value-min-error', 'err-msg': 'Order total cannot be lower than: 5'}]
+        """
+        results = list()
+        for item, order in zip(res, orders):
+            if item.get('order-id'):
+                results.append(self.format_placed_order(item['order-id'], order['symbol'], order['side'], order['size'],
+                                                        order['order_type'], order['price'], client_order_id=order['client_order_id']))
+            else:
+                logger.info(f"({self.name}) place order {order} failed: {item}")
+                results.append(None)
+        return results
+
+    def format_cancel_orders_res(self, res):
+        """
+        {'success': ['180286878676697'],
+        'failed': [{'order-id': '180286878676698', 'err-code': 'order-orderstate-error', 'err-msg': 'Incorrect order state'}]}
+        """
+        results = {int(order_id): True for order_id in res.get('success', [])}
+        results.update({int(item['order-id']): False for item in res.get('failed', []) if item.get('order-id')})
+        return results
@@ -0,0 +1,934 @@
+import argparse
+import base64
+import gzip
+import hashlib
+import hmac
+import json
+import queue
+import random
+import re
+import socket
+import struct
+import threading
+import time
+from collections import Counter, deque
+from datetime import datetime, timedelta
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib import parse
+
+from Exchanges.MatchingEngine import MatchingEngine, OrderError
+
+DEFAULT_SYMBOLS = {
+    'btcusdt': {"base-currency": "btc", "quote-currency": "usdt", "price-precision": 2, "amount-precision": 6,
+                "min-order-value": 5, "limit-order-min-order-amt": 0.0001, "limit-order-max-order-amt": 1000},
+    'ethusdt': {"base-currency": "eth", "quote-currency": "usdt", "price-precision": 2, "amount-precision": 4,
+                "min-order-value": 5, "limit-order-min-order-amt": 0.001, "limit-order-max-order-amt": 10000},
+}
+
+PERIODS = {'1min': 60, '5min': 300, '15min': 900, '30min': 1800, '60min': 3600, '4hour': 14400, '1day': 86400}
+
+LIQUIDITY_ACCOUNT_ID = 1
+
+WS_GUID = '258EAFA5-E914-47DA-95CA-C5AB0DC85B11'
+MARKET_TOPIC = re.compile(r'^market\.(\w+)\.(bbo|kline|mbp)(?:\.(\w+))?$')
+ACCOUNT_TOPIC = re.compile(r'^(orders#(\w+|\*)|accounts\.update#[012])$')
+MBP_LEVELS = {'5': 5, '20': 20, '150': 150}
+
+
+class MarketSimulator(object):
+    """
+    模拟其他市场参与者： 中间价随机游走， 流动性账户每个 tick 撤掉旧报价， 在中间价两侧重新挂 depth 档。
+    价格穿过本地挂单时， 流动性账户的新报价作为 taker 和本地挂单成交。
+    同时用中间价和成交生成 1min kline， 其他周期由 1min 聚合。
+    """
+
+    def __init__(self, engine: MatchingEngine, symbol, price, volatility=0.0005, spread=0.0005, depth=5, level_size=1.0,
+                 tick_interval=0.5, history=2000):
+        self.engine = engine
+        self.symbol = symbol.upper()
+        self.detail = engine.symbols[self.symbol]
+        self.price = price
+        self.volatility = volatility
+        self.spread = spread
+        self.depth = depth
+        self.level_size = level_size
+        self.tick_interval = tick_interval
+        self.bars = deque(maxlen=history)
+        self.working = False
+
+        self._lock = threading.Lock()
+        self._thread = None
+        engine.add_trade_listener(self.on_trade)
+        self._generate_history(history)
+
+    def _generate_history(self, size):
+        # 倒推 size 根 1min kline， 最后一根收在当前价格
+        minute = int(time.time()) // 60 * 60
+        close, bars = self.price, list()
+        for i in range(size):
+            open_ = close * (1 - random.gauss(0, self.volatility * 10))
+            high = max(open_, close) * (1 + abs(random.gauss(0, self.volatility * 3)))
+            low = min(open_, close) * (1 - abs(random.gauss(0, self.volatility * 3)))
+            bars.append(self._new_bar(minute - i * 60, open_, high, low, close, random.uniform(1, 10)))
+            close = open_
+        self.bars.extend(reversed(bars))
+
+    def _new_bar(self, timestamp, open_, high, low, close, amount=0.0):
+        precision = self.detail['price_precision']
+        return {'id': timestamp, 'open': round(open_, precision), 'high': round(high, precision), 'low': round(low, precision),
+                'close': round(close, precision), 'amount': amount, 'vol': amount * close, 'count': 0}
+
+    def _update_bar(self, price, size=0.0):
+        minute = int(time.time()) // 60 * 60
+        price = round(price, self.detail['price_precision'])
+        with self._lock:
+            bar = self.bars[-1] if self.bars else None
+            if bar is None or bar['id'] < minute:
+                self.bars.append(self._new_bar(minute, price, price, price, price))
+                bar = self.bars[-1]
+            bar['high'] = max(bar['high'], price)
+            bar['low'] = min(bar['low'], price)
+            bar['close'] = price
+            if size:
+                bar['amount'] += size
+                bar['vol'] += size * price
+                bar['count'] += 1
+
+    def on_trade(self, trade):
+        if trade['symbol'] == self.symbol: self._update_bar(trade['price'], trade['size'])
+
+    def get_kline(self, period, size):
+        """
+        返回最新的 size 根， 按时间倒序（与火币一致）
+        """
+        seconds = PERIODS[period]
+        with self._lock:
+            bars = list(self.bars)
+            last = dict(bars[-1]) if bars else None
+        if last: bars[-1] = last
+        merged = list()
+        # 从最新的往前聚合， 凑够 size 根就停
+        for bar in reversed(bars):
+            timestamp = bar['id'] // seconds * seconds
+            if merged and merged[-1]['id'] == timestamp:
+                first = merged[-1]
+                first.update(high=max(first['high'], bar['high']), low=min(first['low'], bar['low']), open=bar['open'],
+                             amount=first['amount'] + bar['amount'], vol=first['vol'] + bar['vol'], count=first['count'] + bar['count'])
+            elif len(merged) == size:
+                break
+            else:
+                merged.append(dict(bar, id=timestamp))
+        return merged
+
+    def tick(self):
+        self.price *= 1 + random.gauss(0, self.volatility)
+        precision = self.detail['price_precision']
+        with self.engine.lock:
+            self.engine.cancel_all(LIQUIDITY_ACCOUNT_ID, self.symbol)
+            for i in range(self.depth):
+                offset = self.spread * (i + 1)
+                for side, price in (('buy', self.price * (1 - offset)), ('sell', self.price * (1 + offset))):
+                    try:
+                        self.engine.place_order(LIQUIDITY_ACCOUNT_ID, self.symbol, side, round(price, precision), self.level_size)
+                    except OrderError:
+                        continue
+        self._update_bar(self.price)
+
+    def run(self):
+        while self.working:
+            self.tick()
+            time.sleep(self.tick_interval)
+
+    def start(self):
+        self.engine.deposit(LIQUIDITY_ACCOUNT_ID, self.detail['base_currency'], 1e12)
+        self.engine.deposit(LIQUIDITY_ACCOUNT_ID, self.detail['quote_currency'], 1e18)
+        self.tick()
+        self.working = True
+        self._thread = threading.Thread(target=self.run)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        self.working = False
+
+
+class WsConnection(object):
+    """
+    服务端的一个 websocket 连接（RFC 6455）， 只实现替身用到的部分： 发送不分片， 客户端的分片拼成一条， 不支持扩展
+    """
+
+    def __init__(self, handler, path, host):
+        self.handler = handler
+        self.path = path
+        self.host = host
+        self.topics = set()
+        # 鉴权成功后的 key 信息， 只用于 /ws/v2
+        self.account = None
+        # 发出后还没收到 pong 的 ping 数
+        self.pings = 0
+        self._lock = threading.Lock()
+
+    def _read(self, size):
+        data = self.handler.rfile.read(size)
+        if len(data) < size: raise ConnectionError('connection closed')
+        return data
+
+    @staticmethod
+    def _unmask(payload, mask):
+        # 按一个大整数异或， 比逐字节快
+        size = len(payload)
+        key = (mask * (size // 4 + 1))[:size]
+        return (int.from_bytes(payload, 'big') ^ int.from_bytes(key, 'big')).to_bytes(size, 'big')
+
+    def recv(self):
+        """
+        返回一条完整的文本或二进制消息（bytes）， 连接关闭时抛出 ConnectionError
+        """
+        message = bytearray()
+        while True:
+            first, second = self._read(2)
+            size = second & 0x7f
+            if size == 126:
+                size = struct.unpack('!H', self._read(2))[0]
+            elif size == 127:
+                size = struct.unpack('!Q', self._read(8))[0]
+            mask = self._read(4) if second & 0x80 else None
+            payload = self._read(size)
+            if mask: payload = self._unmask(payload, mask)
+            opcode = first & 0x0f
+            if opcode == 0x8:
+                raise ConnectionError('closed by client')
+            elif opcode == 0x9:
+                # 客户端的 ping 帧（websocket-client 的 ping_interval）， 回 pong 帧
+                self._send_frame(0xa, payload)
+            elif opcode != 0xa:
+                message += payload
+                if first & 0x80: return bytes(message)
+
+    def send(self, payload, binary=False):
+        self._send_frame(0x2 if binary else 0x1, payload)
+
+    def _send_frame(self, opcode, payload):
+        size = len(payload)
+        if size < 126:
+            header = struct.pack('!BB', 0x80 | opcode, size)
+        elif size < 65536:
+            header = struct.pack('!BBH', 0x80 | opcode, 126, size)
+        else:
+            header = struct.pack('!BBQ', 0x80 | opcode, 127, size)
+        with self._lock:
+            self.handler.wfile.write(header + payload)
+
+    def close(self):
+        # 直接关掉 socket， 不发 close 帧， 和网络断开一样
+        try:
+            self.handler.connection.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+
+
+class RequestHandler(BaseHTTPRequestHandler):
+    server: 'LocalServer'
+    protocol_version = 'HTTP/1.1'
+    # 响应头和 body 分两次写， 不关 Nagle 会和客户端的 delayed ACK 叠加出 40ms 的延迟
+    disable_nagle_algorithm = True
+
+    def do_GET(self):
+        if self.headers.get('Upgrade', '').lower() == 'websocket':
+            return self.server.serve_ws(self)
+        self.server.dispatch(self, 'GET')
+
+    def do_POST(self):
+        self.server.dispatch(self, 'POST')
+
+    def log_message(self, format, *args):
+        pass
+
+
+class LocalServer(ThreadingHTTPServer):
+    """
+    火币现货 REST 的本地替身， 只实现 Exchanges/Huobi/Rest.py 用到的接口， 用于压测和延迟测量。
+
+    - 签名校验与火币一致（HmacSHA256, SignatureVersion 2）， Timestamp 与服务器时间相差超过 5 分钟视为过期
+    - keys: {access_key: secret}， 每个 key 对应一个现货账户， 初始余额为 balances
+    - latency / latency_jitter: 每个请求注入的延迟（秒）， 实际延迟在 [latency, latency + latency_jitter] 之间均匀分布
+    - error_rate: 以该概率直接返回 base-system-error， 不处理请求
+    - rate_limit: 每个 key（公共接口按客户端地址）每 rate_limit_window 秒最多 rate_limit 个请求， 超过返回 429， 0 表示不限频；
+                  签名接口的响应带 X-HB-RateLimit-Requests-Remain / X-HB-RateLimit-Requests-Expire
+    - websocket 和 REST 共用端口： ws_url（/ws）推送 gzip 压缩的 bbo / kline / mbp 增量， 支持 mbp 快照的 req；
+      account_ws_url（/ws/v2）鉴权（signatureVersion 2.1）后推送 orders#$symbol 和 accounts.update#N；
+      两者每 ws_ping_interval 秒发一次 ping， 连续两次没有回 pong 的连接会被断开， 行情每 ws_push_interval 秒推送一轮
+    - 故障注入： drop_ws 断开所有 ws 连接， pause_ws 暂停推送和 ping（客户端应判定数据过期），
+      skip_mbp_updates 丢掉 mbp 增量（客户端应发现 seqNum 缺口并重新请求快照）
+    """
+    daemon_threads = True
+
+    def __init__(self, host='127.0.0.1', port=8080, keys=None, balances=None, symbols=None, prices=None,
+                 maker_fee=0.002, taker_fee=0.002, latency=0.0, latency_jitter=0.0, error_rate=0.0,
+                 rate_limit=0, rate_limit_window=1.0, simulator_options=None, ws_push_interval=0.1, ws_ping_interval=5.0):
+        super().__init__((host, port), RequestHandler)
+        self.symbols = {symbol.lower(): dict(detail, symbol=symbol.lower()) for symbol, detail in (symbols or DEFAULT_SYMBOLS).items()}
+        self.engine = MatchingEngine({symbol: {
+            'base_currency': detail['base-currency'],
+            'quote_currency': detail['quote-currency'],
+            'price_precision': detail['price-precision'],
+            'size_precision': detail['amount-precision'],
+            'min_order_value': detail['min-order-value'],
+            'min_limit_order_size': detail['limit-order-min-order-amt'],
+        } for symbol, detail in self.symbols.items()}, maker_fee=maker_fee, taker_fee=taker_fee)
+
+        self.keys = dict()
+        for index, (key, secret) in enumerate((keys or dict()).items()):
+            account_id = 10000 + index
+            self.keys[key] = {'secret': secret, 'account_id': account_id}
+            for currency, amount in (balances or dict()).items():
+                self.engine.deposit(account_id, currency, amount)
+
+        prices = prices or dict()
+        self.simulators = {symbol: MarketSimulator(self.engine, symbol, prices.get(symbol, 30000.0), **(simulator_options or dict()))
+                           for symbol in self.symbols}
+        self.latency = latency
+        self.latency_jitter = latency_jitter
+        self.error_rate = error_rate
+        self.rate_limit = rate_limit
+        self.rate_limit_window = rate_limit_window
+        self.ws_push_interval = ws_push_interval
+        self.ws_ping_interval = ws_ping_interval
+
+        self._ws_connections = set()
+        self._ws_lock = threading.Lock()
+        self._ws_stop = threading.Event()
+        self._ws_thread = None
+        self._ws_paused_until = 0
+        self._ws_pongs = 0
+        self._ws_seq = 0
+        # account_id -> 已鉴权的连接数， 引擎回调里据此过滤， 流动性账户的订单不进推送队列
+        self._ws_accounts = Counter()
+        self._ws_events = queue.Queue()
+        # 每个 topic 上一次推送的内容， 没有变化不推送
+        self._ws_last = dict()
+        # symbol -> {'seq', 'bids': {price: size}, 'asks': {price: size}}， 已推送的 mbp 状态
+        self._mbp = dict()
+        self._mbp_skips = dict()
+        self.engine.add_order_listener(self._on_order_event)
+
+        self._rate_limit_windows = dict()
+        self._rate_limit_lock = threading.Lock()
+        self._thread = None
+        self._routes = [
+            ('GET', re.compile(r'^/v1/common/symbols$'), self.get_symbols, False),
+            ('GET', re.compile(r'^/market/detail/merged$'), self.get_ticker, False),
+            ('GET', re.compile(r'^/market/history/kline$'), self.get_kline, False),
+            ('GET', re.compile(r'^/market/depth$'), self.get_depth, False),
+            ('GET', re.compile(r'^/v1/account/accounts$'), self.get_accounts, True),
+            ('GET', re.compile(r'^/v1/account/accounts/(\d+)/balance$'), self.get_balance, True),
+            ('POST', re.compile(r'^/v1/order/orders/place$'), self.place_order, True),
+            ('POST', re.compile(r'^/v1/order/batch-orders$'), self.place_orders, True),
+            ('POST', re.compile(r'^/v1/order/orders/batchcancel$'), self.cancel_orders, True),
+            ('POST', re.compile(r'^/v1/order/orders/batchCancelOpenOrders$'), self.cancel_all, True),
+            ('POST', re.compile(r'^/v1/order/orders/(\d+)/submitcancel$'), self.cancel_order, True),
+            ('GET', re.compile(r'^/v1/order/orders/(\d+)$'), self.get_order, True),
+            ('GET', re.compile(r'^/v1/order/openOrders$'), self.get_open_orders, True),
+        ]
+
+    @property
+    def url(self):
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}"
+
+    @property
+    def ws_url(self):
+        host, port = self.server_address[:2]
+        return f"ws://{host}:{port}/ws"
+
+    @property
+    def account_ws_url(self):
+        host, port = self.server_address[:2]
+        return f"ws://{host}:{port}/ws/v2"
+
+    # ---------------- 请求处理 ----------------
+
+    def dispatch(self, handler: RequestHandler, method):
+        url = parse.urlsplit(handler.path)
+        params = dict(parse.parse_qsl(url.query, keep_blank_values=True))
+        body = handler.rfile.read(int(handler.headers.get('Content-Length') or 0))
+        headers = dict()
+        try:
+            if self.latency or self.latency_jitter:
+                time.sleep(self.latency + random.uniform(0, self.latency_jitter))
+            route, args = self._route(method, url.path)
+            account = self._verify(handler, method, url.path, params) if route[3] else None
+            limiter_key = params.get('AccessKeyId') if route[3] else handler.client_address[0]
+            allowed, remain, expire = self._check_rate_limit(limiter_key)
+            if self.rate_limit and route[3]:
+                headers = {'X-HB-RateLimit-Requests-Remain': str(remain), 'X-HB-RateLimit-Requests-Expire': str(expire)}
+            if not allowed:
+                return self._send(handler, 429, self._error('too-many-request', 'exceeded rate limit'), headers)
+            if self.error_rate and random.random() < self.error_rate:
+                return self._send(handler, 200, self._error('base-system-error', 'injected error'), headers)
+            data = json.loads(body) if body else dict()
+            result = route[2](*args, params=params, data=data, account=account)
+            if not isinstance(result, dict) or 'status' not in result: result = {'status': 'ok', 'data': result}
+            self._send(handler, 200, result, headers)
+        except OrderError as e:
+            self._send(handler, 200, self._error(e.code, e.msg), headers)
+        except (KeyError, ValueError, TypeError) as e:
+            self._send(handler, 200, self._error('invalid-parameter', f'invalid parameter: {e}'), headers)
+
+    def _route(self, method, path):
+        for route in self._routes:
+            if route[0] != method: continue
+            match = route[1].match(path)
+            if match: return route, [int(arg) for arg in match.groups()]
+        raise OrderError('invalid-parameter', f'unknown api {method} {path}')
+
+    def _verify(self, handler, method, path, params):
+        params = dict(params)
+        signature = params.pop('Signature', None)
+        key = self.keys.get(params.get('AccessKeyId'))
+        if not signature or not key:
+            raise OrderError('api-signature-not-valid', 'Signature not valid: Incorrect Access key')
+        if params.get('SignatureMethod') != 'HmacSHA256' or params.get('SignatureVersion') != '2':
+            raise OrderError('api-signature-not-valid', 'Signature not valid: Incorrect signature method or version')
+        try:
+            timestamp = datetime.strptime(params.get('Timestamp', ''), "%Y-%m-%dT%H:%M:%S")
+        except ValueError:
+            raise OrderError('api-signature-not-valid', 'Signature not valid: Incorrect timestamp')
+        if abs(datetime.utcnow() - timestamp) > timedelta(minutes=5):
+            raise OrderError('api-signature-not-valid', 'Signature not valid: Verification failure [校验失败]')
+        host = (handler.headers.get('Host') or '').split(':')[0].lower()
+        if not hmac.compare_digest(self._sign(key['secret'], method, host, path, params), signature):
+            raise OrderError('api-signature-not-valid', 'Signature not valid: Verification failure [校验失败]')
+        return key
+
+    @staticmethod
+    def _sign(secret, method, host, path, params):
+        msg = "\n".join([method, host, path, parse.urlencode({k: params[k] for k in sorted(params)})])
+        return base64.b64encode(hmac.new(secret.encode('utf-8'), msg.encode('utf-8'), digestmod=hashlib.sha256).digest()).decode()
+
+    def _check_rate_limit(self, key):
+        """
+        固定窗口计数， 返回 (是否放行, 窗口内剩余次数, 窗口结束时间 ms)
+        """
+        if not self.rate_limit: return True, 0, 0
+        now = time.time()
+        with self._rate_limit_lock:
+            window_start, count = self._rate_limit_windows.get(key, (0, 0))
+            if now - window_start >= self.rate_limit_window:
+                window_start, count = now, 0
+            count += 1
+            self._rate_limit_windows[key] = (window_start, count)
+        expire = int((window_start + self.rate_limit_window) * 1000)
+        return count <= self.rate_limit, max(self.rate_limit - count, 0), expire
+
+    @staticmethod
+    def _error(code, msg):
+        return {'status': 'error', 'err-code': code, 'err-msg': msg, 'data': None}
+
+    @staticmethod
+    def _send(handler, code, result, headers=None):
+        body = json.dumps(result, separators=(',', ':')).encode('utf-8')
+        handler.send_response(code)
+        handler.send_header('Content-Type', 'application/json;charset=utf-8')
+        handler.send_header('Content-Length', str(len(body)))
+        for k, v in (headers or dict()).items():
+            handler.send_header(k, v)
+        handler.end_headers()
+        handler.wfile.write(body)
+
+    # ---------------- 火币格式 ----------------
+
+    def _format_order(self, order):
+        detail = self.engine.symbols[order['symbol']]
+        order_type = f"{order['side']}-limit-maker" if order['post_only'] else f"{order['side']}-limit"
+        return {
+            'id': order['id'],
+            'symbol': order['symbol'].lower(),
+            'account-id': order['account_id'],
+            'client-order-id': order['client_order_id'],
+            'amount': f"{order['amount']:.{detail['size_precision']}f}",
+            'price': f"{order['price']:.{detail['price_precision']}f}",
+            'created-at': order['created_at'],
+            'type': order_type,
+            'field-amount': repr(order['filled']),
+            'field-cash-amount': repr(order['filled_cash']),
+            'field-fees': repr(order['fees']),
+            'finished-at': order['finished_at'],
+            'source': 'spot-api',
+            'state': order['state'],
+            'canceled-at': order['canceled_at'],
+        }
+
+    def _format_open_order(self, order):
+        order = self._format_order(order)
+        order = {k.replace('field', 'filled'): v for k, v in order.items()}
+        # openOrders 不返回 finished-at / canceled-at
+        order.pop('finished-at')
+        order.pop('canceled-at')
+        return order
+
+    def _place(self, account, data):
+        if data.get('account-id') is not None and int(data['account-id']) != account['account_id']:
+            raise OrderError('account-frozen-account-inexistent-error', 'account for id does not exist')
+        side, order_type = data['type'].split('-', 1)
+        if order_type not in ('limit', 'limit-maker'):
+            raise OrderError('invalid-parameter', f"unsupported order type {data['type']}")
+        return self.engine.place_order(account['account_id'], data['symbol'], side, float(data['price']), float(data['amount']),
+                                       client_order_id=data.get('client-order-id'), post_only=order_type == 'limit-maker')
+
+    # ---------------- 接口 ----------------
+
+    def get_symbols(self, params, data, account):
+        return [dict(detail, **{'symbol-partition': 'main', 'state': 'online', 'api-trading': 'enabled'})
+                for detail in self.symbols.values()]
+
+    def get_ticker(self, params, data, account):
+        symbol = params['symbol'].lower()
+        ticker = self.engine.get_ticker(symbol)
+        bar = self.simulators[symbol].get_kline('1day', 1)[0]
+        return {
+            'ch': f'market.{symbol}.detail.merged',
+            'status': 'ok',
+            'ts': int(time.time() * 1000),
+            'tick': dict(bar, version=bar['id'], bid=list(ticker['bid'] or [0, 0]), ask=list(ticker['ask'] or [0, 0]))
+        }
+
+    def get_depth(self, params, data, account):
+        symbol = params['symbol'].lower()
+        depth = self.engine.get_depth(symbol, int(params.get('depth', 150)))
+        now = int(time.time() * 1000)
+        return {
+            'ch': f'market.{symbol}.depth.step0',
+            'status': 'ok',
+            'ts': now,
+            'tick': {'bids': [list(level) for level in depth['bids']], 'asks': [list(level) for level in depth['asks']],
+                     'version': now, 'ts': now}
+        }
+
+    def get_kline(self, params, data, account):
+        symbol, period = params['symbol'].lower(), params['period'].lower()
+        if period not in PERIODS: raise OrderError('invalid-parameter', f'invalid period {period}')
+        return {
+            'ch': f'market.{symbol}.kline.{period}',
+            'status': 'ok',
+            'ts': int(time.time() * 1000),
+            'data': self.simulators[symbol].get_kline(period, min(int(params.get('size', 150)), 2000))
+        }
+
+    def get_accounts(self, params, data, account):
+        return [{'id': account['account_id'], 'type': 'spot', 'subtype': '', 'state': 'working'}]
+
+    def get_balance(self, account_id, params, data, account):
+        if account_id != account['account_id']:
+            raise OrderError('account-frozen-account-inexistent-error', 'account for id does not exist')
+        balances = list()
+        for currency, balance in self.engine.get_balances(account_id).items():
+            balances.append({'currency': currency, 'type': 'trade', 'balance': repr(balance['trade'])})
+            balances.append({'currency': currency, 'type': 'frozen', 'balance': repr(balance['frozen'])})
+        return {'id': account_id, 'type': 'spot', 'state': 'working', 'list': balances}
+
+    def place_order(self, params, data, account):
+        return str(self._place(account, data)['id'])
+
+    def place_orders(self, params, data, account):
+        results = list()
+        for item in data:
+            try:
+                results.append({'order-id': self._place(account, item)['id'], 'client-order-id': item.get('client-order-id', '')})
+            except OrderError as e:
+                results.append({'client-order-id': item.get('client-order-id', ''), 'err-code': e.code, 'err-msg': e.msg})
+        return results
+
+    def cancel_order(self, order_id, params, data, account):
+        self.engine.cancel_order(order_id, account['account_id'])
+        return str(order_id)
+
+    def cancel_orders(self, params, data, account):
+        success, failed = list(), list()
+        for order_id in data.get('order-ids', []):
+            try:
+                self.engine.cancel_order(int(order_id), account['account_id'])
+                success.append(str(order_id))
+            except OrderError as e:
+                failed.append({'order-id': str(order_id), 'err-code': e.code, 'err-msg': e.msg})
+        return {'success': success, 'failed': failed}
+
+    def cancel_all(self, params, data, account):
+        order_ids = self.engine.cancel_all(account['account_id'], data.get('symbol'))
+        return {'success-count': len(order_ids), 'failed-count': 0, 'next-id': -1}
+
+    def get_order(self, order_id, params, data, account):
+        return self._format_order(self.engine.get_order(order_id, account['account_id']))
+
+    def get_open_orders(self, params, data, account):
+        orders = self.engine.get_open_orders(account['account_id'], params.get('symbol'))
+        return [self._format_open_order(order) for order in orders[:int(params.get('size', 100))]]
+
+    # ---------------- websocket ----------------
+
+    def serve_ws(self, handler: RequestHandler):
+        path = parse.urlsplit(handler.path).path
+        if path not in ('/ws', '/ws/v2') or not handler.headers.get('Sec-WebSocket-Key'):
+            handler.close_connection = True
+            return self._send(handler, 404, self._error('invalid-parameter', f'unknown websocket {path}'))
+        accept = base64.b64encode(hashlib.sha1((handler.headers['Sec-WebSocket-Key'] + WS_GUID).encode()).digest()).decode()
+        handler.send_response(101)
+        handler.send_header('Upgrade', 'websocket')
+        handler.send_header('Connection', 'Upgrade')
+        handler.send_header('Sec-WebSocket-Accept', accept)
+        handler.end_headers()
+        # 这个 handler 线程之后只读 ws 消息， 返回后 http 连接直接关闭
+        handler.close_connection = True
+        conn = WsConnection(handler, path, (handler.headers.get('Host') or '').split(':')[0].lower())
+        with self._ws_lock:
+            self._ws_connections.add(conn)
+        try:
+            while not self._ws_stop.is_set():
+                msg = json.loads(conn.recv())
+                if path == '/ws':
+                    self._handle_market_message(conn, msg)
+                else:
+                    self._handle_account_message(conn, msg)
+        except (OSError, ValueError):
+            # ConnectionError 是 OSError 的子类； 消息不是 json 时也断开
+            pass
+        finally:
+            with self._ws_lock:
+                self._ws_connections.discard(conn)
+                if conn.account: self._ws_accounts[conn.account['account_id']] -= 1
+            conn.close()
+
+    def _ws_send(self, conn, data):
+        payload = json.dumps(data, separators=(',', ':')).encode('utf-8')
+        try:
+            if conn.path == '/ws':
+                conn.send(gzip.compress(payload), binary=True)
+            else:
+                conn.send(payload)
+        except OSError:
+            conn.close()
+
+    def _get_ws_connections(self, path):
+        with self._ws_lock:
+            return [conn for conn in self._ws_connections if conn.path == path]
+
+    def _parse_market_topic(self, topic):
+        """
+        :return: (symbol, kind, arg)， 不支持的 topic 返回 None
+        """
+        match = MARKET_TOPIC.match(topic or '')
+        if not match or match.group(1) not in self.symbols: return None
+        symbol, kind, arg = match.groups()
+        if kind == 'bbo' and arg is None or kind == 'kline' and arg in PERIODS or kind == 'mbp' and arg in MBP_LEVELS:
+            return symbol, kind, arg
+        return None
+
+    def _handle_market_message(self, conn, msg):
+        if 'pong' in msg:
+            conn.pings = 0
+            self._ws_pongs += 1
+            return
+        op = next((op for op in ('sub', 'unsub', 'req') if op in msg), None)
+        if op is None: return
+        topic = msg[op]
+        parsed = self._parse_market_topic(topic)
+        reply = {'id': msg.get('id'), 'status': 'ok', 'ts': int(time.time() * 1000)}
+        if parsed is None or op == 'req' and parsed[1] != 'mbp':
+            reply.update({'status': 'error', 'err-code': 'bad-request', 'err-msg': f'invalid topic {topic}'})
+        elif op == 'sub':
+            conn.topics.add(topic)
+            reply['subbed'] = topic
+        elif op == 'unsub':
+            conn.topics.discard(topic)
+            reply['unsubbed'] = topic
+        else:
+            reply.update(rep=topic, data=self._mbp_snapshot(parsed[0], MBP_LEVELS[parsed[2]]))
+        self._ws_send(conn, reply)
+
+    def _handle_account_message(self, conn, msg):
+        action, channel = msg.get('action'), msg.get('ch')
+        if action == 'pong':
+            conn.pings = 0
+            self._ws_pongs += 1
+        elif action == 'req' and channel == 'auth':
+            account = self._verify_ws(conn, msg.get('params') or dict())
+            if account and not conn.account:
+                with self._ws_lock:
+                    conn.account = account
+                    self._ws_accounts[account['account_id']] += 1
+            if account:
+                self._ws_send(conn, {'action': 'req', 'code': 200, 'ch': 'auth', 'data': {}})
+            else:
+                self._ws_send(conn, {'action': 'req', 'code': 2003, 'ch': 'auth', 'message': 'auth.fail'})
+        elif action == 'sub':
+            if not conn.account:
+                self._ws_send(conn, {'action': 'sub', 'code': 2002, 'ch': channel, 'message': 'invalid.auth.state'})
+            elif not ACCOUNT_TOPIC.match(channel or ''):
+                self._ws_send(conn, {'action': 'sub', 'code': 2001, 'ch': channel, 'message': 'invalid.ch'})
+            else:
+                conn.topics.add(channel)
+                self._ws_send(conn, {'action': 'sub', 'code': 200, 'ch': channel, 'data': {}})
+
+    def _verify_ws(self, conn, params):
+        """
+        v2 鉴权， 签名方式和 REST 相同（方法是 GET， 路径是 /ws/v2）， 参数不含 authType 和 signature
+        """
+        params = dict(params)
+        signature = params.pop('signature', None)
+        params.pop('authType', None)
+        key = self.keys.get(params.get('accessKey'))
+        if not signature or not key or params.get('signatureMethod') != 'HmacSHA256' or params.get('signatureVersion') != '2.1':
+            return None
+        try:
+            timestamp = datetime.strptime(params.get('timestamp', ''), "%Y-%m-%dT%H:%M:%S")
+        except ValueError:
+            return None
+        if abs(datetime.utcnow() - timestamp) > timedelta(minutes=5): return None
+        if not hmac.compare_digest(self._sign(key['secret'], 'GET', conn.host, conn.path, params), signature): return None
+        return key
+
+    def _mbp_book(self, symbol):
+        # 调用方持有 self._ws_lock
+        book = self._mbp.get(symbol)
+        if book is None:
+            depth = self.engine.get_depth(symbol, max(MBP_LEVELS.values()))
+            book = self._mbp[symbol] = {'seq': 1, 'bids': dict(depth['bids']), 'asks': dict(depth['asks'])}
+        return book
+
+    def _mbp_snapshot(self, symbol, levels):
+        with self._ws_lock:
+            book = self._mbp_book(symbol)
+            return {'seqNum': book['seq'],
+                    'bids': [list(level) for level in sorted(book['bids'].items(), reverse=True)[:levels]],
+                    'asks': [list(level) for level in sorted(book['asks'].items())[:levels]]}
+
+    def _mbp_update(self, symbol):
+        """
+        和上一次推送的深度比较， 只推送变化的价位， 数量为 0 表示删除， seqNum 每次加一；
+        增量不按订阅的档数过滤， 超出档数的价位由客户端裁掉
+        """
+        depth = self.engine.get_depth(symbol, max(MBP_LEVELS.values()))
+        with self._ws_lock:
+            book = self._mbp_book(symbol)
+            tick = dict()
+            for side in ('bids', 'asks'):
+                old, new = book[side], dict(depth[side])
+                tick[side] = [[price, size] for price, size in new.items() if old.get(price) != size]
+                tick[side] += [[price, 0] for price in old if price not in new]
+                book[side] = new
+            if not tick['bids'] and not tick['asks']: return None
+            tick.update(prevSeqNum=book['seq'], seqNum=book['seq'] + 1)
+            book['seq'] += 1
+            if self._mbp_skips.get(symbol):
+                self._mbp_skips[symbol] -= 1
+                return None
+            return tick
+
+    def _market_tick(self, symbol, kind, arg):
+        if kind == 'bbo':
+            ticker = self.engine.get_ticker(symbol)
+            if not ticker['bid'] or not ticker['ask']: return None
+            return {'ask': ticker['ask'][0], 'askSize': ticker['ask'][1], 'bid': ticker['bid'][0], 'bidSize': ticker['bid'][1],
+                    'symbol': symbol}
+        return self.simulators[symbol].get_kline(arg, 1)[0]
+
+    def _push_market(self):
+        now = int(time.time() * 1000)
+        updates, messages = dict(), dict()
+        for conn in self._get_ws_connections('/ws'):
+            for topic in list(conn.topics):
+                if topic not in messages:
+                    symbol, kind, arg = self._parse_market_topic(topic)
+                    if kind == 'mbp':
+                        # 同一个交易对的 mbp 增量一轮只算一次， 不同档数的订阅共用 seqNum
+                        if symbol not in updates: updates[symbol] = self._mbp_update(symbol)
+                        tick = updates[symbol]
+                    else:
+                        tick = self._market_tick(symbol, kind, arg)
+                        if tick is None or tick == self._ws_last.get(topic):
+                            tick = None
+                        else:
+                            self._ws_last[topic] = tick
+                            if kind == 'bbo':
+                                self._ws_seq += 1
+                                tick = dict(tick, seqId=self._ws_seq, quoteTime=now)
+                    messages[topic] = {'ch': topic, 'ts': now, 'tick': tick} if tick else None
+                if messages[topic]: self._ws_send(conn, messages[topic])
+
+    def _ping_ws(self):
+        now = int(time.time() * 1000)
+        for conn in self._get_ws_connections('/ws') + self._get_ws_connections('/ws/v2'):
+            if conn.pings >= 2:
+                # 和火币一样， 连续两次 ping 没有回 pong 就断开
+                conn.close()
+                continue
+            conn.pings += 1
+            self._ws_send(conn, {'ping': now} if conn.path == '/ws' else {'action': 'ping', 'data': {'ts': now}})
+
+    def _on_order_event(self, event, order, trade):
+        # 在引擎锁内调用， 只把有 ws 订阅的账户的事件放进队列， 由推送线程发送
+        if self._ws_accounts[order['account_id']] > 0:
+            self._ws_events.put((event, dict(order), trade))
+
+    def _format_ws_order(self, event, order, trade):
+        detail = self.engine.symbols[order['symbol']]
+        data = {
+            'eventType': event,
+            'symbol': order['symbol'].lower(),
+            'orderId': order['id'],
+            'clientOrderId': order['client_order_id'],
+            'type': f"{order['side']}-limit-maker" if order['post_only'] else f"{order['side']}-limit",
+            'orderPrice': f"{order['price']:.{detail['price_precision']}f}",
+            'orderSize': f"{order['amount']:.{detail['size_precision']}f}",
+            'orderStatus': order['state'],
+        }
+        if event == 'creation':
+            data.update(accountId=order['account_id'], orderSource='spot-api', orderCreateTime=order['created_at'],
+                        lastActTime=order['created_at'])
+            return data
+        data.update(execAmt=repr(order['filled']), remainAmt=repr(order['amount'] - order['filled']))
+        if event == 'trade':
+            data.update(tradePrice=repr(trade['price']), tradeVolume=repr(trade['size']), tradeId=trade['trade_id'],
+                        tradeTime=trade['timestamp'], aggressor=trade['taker_side'] == order['side'],
+                        orderCreateTime=order['created_at'])
+        else:
+            data.update(lastActTime=order['canceled_at'])
+        return data
+
+    def _push_account(self, event, order, trade):
+        account_id, symbol = order['account_id'], order['symbol']
+        data = self._format_ws_order(event, order, trade)
+        detail = self.engine.symbols[symbol]
+        balances = self.engine.get_balances(account_id)
+        change_type = {'creation': 'order.place', 'trade': 'order.match', 'cancellation': 'order.cancel'}[event]
+        now = int(time.time() * 1000)
+        for conn in self._get_ws_connections('/ws/v2'):
+            if not conn.account or conn.account['account_id'] != account_id: continue
+            channel = next((ch for ch in (f"orders#{symbol.lower()}", 'orders#*') if ch in conn.topics), None)
+            if channel: self._ws_send(conn, {'action': 'push', 'ch': channel, 'data': data})
+            for channel in [ch for ch in list(conn.topics) if ch.startswith('accounts.update#')]:
+                for currency in (detail['base_currency'], detail['quote_currency']):
+                    balance = balances.get(currency, {'trade': 0.0, 'frozen': 0.0})
+                    self._ws_seq += 1
+                    self._ws_send(conn, {'action': 'push', 'ch': channel, 'data': {
+                        'currency': currency, 'accountId': account_id, 'balance': repr(balance['trade'] + balance['frozen']),
+                        'available': repr(balance['trade']), 'changeType': change_type, 'accountType': 'trade',
+                        'changeTime': now, 'seqNum': self._ws_seq}})
+
+    def _run_ws(self):
+        next_push = next_ping = time.time()
+        while not self._ws_stop.is_set():
+            now = time.time()
+            if now < self._ws_paused_until:
+                # 暂停期间订单事件留在队列里， 恢复后再推送
+                time.sleep(min(self._ws_paused_until - now, 0.1))
+                continue
+            try:
+                self._push_account(*self._ws_events.get(timeout=max(min(next_push, next_ping) - now, 0)))
+                continue
+            except queue.Empty:
+                pass
+            now = time.time()
+            if now >= next_push:
+                self._push_market()
+                next_push = now + self.ws_push_interval
+            if now >= next_ping:
+                self._ping_ws()
+                next_ping = now + self.ws_ping_interval
+
+    def ws_status(self):
+        with self._ws_lock:
+            return {
+                'market_connections': sum(conn.path == '/ws' for conn in self._ws_connections),
+                'account_connections': sum(conn.path == '/ws/v2' for conn in self._ws_connections),
+                'authenticated': sum(self._ws_accounts.values()),
+                'pongs': self._ws_pongs,
+            }
+
+    def drop_ws(self):
+        """
+        断开所有 ws 连接， 模拟网络中断
+        """
+        with self._ws_lock:
+            connections = list(self._ws_connections)
+        for conn in connections:
+            conn.close()
+        return len(connections)
+
+    def pause_ws(self, seconds):
+        """
+        seconds 秒内不推送、 不发 ping， 连接保持， 模拟交易所推送卡住
+        """
+        self._ws_paused_until = time.time() + seconds
+
+    def skip_mbp_updates(self, symbol, count=1):
+        """
+        丢掉接下来 count 条 mbp 增量（seqNum 照常增加）， 模拟推送丢失
+        """
+        with self._ws_lock:
+            self._mbp_skips[symbol.lower()] = self._mbp_skips.get(symbol.lower(), 0) + count
+
+    # ---------------- 启停 ----------------
+
+    def start(self):
+        for simulator in self.simulators.values():
+            simulator.start()
+        self._thread = threading.Thread(target=self.serve_forever)
+        self._thread.daemon = True
+        self._thread.start()
+        self._ws_thread = threading.Thread(target=self._run_ws)
+        self._ws_thread.daemon = True
+        self._ws_thread.start()
+
+    def stop(self):
+        for simulator in self.simulators.values():
+            simulator.stop()
+        self._ws_stop.set()
+        self.drop_ws()
+        self.shutdown()
+        self.server_close()
+
+
+if __name__ == '__main__':
+    import Settings
+
+    parser = argparse.ArgumentParser(description='Local Huobi spot REST stand-in with a matching engine')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8080)
+    parser.add_argument('--key-path', default=Settings.configs.get('key_path'), help='json file with key / secret')
+    parser.add_argument('--balance', action='append', default=[], help='initial balance, e.g. usdt=10000 (repeatable)')
+    parser.add_argument('--price', action='append', default=[], help='initial price, e.g. btcusdt=30000 (repeatable)')
+    parser.add_argument('--latency', type=float, default=0.0, help='injected latency per request, seconds')
+    parser.add_argument('--latency-jitter', type=float, default=0.0)
+    parser.add_argument('--error-rate', type=float, default=0.0)
+    parser.add_argument('--rate-limit', type=int, default=0, help='requests per window per key, 0 disables')
+    parser.add_argument('--rate-limit-window', type=float, default=1.0)
+    parser.add_argument('--volatility', type=float, default=0.0005, help='relative price change per tick')
+    parser.add_argument('--tick-interval', type=float, default=0.5)
+    parser.add_argument('--ws-push-interval', type=float, default=0.1, help='market ws push period, seconds')
+    parser.add_argument('--ws-ping-interval', type=float, default=5.0)
+    args = parser.parse_args()
+
+    with open(args.key_path) as f:
+        keys = json.load(f)
+    server = LocalServer(host=args.host,
+                         port=args.port,
+                         keys={keys['key']: keys['secret']},
+                         balances={k: float(v) for k, v in (item.split('=') for item in args.balance)} or {'usdt': 10000.0},
+                         prices={k: float(v) for k, v in (item.split('=') for item in args.price)},
+                         latency=args.latency,
+                         latency_jitter=args.latency_jitter,
+                         error_rate=args.error_rate,
+                         rate_limit=args.rate_limit,
+                         rate_limit_window=args.rate_limit_window,
+                         simulator_options={'volatility': args.volatility, 'tick_interval': args.tick_interval},
+                         ws_push_interval=args.ws_push_interval,
+                         ws_ping_interval=args.ws_ping_interval)
+    server.start()
+    print(f"serving Huobi stand-in on {server.url}, set `rest_url: {server.url}`, `market_ws_url: {server.ws_url}` "
+          f"and `account_ws_url: {server.account_ws_url}` in Settings.configs")
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        server.stop()
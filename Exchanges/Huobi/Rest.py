@@ -1,17 +1,82 @@
 import base64
 import hashlib
 import hmac
-import json
+import time
 from urllib import parse
 
-from datetime import datetime
-
-from Exchanges.BaseRest import BaseRest, try_n_decorator, catch_function_error_decorator, HTTP_TIMEOUT
+from Exchanges.BaseRest import BaseRest, catch_function_error_decorator, HTTP_TIMEOUT
+from Codec import codec
+from Exchanges.Huobi.Schemas import KLINE_SCHEMA, OPEN_ORDERS_SCHEMA
+from Exchanges.RateLimiter import PRIORITY_CANCEL, PRIORITY_PLACE, PRIORITY_READ
 from Logger import logger
 
 
+class SigningContext(object):
+    """
+    签名里不变的部分只算一次： 用 secret 初始化好的 hmac 对象（每次请求 copy 一份）、 编码好的鉴权参数、
+    "METHOD\\nhost\\n" 前缀， Timestamp 按秒缓存编码后的字符串。
+    sign() 直接返回带 Signature 的 query string， 和 parse.urlencode 排序后的结果一致。
+    """
+
+    def __init__(self, key, secret, host, signature_method="HmacSHA256", signature_version=2):
+        self._hmac = hmac.new(secret.encode('utf-8'), digestmod=hashlib.sha256)
+        self._auth = [(k, f"{k}={parse.quote_plus(str(v))}") for k, v in
+                      (('AccessKeyId', key), ('SignatureMethod', signature_method), ('SignatureVersion', signature_version))]
+        self._prefixes = {method: f"{method}\n{host}\n" for method in ('GET', 'POST')}
+        # (秒, 编码后的 Timestamp 参数)， 整体替换， 多线程读到的总是一致的一对
+        self._timestamp = (None, None)
+
+    def timestamp(self):
+        second = int(time.time())
+        cached_second, timestamp = self._timestamp
+        if second != cached_second:
+            timestamp = 'Timestamp=' + parse.quote_plus(time.strftime("%Y-%m-%dT%H:%M:%S", time.gmtime(second)))
+            self._timestamp = (second, timestamp)
+        return timestamp
+
+    def signature(self, method, path, query):
+        mac = self._hmac.copy()
+        mac.update((self._prefixes[method] + path + '\n' + query).encode('utf-8'))
+        return base64.b64encode(mac.digest()).decode()
+
+    def sign(self, method, path, params=None):
+        pairs = self._auth + [('Timestamp', self.timestamp())]
+        if params:
+            pairs += [(k, f"{parse.quote_plus(k)}={parse.quote_plus(str(v))}") for k, v in params.items()]
+            pairs.sort()
+        query = '&'.join(pair for _, pair in pairs)
+        return f"{query}&Signature={parse.quote_plus(self.signature(method, path, query))}"
+
+
 class Rest(BaseRest):
     real_url = "https://api.huobi.pro"
+    batch_place_order_limit = 10
+    batch_cancel_order_limit = 50
+    kline_size_limit = 2000
+    # 私有接口按 UID 限频， 行情接口按 IP 限频， 单下单和单撤单共用一组， 撤单优先
+    rate_limits = {
+        'trade': (100, 2),
+        'batch': (50, 2),
+        'query': (50, 2),
+        'account': (100, 2),
+        'market': (800, 1),
+    }
+    rate_limit_paths = [
+        ('/v1/order/orders/batchcancel', 'batch', PRIORITY_CANCEL),
+        ('/v1/order/orders/batchCancelOpenOrders', 'batch', PRIORITY_CANCEL),
+        ('/v1/order/batch-orders', 'batch', PRIORITY_PLACE),
+        ('/v1/order/orders/place', 'trade', PRIORITY_PLACE),
+        ('/v1/account/', 'account', PRIORITY_READ),
+    ]
+    headers = {
+        'GET': {
+            "Content-type": "application/x-www-form-urlencoded"
+        },
+        'POST': {
+            "Accept": "application/json",
+            "Content-type": "application/json"
+        }
+    }
 
     def __init__(self, *args, **kwargs):
         """
@@ -25,70 +90,66 @@ class Rest(BaseRest):
         self._signature_version = 2
         self._signature_method = "HmacSHA256"
         self._signature_url = parse.urlparse(self.url).hostname.lower()
+        self._signing = SigningContext(self._key or "", self._secret or "", self._signature_url,
+                                       self._signature_method, self._signature_version)
 
         self.account_type = kwargs.get('account_type', 'spot').lower()
         self.account_id = self.get_account_id(self.account_type)
         assert self.account_id, f"Get account id failed with {self.account_type}"
+        self.balance_path = f"/v1/account/accounts/{self.account_id}/balance"
 
     def get_account_id(self, account_type):
-        account_info = self._http_requests(method='get', path='/v1/account/accounts')
+        # 账户 id 不会变， 按 key 缓存， 文件名用 key 的摘要
+        key_hash = hashlib.sha1((self._key or "").encode('utf-8')).hexdigest()[:16]
+        account_info = self.get_cached(f"accounts_{key_hash}", lambda: self._http_requests(method='get', path='/v1/account/accounts'))
         for i in account_info:
             if i['type'].lower() == account_type: return i['id']
         logger.info(f'get_account_id failed, account_info: {account_info}, account_type: {account_type}')
 
     def _sign(self, path, method, params):
-        params = params.copy()
-        msg = "\n".join([method, self._signature_url, path, parse.urlencode(params)])
-        return base64.b64encode(
-            hmac.new(self._secret.encode('utf-8'), msg.encode('utf-8'), digestmod=hashlib.sha256).digest()).decode()
+        return self._signing.signature(method, path, parse.urlencode(params))
 
-    @staticmethod
-    def _get_headers(method):
-        headers = {
-            'GET': {
-                "Content-type": "application/x-www-form-urlencoded"
-            },
-            'POST': {
-                "Accept": "application/json",
-                "Content-type": "application/json"
-            }
-        }
-        return headers.get(method.upper(), dict())
+    @classmethod
+    def _get_headers(cls, method):
+        return cls.headers.get(method.upper(), dict())
 
-    @staticmethod
-    def _get_utc_time():
+    def _get_request_url(self, path, method, params=None, sign=True):
         """
-        2017-05-11T16:22:06
+        返回带 query string 的完整 url， 签名请求的参数由 SigningContext 编码和签名
         """
-        return datetime.utcnow().strftime("%FT%X")
-
-    @try_n_decorator(1)
-    def _http_requests(self, path, method='GET', params=None, data=None, sign=True):
-        params = params if params else dict()
-        data = data if data else dict()
-        method = method.upper()
-        url = self.url + path
         if sign:
-            params.update({
-                "AccessKeyId": self._key,
-                "SignatureMethod": self._signature_method,
-                "SignatureVersion": self._signature_version,
-                "Timestamp": self._get_utc_time()
-            })
-            params = {k: params[k] for k in sorted(params)}
-            params.update({"Signature": self._sign(path, method, params)})
+            return f"{self.url}{path}?{self._signing.sign(method, path, params)}"
+        if params:
+            return f"{self.url}{path}?{parse.urlencode(params)}"
+        return self.url + path
+
+    def _get_rate_limit_group(self, method, path, sign=True):
+        if not sign: return 'market', PRIORITY_READ
+        if path.endswith('/submitcancel'): return 'trade', PRIORITY_CANCEL
+        for prefix, group, priority in self.rate_limit_paths:
+            if path.startswith(prefix): return group, priority
+        return 'query', PRIORITY_READ
+
+    def _get_rate_limit_info(self, headers):
+        remain = headers.get('X-HB-RateLimit-Requests-Remain')
+        expire = headers.get('X-HB-RateLimit-Requests-Expire')
+        return (int(remain) if remain is not None else None), (int(expire) / 1000 if expire is not None else None)
+
+    def _send_http_request(self, path, method, params=None, data=None, sign=True, schema=None):
+        data = data if data else dict()
+        url = self._get_request_url(path, method, params, sign)
         headers = self._get_headers(method)
         if method == 'GET':
-            response = self._session.get(url, params=params, headers=headers, timeout=HTTP_TIMEOUT)
+            response = self._session.get(url, headers=headers, timeout=HTTP_TIMEOUT)
         elif method == 'POST':
-            response = self._session.post(url, params=params, data=json.dumps(data, separators=(',', ':')),
-                                          headers=headers, timeout=HTTP_TIMEOUT)
-        return self._handle_http_request_result(response)
+            response = self._session.post(url, data=codec.dumps(data), headers=headers, timeout=HTTP_TIMEOUT)
+        return response.status_code, response.headers, self._handle_http_request_result(response, schema)
 
     @staticmethod
-    def _handle_http_request_result(resp):
+    def _handle_http_request_result(resp, schema=None):
         if resp.status_code // 100 == 2:
-            result = resp.json()
+            # 直接解码响应的 bytes
+            result = codec.decoder(schema)(resp.content)
             if 'status' in result and result['status'] == 'error':
                 return resp.text
             else:
@@ -98,10 +159,9 @@ class Rest(BaseRest):
 
     @catch_function_error_decorator
     def get_balances(self):
-        return self._http_requests(path=f"/v1/account/accounts/{self.account_id}/balance")['list']
+        return self._http_requests(path=self.balance_path)['list']
 
-    @catch_function_error_decorator
-    def place_order(self, symbol, side, size, order_type, price=None, client_order_id=None, time_in_force=None, post_only=False, **kwargs):
+    def _get_place_order_data(self, symbol, side, size, order_type, price=None, client_order_id=None, post_only=False):
         order_type = order_type.lower()
         # 当前该接口不支持市价单，市价买单需要按照金额下单；市价单容易产生滑点， 所以暂时不支持市价单。
         assert order_type != "market", "Market orders are not currently supported"
@@ -113,8 +173,23 @@ class Rest(BaseRest):
             "price": price
         }
         if client_order_id: data.update({'client-order-id': client_order_id})
+        return data
+
+    @catch_function_error_decorator
+    def place_order(self, symbol, side, size, order_type, price=None, client_order_id=None, time_in_force=None, post_only=False, **kwargs):
+        data = self._get_place_order_data(symbol, side, size, order_type, price, client_order_id, post_only)
         return self._http_requests(method='post', path='/v1/order/orders/place', data=data)
 
+    @catch_function_error_decorator
+    def place_orders(self, orders):
+        data = [self._get_place_order_data(**order) for order in orders]
+        return self._http_requests(method='post', path='/v1/order/batch-orders', data=data)
+
+    @catch_function_error_decorator
+    def cancel_orders(self, order_ids, symbol=None):
+        data = {'order-ids': [str(order_id) for order_id in order_ids]}
+        return self._http_requests(method='post', path='/v1/order/orders/batchcancel', data=data)
+
     @catch_function_error_decorator
     def get_order(self, order_id=None, client_order_id=None, symbol=None):
         return self._http_requests(path=f'/v1/order/orders/{order_id}')
@@ -130,7 +205,7 @@ class Rest(BaseRest):
             'symbol': symbol.lower(),
             'size': 500  # huobi spot max return size 500
         }
-        return self._http_requests(path='/v1/order/openOrders', params=params)
+        return self._http_requests(path='/v1/order/openOrders', params=params, schema=OPEN_ORDERS_SCHEMA)
 
     @catch_function_error_decorator
     def cancel_all(self, symbol):
@@ -138,12 +213,19 @@ class Rest(BaseRest):
 
     @catch_function_error_decorator
     def get_symbol_details(self):
-        return self.symbol_details or self._http_requests(path='/v1/common/symbols', sign=False)
+        return self._http_requests(path='/v1/common/symbols', sign=False)
 
     @catch_function_error_decorator
     def get_ticker(self, symbol):
         return self._http_requests(path='/market/detail/merged', sign=False, params={'symbol': symbol.lower()})
 
+    @catch_function_error_decorator
+    def get_depth(self, symbol, size=20):
+        # size: 5, 10, 20， 其他值返回 150 档
+        params = {'symbol': symbol.lower(), 'type': 'step0'}
+        if size in (5, 10, 20): params['depth'] = size
+        return self._http_requests(path='/market/depth', params=params, sign=False)
+
     @catch_function_error_decorator
     def get_kline(self, symbol, period, size, *args, **kwargs):
         params = {
@@ -151,4 +233,4 @@ class Rest(BaseRest):
             'period': period.lower(),
             'size': size
         }
-        return self._http_requests(path='/market/history/kline', params=params, sign=False)
+        return self._http_requests(path='/market/history/kline', params=params, sign=False, schema=KLINE_SCHEMA)
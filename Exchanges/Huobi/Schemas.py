@@ -0,0 +1,84 @@
+"""
+热点接口（kline、 openOrders）响应的 msgspec schema， 用 Codec.codec.decoder(schema) 解码时直接得到紧凑的 Struct，
+不生成中间 dict。 Struct 支持按火币原始字段名的 dict 式读取（bar['id']、 order.get('filled-amount')），
+ExchangeApi 的 format_* 不用区分。 没装 msgspec 时 schema 为 None， 按普通 json 解码。
+"""
+from typing import List, Optional
+
+try:
+    import msgspec
+except ImportError:
+    msgspec = None
+
+
+class RawAccess(object):
+    """
+    按交易所原始字段名（kebab-case）读取 Struct 的字段
+    """
+    __slots__ = ()
+
+    def _attr(self, key):
+        cls = type(self)
+        names = cls.__dict__.get('_raw_names')
+        if names is None:
+            names = dict(zip(cls.__struct_encode_fields__, cls.__struct_fields__))
+            setattr(cls, '_raw_names', names)
+        return names.get(key)
+
+    def __getitem__(self, key):
+        attr = self._attr(key)
+        if attr is None: raise KeyError(key)
+        return getattr(self, attr)
+
+    def __contains__(self, key):
+        return self._attr(key) is not None
+
+    def get(self, key, default=None):
+        attr = self._attr(key)
+        return default if attr is None else getattr(self, attr)
+
+    def keys(self):
+        return type(self).__struct_encode_fields__
+
+
+if msgspec is not None:
+    class KlineBar(msgspec.Struct, RawAccess, gc=False):
+        id: int
+        open: float
+        close: float
+        low: float
+        high: float
+        amount: float
+        vol: float = 0.0
+        count: int = 0
+
+    class KlineResponse(msgspec.Struct, RawAccess, rename='kebab'):
+        status: str
+        data: Optional[List[KlineBar]] = None
+        err_code: Optional[str] = None
+        err_msg: Optional[str] = None
+
+    class OpenOrder(msgspec.Struct, RawAccess, gc=False, rename='kebab'):
+        id: int
+        symbol: str
+        type: str
+        amount: float
+        price: float
+        created_at: int
+        client_order_id: str = ''
+        filled_amount: float = 0.0
+        filled_cash_amount: float = 0.0
+        finished_at: int = 0
+        state: str = ''
+
+    class OpenOrdersResponse(msgspec.Struct, RawAccess, rename='kebab'):
+        status: str
+        data: Optional[List[OpenOrder]] = None
+        err_code: Optional[str] = None
+        err_msg: Optional[str] = None
+
+    KLINE_SCHEMA = KlineResponse
+    OPEN_ORDERS_SCHEMA = OpenOrdersResponse
+else:
+    KLINE_SCHEMA = None
+    OPEN_ORDERS_SCHEMA = None
@@ -0,0 +1,212 @@
+import base64
+import gzip
+import hashlib
+import hmac
+from urllib import parse
+
+from datetime import datetime
+
+from Codec import codec
+from Exchanges.BaseWs import BaseWs
+from Exchanges.OrderBook import OrderBook
+from Logger import logger
+
+
+class MarketWs(BaseWs):
+    real_url = "wss://api.huobi.pro/ws"
+
+    def __init__(self, *args, on_kline=None, on_connected=None, **kwargs):
+        """
+        on_kline: callback(symbol, period, tick)， 每收到一根 kline 推送调用一次
+        on_connected: callback()， 每次（重新）连接成功后调用， 断线期间的推送已丢失， 依赖推送的本地状态需要重建
+        """
+        super().__init__(*args, **kwargs)
+        self.tickers = dict()
+        self.klines = dict()
+        self.order_books = dict()
+
+        self._topics = set()
+        self._on_kline = on_kline
+        self._on_connected_callback = on_connected
+
+    @staticmethod
+    def _decode(message):
+        if isinstance(message, bytes):
+            message = gzip.decompress(message)
+        return codec.loads(message)
+
+    def _on_connected(self):
+        self.tickers.clear()
+        self.klines.clear()
+        for book in list(self.order_books.values()):
+            book.reset()
+        if self._on_connected_callback: self._on_connected_callback()
+        for topic in list(self._topics):
+            self.send({'sub': topic, 'id': topic})
+        # 先订阅增量再请求快照， 快照到之前的增量由 OrderBook 缓存
+        for book in list(self.order_books.values()):
+            self._request_order_book(book)
+
+    def _handle_message(self, msg):
+        if 'ping' in msg:
+            self.send({'pong': msg['ping']})
+        elif 'ch' in msg and 'tick' in msg:
+            self._handle_tick(msg['ch'], msg['tick'], msg['ts'])
+        elif 'rep' in msg and msg.get('status') == 'ok':
+            self._handle_rep(msg['rep'], msg['data'])
+        elif msg.get('status') == 'error':
+            logger.info(f"({self.name}) ws error response: {msg}")
+
+    def _handle_tick(self, channel, tick, ts):
+        # market.$symbol.bbo, market.$symbol.kline.$period
+        items = channel.split('.')
+        symbol = items[1].upper()
+        if items[2] == 'bbo':
+            tick['ts'] = ts
+            self.tickers[symbol] = tick
+        elif items[2] == 'kline':
+            period = items[3]
+            self.klines[(symbol, period)] = tick
+            if self._on_kline: self._on_kline(symbol, period, tick)
+        elif items[2] == 'mbp':
+            # 只推送变化的价位， 数量为 0 表示删除
+            book = self.order_books.get(symbol)
+            if book and not book.apply_update(tick.get('bids', ()), tick.get('asks', ()), tick['seqNum'], tick['prevSeqNum']):
+                logger.info(f"({self.name}) {symbol} order book seq gap at {tick['prevSeqNum']}, resync")
+                self._request_order_book(book)
+
+    def _handle_rep(self, channel, data):
+        # market.$symbol.mbp.$levels 的快照
+        items = channel.split('.')
+        if len(items) < 3 or items[2] != 'mbp': return
+        book = self.order_books.get(items[1].upper())
+        if book and not book.apply_snapshot(data.get('bids', ()), data.get('asks', ()), data['seqNum']):
+            logger.info(f"({self.name}) {book.symbol} order book snapshot {data['seqNum']} mismatch, resync")
+            self._request_order_book(book)
+
+    def _request_order_book(self, book):
+        topic = f"market.{book.symbol.lower()}.mbp.{book.levels}"
+        self.send({'req': topic, 'id': topic})
+
+    def subscribe(self, topic):
+        if topic not in self._topics:
+            self._topics.add(topic)
+            self.send({'sub': topic, 'id': topic})
+
+    def subscribe_ticker(self, symbol):
+        self.subscribe(f"market.{symbol.lower()}.bbo")
+
+    def subscribe_kline(self, symbol, period):
+        self.subscribe(f"market.{symbol.lower()}.kline.{period.lower()}")
+
+    def subscribe_order_book(self, symbol, levels=150):
+        """
+        MBP 增量深度 market.$symbol.mbp.$levels， levels: 5, 20, 150（/ws）， 400（/feed）
+        """
+        symbol = symbol.upper()
+        if symbol in self.order_books: return
+        book = self.order_books[symbol] = OrderBook(symbol, levels=levels, name=self.name)
+        self.subscribe(f"market.{symbol.lower()}.mbp.{levels}")
+        self._request_order_book(book)
+
+    def get_ticker(self, symbol):
+        """
+        {'seqId': 103273695595, 'ask': 29000.01, 'askSize': 0.25, 'bid': 29000.0, 'bidSize': 1.2,
+        'quoteTime': 1609459200123, 'symbol': 'btcusdt', 'ts': 1609459200130}
+        """
+        if self.is_fresh():
+            return self.tickers.get(symbol.upper())
+
+    def get_order_book(self, symbol):
+        book = self.order_books.get(symbol.upper())
+        if book and book.synced and self.is_fresh():
+            return book
+
+    def is_kline_fresh(self, symbol, period):
+        return self.is_fresh() and (symbol.upper(), period.lower()) in self.klines
+
+
+class AccountWs(BaseWs):
+    """
+    v2 私有 ws: orders#$symbol, accounts.update#2
+    """
+    real_url = "wss://api.huobi.pro/ws/v2"
+
+    def __init__(self, *args, key=None, secret=None, account_id=None, on_order=None, on_balance=None, on_connected=None, **kwargs):
+        """
+        on_order: callback(data)， orders#$symbol 推送的 data
+        on_balance: callback(data)， accounts.update#2 推送的 data（已按 account_id 过滤）
+        on_connected: callback()， 每次鉴权成功后调用
+        """
+        super().__init__(*args, **kwargs)
+        self._key = key
+        self._secret = secret
+        self._signature_url = (parse.urlparse(self.url).hostname or "").lower()
+        self._signature_path = parse.urlparse(self.url).path or '/ws/v2'
+        self.account_id = account_id
+        self.authenticated = False
+
+        self._topics = {'accounts.update#2'}
+        self._on_order = on_order
+        self._on_balance = on_balance
+        self._on_connected_callback = on_connected
+
+    def _sign(self, params):
+        msg = "\n".join(["GET", self._signature_url, self._signature_path, parse.urlencode(params)])
+        return base64.b64encode(
+            hmac.new(self._secret.encode('utf-8'), msg.encode('utf-8'), digestmod=hashlib.sha256).digest()).decode()
+
+    def _on_connected(self):
+        self.authenticated = False
+        params = {
+            "accessKey": self._key,
+            "signatureMethod": "HmacSHA256",
+            "signatureVersion": "2.1",
+            "timestamp": datetime.utcnow().strftime("%FT%X")
+        }
+        params = {k: params[k] for k in sorted(params)}
+        params.update({"authType": "api", "signature": self._sign(params)})
+        self.send({"action": "req", "ch": "auth", "params": params})
+
+    def _on_close(self, ws, *args):
+        self.authenticated = False
+        super()._on_close(ws, *args)
+
+    def _handle_message(self, msg):
+        action = msg.get('action')
+        if action == 'ping':
+            self.send({"action": "pong", "data": msg['data']})
+        elif action == 'push':
+            self._handle_push(msg['ch'], msg['data'])
+        elif action == 'req' and msg.get('ch') == 'auth':
+            self._handle_auth(msg)
+        elif msg.get('code', 200) != 200:
+            logger.info(f"({self.name}) ws error response: {msg}")
+
+    def _handle_auth(self, msg):
+        if msg.get('code') != 200:
+            logger.info(f"({self.name}) ws auth failed: {msg}")
+            return
+        self.authenticated = True
+        logger.info(f"({self.name}) ws authenticated")
+        if self._on_connected_callback: self._on_connected_callback()
+        for topic in list(self._topics):
+            self.send({"action": "sub", "ch": topic})
+
+    def _handle_push(self, channel, data):
+        if channel.startswith('orders#'):
+            if self._on_order: self._on_order(data)
+        elif channel.startswith('accounts.update#'):
+            if self.account_id is not None and data.get('accountId') != self.account_id: return
+            if self._on_balance: self._on_balance(data)
+
+    def subscribe(self, topic):
+        if topic not in self._topics:
+            self._topics.add(topic)
+            if self.authenticated: self.send({"action": "sub", "ch": topic})
+
+    def subscribe_orders(self, symbol):
+        self.subscribe(f"orders#{symbol.lower()}")
+
+    def is_fresh(self):
+        return self.authenticated and super().is_fresh()
@@ -0,0 +1,125 @@
+import math
+import threading
+from collections import deque
+
+
+class KlineCache:
+    """
+    按 (symbol, period) 缓存最近 size 根 K 线， 并维护各字段的滚动和， 使每次更新后的 MA 计算为 O(1)。
+
+    bar 格式: {'timestamp': 1609459200, 'open': 1.0, 'high': 1.0, 'low': 1.0, 'close': 1.0, 'volume': 1.0}  # timestamp 单位 秒
+    """
+    fields = ('open', 'high', 'low', 'close', 'volume')
+    # 预热完成后每次只拉取最新的两根 K 线： 上一根（可能刚收盘）和当前这根
+    incremental_size = 2
+
+    def __init__(self, symbol, period, size):
+        self.symbol = symbol
+        self.period = period
+        self.size = size
+        self.bars = deque()
+        self.sums = dict.fromkeys(self.fields, 0.0)
+        # REST 线程与 ws 推送线程都会更新缓存
+        self.lock = threading.RLock()
+        # 滚动和的浮点误差会累积， 每更新 size 次按 fsum 重新求和一次
+        self._updates = 0
+
+    @property
+    def warm(self):
+        return len(self.bars) >= self.size
+
+    @property
+    def last_timestamp(self):
+        return self.bars[-1]['timestamp'] if self.bars else None
+
+    def fetch_size(self):
+        return self.incremental_size if self.warm else self.size
+
+    def resize(self, size):
+        with self.lock:
+            self.size = size
+            while len(self.bars) > self.size:
+                self.bars.popleft()
+            self._resum()
+
+    def reset(self, bars):
+        with self.lock:
+            self.bars = deque(sorted(bars, key=lambda bar: bar['timestamp'])[-self.size:])
+            self._resum()
+
+    def invalidate(self):
+        with self.lock:
+            self.bars = deque()
+            self._resum()
+
+    def update(self, bars):
+        """
+        用最新的若干根 K 线（任意顺序）原地更新缓存。
+        :return: False 表示缓存未预热或与最新数据之间存在缺口， 需要全量拉取后 reset
+        """
+        bars = sorted(bars, key=lambda bar: bar['timestamp'])
+        with self.lock:
+            if not self.warm:
+                return False
+            if bars and bars[0]['timestamp'] > self.last_timestamp:
+                return False
+            for bar in bars:
+                self._merge(bar)
+            return True
+
+    def push(self, bar):
+        """
+        实时推送的单根 K 线。 推送必须是连续的（新 bar 出现前已收到上一根的最终推送）， 断线重连后应先 invalidate。
+        """
+        with self.lock:
+            if not self.warm:
+                return False
+            self._merge(bar)
+            return True
+
+    def window(self, size=None):
+        with self.lock:
+            bars = list(self.bars)
+        return bars[-size:] if size else bars
+
+    def mean(self, source='close'):
+        with self.lock:
+            if not self.bars:
+                return math.nan
+            if source in self.sums:
+                return self.sums[source] / len(self.bars)
+            return math.fsum(bar[source] for bar in self.bars) / len(self.bars)
+
+    def _merge(self, bar):
+        timestamp = bar['timestamp']
+        if timestamp == self.last_timestamp:
+            self._replace_last(bar)
+        elif timestamp > self.last_timestamp:
+            self._append(bar)
+
+    def _append(self, bar):
+        self.bars.append(bar)
+        for field in self.fields:
+            self.sums[field] += bar[field]
+        if len(self.bars) > self.size:
+            expired = self.bars.popleft()
+            for field in self.fields:
+                self.sums[field] -= expired[field]
+        self._on_updated()
+
+    def _replace_last(self, bar):
+        previous = self.bars[-1]
+        self.bars[-1] = bar
+        for field in self.fields:
+            self.sums[field] += bar[field] - previous[field]
+        self._on_updated()
+
+    def _on_updated(self):
+        self._updates += 1
+        if self._updates >= self.size:
+            self._resum()
+
+    def _resum(self):
+        self._updates = 0
+        for field in self.fields:
+            self.sums[field] = math.fsum(bar[field] for bar in self.bars)
@@ -0,0 +1,147 @@
+import contextlib
+import os
+import re
+import threading
+
+import numpy as np
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+from Logger import logger
+
+
+class KlineStore:
+    """
+    本地 K 线库， 每个 (symbol, period) 一个目录， 每个字段一个只追加的二进制列文件（int64 / float64），
+    用 np.memmap 映射读取， window() 返回的是映射上的切片， 不复制数据。
+
+    只保存已收盘的 K 线： 一次拉取的 K 线中最新的一根还在变化， 不写入。
+    timestamp 列最后写， 它的长度就是已提交的行数， 写到一半退出时其他列多出的部分在下一次追加前截掉。
+    多个进程共用一个目录时， 追加用文件锁互斥（没有 fcntl 的平台只保证进程内互斥）。
+    """
+    fields = ('timestamp', 'open', 'high', 'low', 'close', 'volume')
+    dtypes = {'timestamp': np.int64, 'open': np.float64, 'high': np.float64, 'low': np.float64,
+              'close': np.float64, 'volume': np.float64}
+    itemsize = 8
+
+    def __init__(self, path, key, seconds):
+        """
+        path: 根目录， key: 目录名（交易所、 交易对、 周期）， seconds: 一根 K 线的秒数
+        """
+        self.key = key
+        self.seconds = seconds
+        self.path = os.path.join(path, re.sub(r'[^\w.-]', '_', key))
+        self.lock = threading.RLock()
+        self._size = 0
+        self._columns = {field: np.empty(0, dtype=self.dtypes[field]) for field in self.fields}
+        os.makedirs(self.path, exist_ok=True)
+        self._reload()
+
+    def __len__(self):
+        return self._size
+
+    @property
+    def last_timestamp(self):
+        with self.lock:
+            return int(self._columns['timestamp'][-1]) if self._size else None
+
+    def _file(self, field):
+        return os.path.join(self.path, f"{field}.bin")
+
+    @contextlib.contextmanager
+    def _file_lock(self):
+        if fcntl is None:
+            yield
+            return
+        with open(os.path.join(self.path, '.lock'), 'a') as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+    def _committed_size(self):
+        try:
+            return os.path.getsize(self._file('timestamp')) // self.itemsize
+        except FileNotFoundError:
+            return 0
+
+    def _reload(self):
+        # 其他进程可能追加了新的 K 线， 行数变了才重新映射； 旧映射上的切片在被引用期间仍然有效
+        size = self._committed_size()
+        if size == self._size: return
+        self._columns = {field: np.memmap(self._file(field), dtype=self.dtypes[field], mode='r', shape=(size,))
+                         for field in self.fields}
+        self._size = size
+
+    def _truncate(self, size):
+        for field in self.fields:
+            file_name = self._file(field)
+            if os.path.exists(file_name) and os.path.getsize(file_name) > size * self.itemsize:
+                os.truncate(file_name, size * self.itemsize)
+
+    def fetch_size(self, now, limit):
+        """
+        补齐到最新需要拉取的 K 线数： 空库拉 limit 根（交易所单次最多返回的根数）；
+        否则从最后一根已保存的开始拉到当前这根， 至少 2 根， 缺口超过 limit 的部分补不回来
+        """
+        last = self.last_timestamp
+        if last is None: return limit
+        return int(min(limit, max(2, (now - last) // self.seconds + 1)))
+
+    def update(self, bars):
+        """
+        追加一次拉取的 K 线（任意顺序， 可以和已保存的重叠）， 最新的一根未收盘， 不写入。
+        :return: 追加的根数
+        """
+        closed = sorted(bars, key=lambda bar: bar['timestamp'])[:-1]
+        # 大多数调用没有新收盘的 K 线， 不用加文件锁
+        last = self.last_timestamp
+        if not closed: return 0
+        if last is not None and closed[-1]['timestamp'] <= last and self._committed_size() == self._size: return 0
+        with self.lock, self._file_lock():
+            self._reload()
+            last = self.last_timestamp
+            if last is not None: closed = [bar for bar in closed if bar['timestamp'] > last]
+            if not closed: return 0
+            if last is not None and closed[0]['timestamp'] != last + self.seconds:
+                logger.info(f"(KlineStore) {self.key} gap {last} -> {closed[0]['timestamp']}, "
+                            f"{(closed[0]['timestamp'] - last) // self.seconds - 1} bars missing")
+            self._truncate(self._size)
+            for field in self.fields[1:] + self.fields[:1]:
+                values = np.array([bar[field] for bar in closed], dtype=self.dtypes[field])
+                with open(self._file(field), 'ab') as f:
+                    f.write(values.tobytes())
+            self._reload()
+            return len(closed)
+
+    def window(self, size):
+        """
+        最近 size 根已收盘的 K 线 {field: ndarray}， 是 memmap 上的只读切片， 不复制；
+        不足 size 根或其中有缺口时返回 None
+        """
+        with self.lock:
+            columns, count = self._columns, self._size
+        if size <= 0: return {field: columns[field][:0] for field in self.fields}
+        if size > count: return None
+        timestamps = columns['timestamp']
+        # timestamp 严格递增且按周期对齐， 首尾之差等于 (size - 1) 个周期就说明中间没有缺口
+        if timestamps[count - 1] - timestamps[count - size] != (size - 1) * self.seconds: return None
+        return {field: columns[field][count - size:count] for field in self.fields}
+
+    def gaps(self):
+        """
+        所有缺口 [(缺口前一根的 timestamp, 缺口后一根的 timestamp), ...]
+        """
+        with self.lock:
+            timestamps = self._columns['timestamp']
+        index = np.flatnonzero(np.diff(timestamps) != self.seconds)
+        return [(int(timestamps[i]), int(timestamps[i + 1])) for i in index]
+
+    @classmethod
+    def to_bars(cls, columns):
+        values = [columns[field].tolist() for field in cls.fields]
+        return [dict(zip(cls.fields, row)) for row in zip(*values)]
@@ -0,0 +1,111 @@
+import threading
+import time
+
+
+class LocalAccount:
+    """
+    本地订单 & 余额， 由私有 ws 推送实时维护， 并定期用 REST 结果校正。
+
+    REST 快照返回前到达的推送可能比快照更新， 所以最近的推送会被记录下来， 在 reset 时重新应用到快照上。
+    """
+
+    def __init__(self, event_expired=60):
+        self.lock = threading.Lock()
+        self.orders = dict()
+        self.balances = dict()
+        self.synced_symbols = set()
+        self.balances_synced = False
+
+        self._event_expired = event_expired
+        self._order_events = dict()
+        self._balance_events = dict()
+        # 最近结束的订单 order_id -> 时间， 成交 / 撤单推送可能比下单请求先返回
+        self._closed = dict()
+
+    def invalidate(self):
+        with self.lock:
+            self.synced_symbols.clear()
+            self.balances_synced = False
+
+    def is_synced(self, symbol=None):
+        return self.balances_synced if symbol is None else symbol.upper() in self.synced_symbols
+
+    def get_order(self, order_id):
+        with self.lock:
+            return self.orders.get(order_id)
+
+    def update_order(self, order):
+        with self.lock:
+            self._order_events[order['order_id']] = (time.time(), order)
+            self._apply_order(order)
+
+    def add_order(self, order):
+        """
+        本地刚下的单， 已经收到结束推送的不再加入
+        :return: 是否加入
+        """
+        with self.lock:
+            if order['order_id'] in self._closed: return False
+            self._order_events[order['order_id']] = (time.time(), order)
+            self._apply_order(order)
+            return True
+
+    def update_balance(self, balance):
+        with self.lock:
+            self._balance_events[balance['currency']] = (time.time(), balance)
+            self.balances[balance['currency']] = balance
+
+    def reset_orders(self, symbol, orders, since):
+        """
+        :param orders: REST 返回的 symbol 全部活跃订单
+        :param since: 发出 REST 请求的时间， 之后的推送/本地下单比快照新
+        :return: 快照与本地状态不一致的订单 id
+        """
+        symbol = symbol.upper()
+        snapshot = {order['order_id']: order for order in orders}
+        with self.lock:
+            was_synced = symbol in self.synced_symbols
+            local = {k for k, v in self.orders.items() if v['symbol'] == symbol}
+            for order_id in local:
+                self.orders.pop(order_id)
+            for order in snapshot.values():
+                self._apply_order(order)
+            for order_id, (event_time, order) in list(self._order_events.items()):
+                if event_time >= since:
+                    self._apply_order(order)
+                elif event_time < time.time() - self._event_expired:
+                    self._order_events.pop(order_id)
+            for order_id, closed_time in list(self._closed.items()):
+                if closed_time < time.time() - self._event_expired: self._closed.pop(order_id)
+            self.synced_symbols.add(symbol)
+            current = {k for k, v in self.orders.items() if v['symbol'] == symbol}
+        return local ^ current if was_synced else set()
+
+    def reset_balances(self, balances, since):
+        with self.lock:
+            drift = {k for k, v in balances.items() if self.balances.get(k, {}).get('total') != v['total']} \
+                if self.balances_synced else set()
+            self.balances = dict(balances)
+            for currency, (event_time, balance) in list(self._balance_events.items()):
+                if event_time >= since:
+                    self.balances[currency] = balance
+                elif event_time < time.time() - self._event_expired:
+                    self._balance_events.pop(currency)
+            self.balances_synced = True
+        return drift
+
+    def get_active_orders(self, symbol):
+        symbol = symbol.upper()
+        with self.lock:
+            return [order for order in self.orders.values() if order['symbol'] == symbol]
+
+    def get_balances(self):
+        with self.lock:
+            return dict(self.balances)
+
+    def _apply_order(self, order):
+        if order['status'] == 'closed':
+            self._closed[order['order_id']] = time.time()
+            self.orders.pop(order['order_id'], None)
+        else:
+            self.orders[order['order_id']] = order
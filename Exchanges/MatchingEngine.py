@@ -0,0 +1,287 @@
+import bisect
+import itertools
+import threading
+import time
+from collections import deque
+
+
+class OrderError(Exception):
+    def __init__(self, code, msg):
+        super().__init__(f"{code}: {msg}")
+        self.code = code
+        self.msg = msg
+
+
+class BookSide(object):
+    """
+    一边的订单簿： 价格有序数组 + 每个价位一个按时间排序的队列（价格优先、 时间优先）
+    """
+
+    def __init__(self, side):
+        self.side = side
+        self.prices = list()
+        self.levels = dict()
+
+    def __bool__(self):
+        return bool(self.prices)
+
+    def best_price(self):
+        if not self.prices: return None
+        return self.prices[-1] if self.side == 'buy' else self.prices[0]
+
+    def best_level(self):
+        return self.levels[self.best_price()]
+
+    def add(self, order):
+        price = order['price']
+        if price not in self.levels:
+            bisect.insort(self.prices, price)
+            self.levels[price] = deque()
+        self.levels[price].append(order)
+
+    def remove(self, order):
+        level = self.levels.get(order['price'])
+        if level is None: return
+        try:
+            level.remove(order)
+        except ValueError:
+            return
+        if not level: self._drop_level(order['price'])
+
+    def pop_best(self):
+        price = self.best_price()
+        level = self.levels[price]
+        order = level.popleft()
+        if not level: self._drop_level(price)
+        return order
+
+    def _drop_level(self, price):
+        del self.levels[price]
+        del self.prices[bisect.bisect_left(self.prices, price)]
+
+    def depth(self, size):
+        prices = self.prices[::-1] if self.side == 'buy' else self.prices
+        return [(price, sum(o['amount'] - o['filled'] for o in self.levels[price])) for price in prices[:size]]
+
+
+class MatchingEngine(object):
+    """
+    现货限价单撮合引擎， 价格优先、 时间优先， 挂单以挂单价成交。
+
+    symbols: {'BTCUSDT': {'base_currency': 'btc', 'quote_currency': 'usdt', 'price_precision': 2, 'size_precision': 6,
+                          'min_order_value': 5, 'min_limit_order_size': 0.0001}}
+    余额: {account_id: {currency: {'trade': 可用, 'frozen': 冻结}}}
+    手续费: 买方按成交数量收 base， 卖方按成交金额收 quote
+    订单状态: submitted, partial-filled, filled, canceled, partial-canceled
+    """
+
+    def __init__(self, symbols, maker_fee=0.002, taker_fee=0.002):
+        self.symbols = {symbol.upper(): detail for symbol, detail in symbols.items()}
+        self.maker_fee = maker_fee
+        self.taker_fee = taker_fee
+        self.accounts = dict()
+        self.orders = dict()
+        self.open_orders = dict()
+        self.books = {symbol: {'buy': BookSide('buy'), 'sell': BookSide('sell')} for symbol in self.symbols}
+        self.trade_listeners = list()
+        self.order_listeners = list()
+
+        self.lock = threading.RLock()
+        self._order_ids = itertools.count(1)
+        self._trade_ids = itertools.count(1)
+
+    def add_trade_listener(self, callback):
+        """
+        callback(trade), trade: {'trade_id', 'symbol', 'price', 'size', 'taker_side', 'timestamp'}
+        """
+        self.trade_listeners.append(callback)
+
+    def add_order_listener(self, callback):
+        """
+        callback(event, order, trade)， event: creation, trade, cancellation， trade 只在 trade 事件时有；
+        在引擎锁内调用， order 是引擎里的订单本身， 需要保留的话自己复制
+        """
+        self.order_listeners.append(callback)
+
+    def _notify_order(self, event, order, trade=None):
+        for callback in self.order_listeners:
+            callback(event, order, trade)
+
+    def deposit(self, account_id, currency, amount):
+        with self.lock:
+            balance = self._balance(account_id, currency)
+            balance['trade'] += amount
+
+    def _balance(self, account_id, currency):
+        account = self.accounts.setdefault(account_id, dict())
+        return account.setdefault(currency.lower(), {'trade': 0.0, 'frozen': 0.0})
+
+    def get_balances(self, account_id):
+        with self.lock:
+            return {currency: dict(balance) for currency, balance in self.accounts.get(account_id, dict()).items()}
+
+    def get_order(self, order_id, account_id=None):
+        with self.lock:
+            order = self.orders.get(order_id)
+            if not order or (account_id is not None and order['account_id'] != account_id):
+                raise OrderError('base-record-invalid', 'record invalid')
+            return dict(order)
+
+    def get_open_orders(self, account_id, symbol=None):
+        with self.lock:
+            return [dict(order) for order in self.open_orders.get(account_id, dict()).values()
+                    if symbol is None or order['symbol'] == symbol.upper()]
+
+    def get_ticker(self, symbol):
+        with self.lock:
+            book = self.books[symbol.upper()]
+            bids, asks = book['buy'].depth(1), book['sell'].depth(1)
+            return {'bid': bids[0] if bids else None, 'ask': asks[0] if asks else None}
+
+    def get_depth(self, symbol, size=20):
+        with self.lock:
+            book = self.books[symbol.upper()]
+            return {'bids': book['buy'].depth(size), 'asks': book['sell'].depth(size)}
+
+    def _check(self, symbol, side, price, amount):
+        detail = self.symbols.get(symbol)
+        if not detail: raise OrderError('invalid-parameter', f'invalid symbol {symbol}')
+        if side not in ('buy', 'sell'): raise OrderError('invalid-parameter', f'invalid side {side}')
+        if price is None or price <= 0: raise OrderError('order-limitorder-price-error', 'invalid price')
+        if round(price, detail['price_precision']) != price:
+            raise OrderError('order-orderprice-precision-error', f"order price precision error, scale: `{detail['price_precision']}`")
+        if round(amount, detail['size_precision']) != amount:
+            raise OrderError('order-orderamount-precision-error', f"order amount precision error, scale: `{detail['size_precision']}`")
+        if amount < detail['min_limit_order_size']:
+            raise OrderError('order-limitorder-amount-min-error', f"limit order amount error, min: `{detail['min_limit_order_size']}`")
+        if price * amount < detail['min_order_value']:
+            raise OrderError('order-value-min-error', f"Order total cannot be lower than: `{detail['min_order_value']}`")
+        return detail
+
+    def place_order(self, account_id, symbol, side, price, amount, client_order_id=None, post_only=False):
+        symbol, side = symbol.upper(), side.lower()
+        price, amount = float(price), float(amount)
+        with self.lock:
+            detail = self._check(symbol, side, price, amount)
+            if client_order_id and any(o['client_order_id'] == client_order_id for o in self.open_orders.get(account_id, dict()).values()):
+                raise OrderError('order-duplicate-client-order-id', f'duplicate client order id {client_order_id}')
+
+            currency, reserve = (detail['quote_currency'], price * amount) if side == 'buy' else (detail['base_currency'], amount)
+            balance = self._balance(account_id, currency)
+            if balance['trade'] < reserve - 1e-12:
+                raise OrderError('account-frozen-balance-insufficient-error', 'trade account balance is not enough')
+            balance['trade'] -= reserve
+            balance['frozen'] += reserve
+
+            now = int(time.time() * 1000)
+            order = {
+                'id': next(self._order_ids),
+                'account_id': account_id,
+                'symbol': symbol,
+                'side': side,
+                'price': price,
+                'amount': amount,
+                'filled': 0.0,
+                'filled_cash': 0.0,
+                'fees': 0.0,
+                'reserved': reserve,
+                'state': 'submitted',
+                'client_order_id': client_order_id or '',
+                'post_only': post_only,
+                'created_at': now,
+                'finished_at': 0,
+                'canceled_at': 0,
+            }
+            self.orders[order['id']] = order
+            self._notify_order('creation', order)
+
+            opposite = self.books[symbol]['sell' if side == 'buy' else 'buy']
+            if post_only and opposite and self._crosses(order, opposite.best_price()):
+                # post only 单会吃单时直接撤销
+                self._finish_cancel(order)
+                return dict(order)
+            self._match(order, opposite, detail)
+            if order['state'] in ('submitted', 'partial-filled'):
+                self.books[symbol][side].add(order)
+                self.open_orders.setdefault(account_id, dict())[order['id']] = order
+            return dict(order)
+
+    @staticmethod
+    def _crosses(order, price):
+        return order['price'] >= price if order['side'] == 'buy' else order['price'] <= price
+
+    def _match(self, taker, opposite, detail):
+        while opposite and taker['filled'] < taker['amount'] and self._crosses(taker, opposite.best_price()):
+            maker = opposite.best_level()[0]
+            size = min(taker['amount'] - taker['filled'], maker['amount'] - maker['filled'])
+            self._fill(maker, maker['price'], size, self.maker_fee, detail)
+            self._fill(taker, maker['price'], size, self.taker_fee, detail)
+            if maker['state'] == 'filled': opposite.pop_best()
+            trade = {
+                'trade_id': next(self._trade_ids),
+                'symbol': taker['symbol'],
+                'price': maker['price'],
+                'size': size,
+                'taker_side': taker['side'],
+                'timestamp': int(time.time() * 1000),
+            }
+            for callback in self.trade_listeners:
+                callback(trade)
+            self._notify_order('trade', maker, trade)
+            self._notify_order('trade', taker, trade)
+
+    def _fill(self, order, price, size, fee_rate, detail):
+        base = self._balance(order['account_id'], detail['base_currency'])
+        quote = self._balance(order['account_id'], detail['quote_currency'])
+        if order['side'] == 'buy':
+            # 冻结按挂单价计算， 以更低的价格成交时差额退回可用
+            release = order['price'] * size
+            quote['frozen'] -= release
+            quote['trade'] += release - price * size
+            fee = size * fee_rate
+            base['trade'] += size - fee
+        else:
+            release = size
+            base['frozen'] -= size
+            fee = price * size * fee_rate
+            quote['trade'] += price * size - fee
+        order['reserved'] -= release
+        order['filled'] += size
+        order['filled_cash'] += price * size
+        order['fees'] += fee
+        if order['amount'] - order['filled'] <= 1e-12:
+            order['state'] = 'filled'
+            order['finished_at'] = int(time.time() * 1000)
+            self.open_orders.get(order['account_id'], dict()).pop(order['id'], None)
+        else:
+            order['state'] = 'partial-filled'
+
+    def _finish_cancel(self, order):
+        detail = self.symbols[order['symbol']]
+        currency = detail['quote_currency'] if order['side'] == 'buy' else detail['base_currency']
+        balance = self._balance(order['account_id'], currency)
+        balance['frozen'] -= order['reserved']
+        balance['trade'] += order['reserved']
+        order['reserved'] = 0.0
+        order['state'] = 'partial-canceled' if order['filled'] else 'canceled'
+        order['canceled_at'] = order['finished_at'] = int(time.time() * 1000)
+        self.open_orders.get(order['account_id'], dict()).pop(order['id'], None)
+        self._notify_order('cancellation', order)
+
+    def cancel_order(self, order_id, account_id=None):
+        with self.lock:
+            order = self.orders.get(order_id)
+            if not order or (account_id is not None and order['account_id'] != account_id):
+                raise OrderError('base-record-invalid', 'record invalid')
+            if order['state'] not in ('submitted', 'partial-filled'):
+                raise OrderError('order-orderstate-error', 'Incorrect order state')
+            self.books[order['symbol']][order['side']].remove(order)
+            self._finish_cancel(order)
+            return dict(order)
+
+    def cancel_all(self, account_id, symbol=None):
+        with self.lock:
+            orders = self.get_open_orders(account_id, symbol)
+            for order in orders:
+                self.cancel_order(order['id'], account_id)
+            return [order['id'] for order in orders]
@@ -0,0 +1,161 @@
+import bisect
+import threading
+import time
+from collections import deque
+
+from Metrics import metrics
+
+
+class BookLevels(object):
+    """
+    一边的价位： 升序价格数组 + {price: size}， 增删改一个价位是一次二分查找（数组插入 / 删除是一次 memmove）。
+    买盘最优价在数组末尾， 卖盘最优价在开头。
+    """
+
+    def __init__(self, side):
+        self.side = side
+        self.prices = list()
+        self.sizes = dict()
+
+    def __len__(self):
+        return len(self.prices)
+
+    def load(self, levels):
+        self.sizes = {float(price): float(size) for price, size in levels if float(size) > 0}
+        self.prices = sorted(self.sizes)
+
+    def set(self, price, size):
+        # size 为 0 表示删除这个价位
+        if size > 0:
+            if price not in self.sizes: bisect.insort(self.prices, price)
+            self.sizes[price] = size
+        elif self.sizes.pop(price, None) is not None:
+            del self.prices[bisect.bisect_left(self.prices, price)]
+
+    def trim(self, size):
+        # 只保留最优的 size 档， 超出订阅档位的价位交易所不会再推送删除
+        excess = len(self.prices) - size
+        if excess <= 0: return
+        if self.side == 'buy':
+            removed, self.prices = self.prices[:excess], self.prices[excess:]
+        else:
+            removed, self.prices = self.prices[-excess:], self.prices[:-excess]
+        for price in removed:
+            del self.sizes[price]
+
+    def best(self):
+        if not self.prices: return None
+        price = self.prices[-1] if self.side == 'buy' else self.prices[0]
+        return price, self.sizes[price]
+
+    def depth(self, size):
+        prices = self.prices[:-size - 1:-1] if self.side == 'buy' else self.prices[:size]
+        return [(price, self.sizes[price]) for price in prices]
+
+
+class OrderBook(object):
+    """
+    由 快照 + 增量 维护的本地 L2 订单簿（按价位聚合）。
+
+    增量带 (seq, prev_seq)， 必须首尾相接： prev_seq 等于上一条的 seq；
+    还没有快照时增量先缓存， 快照到了以后丢掉 seq 不大于快照的， 其余接在快照后面；
+    发现缺口时订单簿失效（synced=False）， 调用方重新请求快照。
+    """
+
+    def __init__(self, symbol, levels=150, name='', max_pending=1000):
+        self.symbol = symbol.upper()
+        self.levels = levels
+        self.name = name
+        self.bids = BookLevels('buy')
+        self.asks = BookLevels('sell')
+        self.seq = None
+        self.synced = False
+        self.update_time = 0
+        self.lock = threading.Lock()
+
+        # 快照后的第一条增量可以跨过快照： prev_seq < 快照 seq < seq
+        self._from_snapshot = False
+        self._pending = deque(maxlen=max_pending)
+
+    def reset(self):
+        # 断线重连后， 等待新的快照
+        with self.lock:
+            self.synced = False
+            self.seq = None
+            self._pending.clear()
+
+    def apply_snapshot(self, bids, asks, seq=None):
+        """
+        :return: False 表示缓存的增量和快照接不上， 需要重新请求快照
+        """
+        with self.lock:
+            self.bids.load(bids)
+            self.asks.load(asks)
+            self.bids.trim(self.levels)
+            self.asks.trim(self.levels)
+            self.seq = seq
+            self.synced = True
+            self._from_snapshot = True
+            self.update_time = time.time()
+            pending, self._pending = list(self._pending), deque(maxlen=self._pending.maxlen)
+            return all(self._apply(*update) for update in pending)
+
+    def apply_update(self, bids, asks, seq, prev_seq):
+        """
+        :return: False 表示出现缺口， 订单簿已失效， 需要重新请求快照
+        """
+        with self.lock:
+            if not self.synced:
+                # 等待快照期间缓存增量； 缓存满了说明快照迟迟没到， 丢掉最旧的， 快照到了以后会判断接不上
+                self._pending.append((bids, asks, seq, prev_seq))
+                return True
+            return self._apply(bids, asks, seq, prev_seq)
+
+    def _apply(self, bids, asks, seq, prev_seq):
+        if self.seq is not None and prev_seq != self.seq:
+            if self._from_snapshot and seq <= self.seq: return True
+            if not (self._from_snapshot and prev_seq < self.seq < seq): return self._on_gap()
+        for price, size in bids:
+            self.bids.set(float(price), float(size))
+        for price, size in asks:
+            self.asks.set(float(price), float(size))
+        if len(self.bids) > self.levels: self.bids.trim(self.levels)
+        if len(self.asks) > self.levels: self.asks.trim(self.levels)
+        self.seq = seq
+        self._from_snapshot = False
+        self.update_time = time.time()
+        return True
+
+    def _on_gap(self):
+        self.synced = False
+        self.seq = None
+        metrics.inc('order_book_resync_total', exchange=self.name, symbol=self.symbol)
+        return False
+
+    def best_bid(self):
+        """
+        (price, size)， 没有买盘时为 None
+        """
+        with self.lock:
+            return self.bids.best()
+
+    def best_ask(self):
+        with self.lock:
+            return self.asks.best()
+
+    def depth(self, size=20):
+        """
+        {'bids': [(price, size), ...], 'asks': [(price, size), ...]}， 各 size 档， 从最优价开始
+        """
+        with self.lock:
+            return {'bids': self.bids.depth(size), 'asks': self.asks.depth(size)}
+
+    def microprice(self):
+        """
+        按买一卖一挂单量加权的中间价： (bid * ask_size + ask * bid_size) / (bid_size + ask_size)，
+        挂单量少的一边更可能先被吃掉， 价格向那一边偏
+        """
+        with self.lock:
+            bid, ask = self.bids.best(), self.asks.best()
+        if not bid or not ask: return None
+        return (bid[0] * ask[1] + ask[0] * bid[1]) / (bid[1] + ask[1])
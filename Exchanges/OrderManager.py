@@ -0,0 +1,184 @@
+import threading
+import time
+
+from Metrics import metrics
+
+
+class OrderManager:
+    """
+    本地订单状态： 下单成功后用下单请求 + 交易所返回的 order_id 直接生成订单（不再 get_order），
+    按 client_order_id 索引， 撤单、 私有 ws 推送等状态变化都在本地更新。
+
+    symbol 与交易所对账（reset）后的 reconcile_period 秒内， 活跃订单直接用本地的， 不再每轮查询；
+    超时、 撤单被拒、 冻结余额和本地挂单的差额变了（有成交）等不一致时 invalidate， 下一次查询走 REST 重新对账。
+    """
+
+    def __init__(self, reconcile_period=30, name='', closed_expired=60):
+        self.reconcile_period = reconcile_period
+        self.closed_expired = closed_expired
+        self.name = name
+        self.lock = threading.Lock()
+        # client_order_id -> order， 交易所返回的没有 client_order_id 的订单用 order_id
+        self.orders = dict()
+        self.order_ids = dict()
+        # symbol -> 最近一次对账的时间
+        self.synced = dict()
+
+        self._added = dict()
+        # 最近结束的订单 order_id / client_order_id -> 时间， 成交 / 撤单推送可能比下单请求先返回
+        self._closed = dict()
+        # 对账过或者下过单的 symbol， 一个币种的 symbol 全部在有效期内才检查冻结余额
+        self._symbols = set()
+        # symbol -> (base_currency, quote_currency)， check_frozen 时记录
+        self._currencies = dict()
+        # currency -> 对账后交易所冻结余额和本地挂单占用的差额（其他进程、 手动下的单）
+        self._frozen_offsets = dict()
+
+    @staticmethod
+    def _key(order):
+        return order.get('client_order_id') or order['order_id']
+
+    def is_synced(self, symbol):
+        synced_time = self.synced.get(symbol.upper())
+        return synced_time is not None and time.time() - synced_time < self.reconcile_period
+
+    def invalidate(self, symbol=None, reason=''):
+        with self.lock:
+            symbols = list(self.synced) if symbol is None else [symbol.upper()]
+            for symbol in symbols:
+                if self.synced.pop(symbol, None) is not None:
+                    metrics.inc('order_reconcile_triggered_total', exchange=self.name, symbol=symbol, reason=reason)
+
+    def get_order(self, order_id=None, client_order_id=None):
+        with self.lock:
+            if client_order_id is None: client_order_id = self.order_ids.get(order_id)
+            return self.orders.get(client_order_id)
+
+    def get_active_orders(self, symbol):
+        symbol = symbol.upper()
+        with self.lock:
+            return [order for order in self.orders.values() if order['symbol'] == symbol]
+
+    def add(self, order):
+        """
+        本地刚下的单， 已经收到结束推送的不再加入
+        :return: 是否加入
+        """
+        with self.lock:
+            self._expire_closed()
+            if order['order_id'] in self._closed or order.get('client_order_id') in self._closed: return False
+            self._added[self._key(order)] = time.time()
+            self._symbols.add(order['symbol'])
+            self._apply(order)
+            return True
+
+    def update(self, order):
+        """
+        状态变化（ws 推送、 get_order）， 推送里没有 client_order_id 时按 order_id 找
+        """
+        with self.lock:
+            if not order.get('client_order_id') and order['order_id'] in self.order_ids:
+                order['client_order_id'] = self.order_ids[order['order_id']]
+            self._apply(order)
+
+    def on_cancelled(self, results, symbol=None):
+        """
+        results: {order_id: 撤单请求是否被接受}； 被拒绝的通常是已经成交了， 需要对账
+        """
+        rejected = set()
+        with self.lock:
+            for order_id, accepted in results.items():
+                key = self.order_ids.get(order_id)
+                if accepted:
+                    self._remove(key)
+                else:
+                    order = self.orders.get(key)
+                    rejected.add(order['symbol'] if order else symbol)
+        for symbol in rejected - {None}:
+            self.invalidate(symbol, reason='cancel_rejected')
+
+    def clear(self, symbol):
+        # cancel_all 之后， 本地不知道哪些撤掉了、 哪些已经成交， 全部重新对账
+        symbol = symbol.upper()
+        with self.lock:
+            for key in [key for key, order in self.orders.items() if order['symbol'] == symbol]:
+                self._remove(key)
+        self.invalidate(symbol, reason='cancel_all')
+
+    def reset(self, symbol, orders, since):
+        """
+        用 REST 返回的 symbol 全部活跃订单对账， since 之后本地新下的单快照里可能还没有， 保留
+        :return: 快照与本地不一致的订单
+        """
+        symbol = symbol.upper()
+        snapshot = {self._key(order): order for order in orders}
+        with self.lock:
+            was_synced = symbol in self.synced
+            local = {key for key, order in self.orders.items() if order['symbol'] == symbol}
+            for key in local - set(snapshot):
+                if self._added.get(key, 0) < since: self._remove(key)
+            for order in snapshot.values():
+                self._apply(order)
+            self.synced[symbol] = time.time()
+            self._symbols.add(symbol)
+            # 差额在下一次 check_frozen 时重新记录， 还不知道 symbol 的币种时全部重新记录
+            for currency in self._currencies.get(symbol) or list(self._frozen_offsets):
+                self._frozen_offsets.pop(currency, None)
+            for key in [key for key in self._added if key not in self.orders]:
+                self._added.pop(key)
+        return local ^ set(snapshot) if was_synced else set()
+
+    def check_frozen(self, balances, symbol_details):
+        """
+        本地挂单占用： 买单冻结 价格 * 数量 的计价币， 卖单冻结数量的基础币。
+        交易所的冻结余额还包括其他进程、 手动下的单， 所以对账后记录两者的差额， 差额变了说明有成交（或者有本地不知道的挂单），
+        用到这个币种的 symbol 都要重新对账； 用到这个币种的 symbol 有没在有效期内的， 不检查。
+        """
+        with self.lock:
+            synced_symbols = {symbol for symbol in self._symbols if self.is_synced(symbol)}
+            for symbol in self._symbols:
+                detail = symbol_details[symbol]
+                self._currencies[symbol] = (detail['base_currency'], detail['quote_currency'])
+            expected, currencies = dict(), dict()
+            for order in self.orders.values():
+                detail = symbol_details[order['symbol']]
+                if order['side'] == 'buy':
+                    currency, value = detail['quote_currency'], order['order_price'] * (order['order_size'] - order['filled_size'])
+                else:
+                    currency, value = detail['base_currency'], order['order_size'] - order['filled_size']
+                expected[currency] = expected.get(currency, 0.0) + value
+            for symbol, symbol_currencies in self._currencies.items():
+                for currency in symbol_currencies:
+                    currencies.setdefault(currency, set()).add(symbol)
+            mismatched = set()
+            for currency, symbols in currencies.items():
+                if not symbols <= synced_symbols: continue
+                value = expected.get(currency, 0.0)
+                offset = balances.get(currency, dict()).get('frozen', 0.0) - value
+                baseline = self._frozen_offsets.setdefault(currency, offset)
+                if abs(offset - baseline) > 1e-6 * max(1.0, value, abs(baseline)):
+                    mismatched.update(symbols)
+        for symbol in mismatched:
+            self.invalidate(symbol, reason='frozen_mismatch')
+        return mismatched
+
+    def _expire_closed(self):
+        expired = time.time() - self.closed_expired
+        for key in [key for key, closed_time in self._closed.items() if closed_time < expired]:
+            self._closed.pop(key)
+
+    def _apply(self, order):
+        key = self._key(order)
+        if order['status'] == 'closed':
+            now = time.time()
+            self._closed[order['order_id']] = now
+            if order.get('client_order_id'): self._closed[order['client_order_id']] = now
+            self._remove(key)
+            self.order_ids.pop(order['order_id'], None)
+        else:
+            self.orders[key] = order
+            self.order_ids[order['order_id']] = key
+
+    def _remove(self, key):
+        order = self.orders.pop(key, None)
+        if order: self.order_ids.pop(order['order_id'], None)
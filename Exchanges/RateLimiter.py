@@ -0,0 +1,154 @@
+import asyncio
+import heapq
+import itertools
+import threading
+import time
+
+from Metrics import metrics
+
+# 优先级车道， 数字越小越先发： 撤单 > 下单 > 查询
+PRIORITY_CANCEL = 0
+PRIORITY_PLACE = 1
+PRIORITY_READ = 2
+PRIORITY_NAMES = {PRIORITY_CANCEL: 'cancel', PRIORITY_PLACE: 'place', PRIORITY_READ: 'read'}
+
+
+class TokenBucket(object):
+    """
+    一个接口组的令牌桶， 容量 capacity， 每秒补充 rate 个。
+    交易所按固定窗口计数（window 秒内最多 limit 次）， 任意 window 内最多发出 capacity + rate * window 个请求，
+    所以取 capacity = limit * burst， rate = limit * (1 - burst) / window， 没有响应头也不会超限。
+    capacity 至少 1 个、 不超过 limit； limit 很小（capacity 取满 limit）时补充速度取 limit * burst / window， 不能为 0，
+    否则拿完第一个令牌以后永远等不到。 limit 小于 1 时报错。
+
+    等待的请求按 (priority, 到达顺序) 排队， 排在前面的请求先占令牌， 高优先级的请求总是插到低优先级前面。
+    blocked_until: 交易所告知额度已用完（剩余 0 或 429）时， 到窗口结束前不再发请求。
+    """
+
+    def __init__(self, limit, window, burst=0.1):
+        if limit < 1 or window <= 0: raise ValueError(f"invalid rate limit: {limit} per {window}s")
+        self.limit = limit
+        self.window = window
+        self.capacity = min(limit, max(limit * burst, 1))
+        self.rate = max(limit - self.capacity, limit * burst) / window
+        self.tokens = self.capacity
+        self.blocked_until = 0.0
+        self.waiters = list()
+
+        self._updated = time.time()
+
+    def refill(self, now):
+        if now > self._updated:
+            self.tokens = min(self.capacity, self.tokens + (now - self._updated) * self.rate)
+            self._updated = now
+
+    def delay(self, ticket, weight, now):
+        """
+        ticket 还要等多久才能拿到令牌， 0 表示现在就能拿
+        """
+        self.refill(now)
+        # 前面排着的请求也要消耗令牌
+        ahead = sum(w for t, w in self.waiters if t < ticket)
+        need = ahead + weight - self.tokens
+        return max(need / self.rate, self.blocked_until - now, 0.0)
+
+    def take(self, weight):
+        self.tokens -= weight
+
+
+class RateLimiter(object):
+    """
+    客户端限频： 每个接口组一个令牌桶， 请求在发出前排队等待令牌， 不会因为超限被拒绝。
+
+    limits: {group: (limit, window)}， 交易所对该组的限制为每 window 秒 limit 次；
+            不在 limits 里的组（包括 None）和 limit 为 None 的组不限频。
+    同步请求在 acquire() 里阻塞， 异步请求用 async_acquire()， 两者共用同一组令牌桶。
+    update() 用响应头里的剩余额度校正本地令牌， 其他进程 / 策略用同一个 key 时也不会超限。
+    """
+
+    def __init__(self, limits, name=None, burst=0.1):
+        self.name = name
+        self.buckets = {group: TokenBucket(limit[0], limit[1], burst) for group, limit in limits.items() if limit}
+
+        self._cond = threading.Condition()
+        self._seq = itertools.count()
+
+    def _enqueue(self, bucket, priority, weight):
+        ticket = (priority, next(self._seq))
+        heapq.heappush(bucket.waiters, (ticket, weight))
+        return ticket
+
+    def _try_take(self, bucket, ticket, weight):
+        # 调用方持有 self._cond， 返回 0 表示已拿到令牌并出队
+        wait = bucket.delay(ticket, weight, time.time())
+        if wait == 0:
+            bucket.take(weight)
+            bucket.waiters.remove((ticket, weight))
+            heapq.heapify(bucket.waiters)
+            self._cond.notify_all()
+        return wait
+
+    def _observe(self, group, priority, start_time):
+        wait = time.time() - start_time
+        lane = PRIORITY_NAMES.get(priority, priority)
+        metrics.observe('rate_limit_wait_seconds', wait, exchange=self.name, group=group, lane=lane)
+        if wait > 0.001: metrics.inc('rate_limit_throttled_total', exchange=self.name, group=group, lane=lane)
+
+    def acquire(self, group, priority=PRIORITY_READ, weight=1):
+        bucket = self.buckets.get(group)
+        if bucket is None: return
+        start_time = time.time()
+        with self._cond:
+            ticket = self._enqueue(bucket, priority, weight)
+            while True:
+                wait = self._try_take(bucket, ticket, weight)
+                if wait == 0: break
+                self._cond.wait(wait)
+        self._observe(group, priority, start_time)
+
+    async def async_acquire(self, group, priority=PRIORITY_READ, weight=1):
+        bucket = self.buckets.get(group)
+        if bucket is None: return
+        start_time = time.time()
+        with self._cond:
+            ticket = self._enqueue(bucket, priority, weight)
+        try:
+            while True:
+                with self._cond:
+                    wait = self._try_take(bucket, ticket, weight)
+                if wait == 0: break
+                await asyncio.sleep(wait)
+        except asyncio.CancelledError:
+            with self._cond:
+                if (ticket, weight) in bucket.waiters:
+                    bucket.waiters.remove((ticket, weight))
+                    heapq.heapify(bucket.waiters)
+                self._cond.notify_all()
+            raise
+        self._observe(group, priority, start_time)
+
+    def update(self, group, remain=None, expire=None, rejected=False):
+        """
+        remain: 交易所返回的当前窗口剩余次数； expire: 当前窗口结束的时间戳（秒）； rejected: 收到 429
+        """
+        bucket = self.buckets.get(group)
+        if bucket is None: return
+        now = time.time()
+        if rejected: metrics.inc('rate_limit_rejected_total', exchange=self.name, group=group)
+        with self._cond:
+            bucket.refill(now)
+            if remain is not None and remain < bucket.tokens:
+                bucket.tokens = max(remain, 0)
+            if rejected or (remain is not None and remain <= 0):
+                bucket.tokens = min(bucket.tokens, 0)
+                until = expire if expire and expire > now else now + bucket.window
+                bucket.blocked_until = max(bucket.blocked_until, until)
+            self._cond.notify_all()
+
+    def status(self):
+        now = time.time()
+        with self._cond:
+            for bucket in self.buckets.values(): bucket.refill(now)
+            return {group: {'tokens': round(bucket.tokens, 3), 'capacity': bucket.capacity, 'rate': bucket.rate,
+                            'waiting': len(bucket.waiters), 'blocked': max(bucket.blocked_until - now, 0)}
+                    for group, bucket in self.buckets.items()}
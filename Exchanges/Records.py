@@ -0,0 +1,118 @@
+class Record(object):
+    """
+    带 __slots__ 的定长记录， 比 dict 省内存、 创建快， 字段用属性访问。
+    同时兼容 dict 的读写方式（record['field']、 get、 keys、 items、 in、 dict(record)），
+    GridTrading 等按 dict 使用的代码不用改。
+    """
+    __slots__ = ()
+
+    def __getitem__(self, key):
+        try:
+            return getattr(self, key)
+        except (AttributeError, TypeError):
+            raise KeyError(key)
+
+    def __setitem__(self, key, value):
+        if key not in self.__slots__: raise KeyError(key)
+        setattr(self, key, value)
+
+    def __contains__(self, key):
+        return key in self.__slots__
+
+    def __iter__(self):
+        return iter(self.__slots__)
+
+    def __len__(self):
+        return len(self.__slots__)
+
+    def __eq__(self, other):
+        if isinstance(other, (Record, dict)):
+            return self.to_dict() == dict(other)
+        return NotImplemented
+
+    def __repr__(self):
+        return repr(self.to_dict())
+
+    def get(self, key, default=None):
+        return getattr(self, key, default) if key in self.__slots__ else default
+
+    def keys(self):
+        return self.__slots__
+
+    def values(self):
+        return [getattr(self, key) for key in self.__slots__]
+
+    def items(self):
+        return [(key, getattr(self, key)) for key in self.__slots__]
+
+    def update(self, **kwargs):
+        for key, value in kwargs.items():
+            self[key] = value
+
+    def to_dict(self):
+        return {key: getattr(self, key) for key in self.__slots__}
+
+    def copy(self):
+        record = self.__class__.__new__(self.__class__)
+        for key in self.__slots__:
+            setattr(record, key, getattr(self, key))
+        return record
+
+
+class Order(Record):
+    __slots__ = ('symbol', 'order_id', 'status', 'filled_size', 'side', 'average_price',
+                 'client_order_id', 'order_price', 'order_size', 'created_at', 'order_type')
+
+    def __init__(self, symbol, order_id, status, filled_size, side, average_price,
+                 client_order_id=None, order_price=0.0, order_size=0.0, created_at=0, order_type='limit'):
+        self.symbol = symbol
+        self.order_id = order_id
+        self.status = status  # open, closed
+        self.filled_size = filled_size
+        self.side = side  # buy, sell
+        self.average_price = average_price
+        self.client_order_id = client_order_id
+        self.order_price = order_price
+        self.order_size = order_size
+        self.created_at = created_at  # ms
+        self.order_type = order_type  # limit, market
+
+
+class Ticker(Record):
+    __slots__ = ('ask_price', 'bid_price', 'ask_size', 'bid_size', 'timestamp', 'symbol')
+
+    def __init__(self, ask_price, bid_price, ask_size, bid_size, timestamp, symbol):
+        self.ask_price = ask_price
+        self.bid_price = bid_price
+        self.ask_size = ask_size
+        self.bid_size = bid_size
+        self.timestamp = timestamp  # ms
+        self.symbol = symbol
+
+
+class Balance(Record):
+    __slots__ = ('currency', 'frozen', 'free', 'total')
+
+    def __init__(self, currency, frozen=0.0, free=0.0, total=0.0):
+        self.currency = currency
+        self.frozen = frozen
+        self.free = free
+        self.total = total
+
+
+class SymbolDetail(Record):
+    __slots__ = ('base_currency', 'quote_currency', 'price_precision', 'size_precision', 'symbol', 'tick_size',
+                 'min_order_value', 'min_limit_order_size')
+
+    def __init__(self, base_currency, quote_currency, price_precision, size_precision, symbol, tick_size,
+                 min_order_value, min_limit_order_size):
+        self.base_currency = base_currency
+        self.quote_currency = quote_currency
+        self.price_precision = price_precision
+        self.size_precision = size_precision
+        self.symbol = symbol
+        self.tick_size = tick_size
+        # 限价单和市价买单的最小下单金额， 以计价币种为单位
+        self.min_order_value = min_order_value
+        # 限价单最小下单量
+        self.min_limit_order_size = min_limit_order_size
@@ -1,8 +1,9 @@
 import logging
 import os
-import queue
 import threading
 import time
+import traceback
+from collections import deque
 
 import Settings
 from logging import handlers
@@ -10,7 +11,16 @@ from Utils import utils
 
 
 class MyLogger(logging.Logger):
-    def __init__(self, name, level='INFO', fmt=None, interval=1, backup_count=10, when='D'):
+    def __init__(self, name, level='INFO', fmt=None, interval=1, backup_count=10, when='D',
+                 queue_size=100000, full_policy='drop', batch_size=1000, log_dir="./Logs"):
+        """
+        queue_size: 日志队列上限， 磁盘慢时内存不会无限增长
+        full_policy: 队列满时的处理方式
+            drop: 丢弃 DEBUG/INFO 并计入 dropped， WARNING 及以上阻塞等待， 从不丢弃
+            block: 所有级别都阻塞等待
+        batch_size: 写线程每次最多取出并一次性写入的日志条数
+        log_dir: 日志文件目录
+        """
         super().__init__(name)
         self.setLevel(level.upper())
 
@@ -18,31 +28,67 @@ class MyLogger(logging.Logger):
         self._backup_count = backup_count
         self._when = when
         self._fmt = '[%(asctime)s] - %(levelname)s: %(message)s' if not fmt else fmt
-        self.log_dir = "./Logs"
+        self.log_dir = log_dir
         self.file_name = f"{self.log_dir}/{name}.log"
         self.working = False
-
-        self._que = queue.Queue()
-        self._level_callback = {
-            logging.INFO: super().info,
-            logging.WARNING: super().warning,
-            logging.DEBUG: super().debug,
-            logging.CRITICAL: super().critical,
-            logging.ERROR: super().error
-        }
+        self.dropped = 0
+
+        self._que = deque()
+        self._cond = threading.Condition()
+        self._queue_size = queue_size
+        self._full_policy = full_policy
+        self._batch_size = batch_size
+        self._reported_dropped = 0
         self._thread = threading.Thread(target=self.run)
         self._thread.daemon = True
 
         self._initialize()
 
     def run(self):
-        while self.working or not self._que.empty():
+        while True:
+            with self._cond:
+                while not self._que and self.working:
+                    self._cond.wait(1)
+                if not self._que: break
+                items = [self._que.popleft() for _ in range(min(len(self._que), self._batch_size))]
+                self._cond.notify_all()
             try:
-                level, msg = self._que.get(timeout=1)
-            except queue.Empty:
-                continue
-            if level in self._level_callback:
-                self._level_callback[level](msg)
+                self._write(items)
+            except Exception:
+                traceback.print_exc()
+
+    def _make_record(self, level, msg, args, created, ident):
+        # 格式化（包括 msg % args）推迟到写线程
+        record = self.makeRecord(self.name, level, "(unknown file)", 0, f"({ident}) {msg}", args, None)
+        record.created = created
+        record.msecs = int((created - int(created)) * 1000) + 0.0
+        return record
+
+    def _write(self, items):
+        records = [self._make_record(*item) for item in items]
+        if self.dropped != self._reported_dropped:
+            msg = f"(Logger) queue full, dropped {self.dropped - self._reported_dropped} DEBUG/INFO messages, total: {self.dropped}"
+            self._reported_dropped = self.dropped
+            records.append(self._make_record(logging.WARNING, msg, (), time.time(), threading.get_ident()))
+        for handler in list(self.handlers):
+            if isinstance(handler, logging.StreamHandler):
+                self._write_stream(handler, records)
+            else:
+                for record in records:
+                    handler.handle(record)
+
+    @staticmethod
+    def _write_stream(handler, records):
+        # 一个批次格式化后拼接， 每个 handler 只 write + flush 一次
+        records = [record for record in records if record.levelno >= handler.level]
+        if not records: return
+        text = ''.join(handler.format(record) + handler.terminator for record in records)
+        with handler.lock:
+            if isinstance(handler, handlers.BaseRotatingHandler) and handler.shouldRollover(records[0]):
+                handler.doRollover()
+            if handler.stream is None: return
+            handler.stream.write(text)
+            handler.flush()
 
     def set_log_name(self, name, clear_handlers=True):
         if clear_handlers:
@@ -69,27 +115,43 @@ class MyLogger(logging.Logger):
         self.setLevel(self.level)
 
     def warning(self, msg, *args, **kwargs):
-        self.put(logging.WARNING, msg)
-        utils.send(msg)
+        self.put(logging.WARNING, msg, args)
+        utils.send(msg % args if args else msg)
 
     def debug(self, msg, *args, **kwargs):
-        self.put(logging.DEBUG, msg)
+        self.put(logging.DEBUG, msg, args)
 
     def error(self, msg, *args, **kwargs):
-        self.put(logging.ERROR, msg)
-
-    def put(self, level, msg):
-        if self.working:
-            msg = f"({threading.current_thread().ident}) {msg}"
-            self._que.put((level, msg))
+        self.put(logging.ERROR, msg, args)
+        utils.send(msg % args if args else msg, severity='error')
+
+    def critical(self, msg, *args, **kwargs):
+        self.put(logging.CRITICAL, msg, args)
+        utils.send(msg % args if args else msg, severity='critical')
+
+    def put(self, level, msg, args=()):
+        # 先判断级别， 被过滤的日志不做任何格式化
+        if not self.working or not self.isEnabledFor(level): return
+        item = (level, msg, args, time.time(), threading.get_ident())
+        with self._cond:
+            while len(self._que) >= self._queue_size:
+                if level < logging.WARNING and self._full_policy == 'drop':
+                    self.dropped += 1
+                    return
+                self._cond.wait(1)
+            self._que.append(item)
+            self._cond.notify()
 
     def info(self, msg, *args, **kwargs):
-        for item in args:
-            msg += f" {item}"
-        self.put(logging.INFO, msg)
+        self.put(logging.INFO, msg, args)
+
+    def qsize(self):
+        return len(self._que)
 
     def stop(self):
         self.working = False
+        with self._cond:
+            self._cond.notify_all()
         self._thread.join()
         super().info("Logger Stopped")
 
@@ -99,7 +161,10 @@ class MyLogger(logging.Logger):
         self.info('Logger Started')
 
 
-logger = MyLogger(name='mm', level=Settings.configs.get('log_level', 'INFO'))
+logger = MyLogger(name='mm',
+                  level=Settings.configs.get('log_level', 'INFO'),
+                  queue_size=Settings.configs.get('log_queue_size', 100000),
+                  full_policy=Settings.configs.get('log_queue_full_policy', 'drop'))
 
 if __name__ == '__main__':
     logger.start()
@@ -1,11 +1,37 @@
+import multiprocessing
+
+import Settings
 from Logger import logger
+from Metrics import metrics
 from TradeSystem import TradeSystem
 from Utils import utils
 
-if __name__ == '__main__':
+
+def run(shard=0, num_shards=1):
+    if num_shards > 1:
+        # 每个进程单独的日志文件和 metrics 端口
+        logger.set_log_name(f"mm_{shard}")
+        if Settings.configs.get('metrics_port', 9108):
+            Settings.configs['metrics_port'] = Settings.configs.get('metrics_port', 9108) + shard
+        path = Settings.configs.get('metrics_snapshot_path', './Logs/metrics.json')
+        if path: Settings.configs['metrics_snapshot_path'] = path.replace('.json', f'_{shard}.json')
     logger.start()
-    mm_system = TradeSystem()
+    metrics.start()
+    mm_system = TradeSystem(shard=shard, num_shards=num_shards)
     mm_system.start()
     mm_system.join()
     utils.immediate_send_all_info()
+    metrics.stop()
     logger.stop()
+
+
+if __name__ == '__main__':
+    # num_processes: 把 strategies 分到多个进程， 每个进程有自己的 api、 连接池和 GIL
+    num_processes = Settings.configs.get('num_processes', 1)
+    if num_processes > 1:
+        processes = [multiprocessing.get_context('spawn').Process(target=run, args=(shard, num_processes), name=f"mm_{shard}")
+                     for shard in range(num_processes)]
+        for process in processes: process.start()
+        for process in processes: process.join()
+    else:
+        run()
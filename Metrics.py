@@ -0,0 +1,231 @@
+import bisect
+import json
+import threading
+import time
+import traceback
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+import Settings
+from Logger import logger
+
+
+def single(cls):
+    cls_dict = dict()
+
+    def wrapper(*args, **kwargs):
+        if cls not in cls_dict:
+            cls_dict.update({cls: cls(*args, **kwargs)})
+        return cls_dict[cls]
+
+    return wrapper
+
+
+def _latency_bounds(low=0.0001, high=120, factor=1.2):
+    # 100us ~ 120s 的等比分桶， 相邻桶相差 20%， 分位数误差不超过 20%
+    bounds = [low]
+    while bounds[-1] < high:
+        bounds.append(bounds[-1] * factor)
+    return bounds
+
+
+class Histogram(object):
+    bounds = _latency_bounds()
+
+    def __init__(self):
+        self.counts = [0] * (len(self.bounds) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, value):
+        index = bisect.bisect_left(self.bounds, value)
+        with self._lock:
+            self.counts[index] += 1
+            self.count += 1
+            self.sum += value
+            if value > self.max: self.max = value
+
+    def quantile(self, q):
+        with self._lock:
+            counts, count, max_value = list(self.counts), self.count, self.max
+        if not count: return 0.0
+        rank, cumulative = q * count, 0
+        for index, bucket_count in enumerate(counts):
+            cumulative += bucket_count
+            if cumulative >= rank:
+                return min(self.bounds[index], max_value) if index < len(self.bounds) else max_value
+        return max_value
+
+    def snapshot(self):
+        return {
+            'count': self.count,
+            'sum': self.sum,
+            'p50': self.quantile(0.5),
+            'p99': self.quantile(0.99),
+            'max': self.max
+        }
+
+
+class MetricsHandler(BaseHTTPRequestHandler):
+    registry = None
+
+    def do_GET(self):
+        if self.path.split('?')[0] not in ('/', '/metrics'):
+            self.send_error(404)
+            return
+        body = self.registry.to_prometheus().encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+@single
+class Metrics(object):
+    """
+    进程内指标： 延迟直方图（p50/p99/max）、 计数器和回调式 gauge。
+    observe / inc 只有一次字典查找和一次无竞争的加锁， 可以放在请求热路径上。
+    """
+
+    def __init__(self):
+        self.config = Settings.configs
+        self.histograms = dict()
+        self.counters = dict()
+        self.gauges = dict()
+        self.working = False
+
+        self._lock = threading.Lock()
+        self._server = None
+        self._thread = None
+
+    @staticmethod
+    def _key(name, labels):
+        return name, tuple(sorted(labels.items()))
+
+    def histogram(self, name, **labels):
+        key = self._key(name, labels)
+        histogram = self.histograms.get(key)
+        if histogram is None:
+            with self._lock:
+                histogram = self.histograms.setdefault(key, Histogram())
+        return histogram
+
+    def observe(self, name, value, **labels):
+        self.histogram(name, **labels).observe(value)
+
+    def inc(self, name, value=1, **labels):
+        key = self._key(name, labels)
+        with self._lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def register_gauge(self, name, callback, **labels):
+        self.gauges[self._key(name, labels)] = callback
+
+    def snapshot(self):
+        gauges = dict()
+        for key, callback in list(self.gauges.items()):
+            try:
+                gauges[key] = callback()
+            except Exception:
+                continue
+        return {
+            'time': time.time(),
+            'histograms': [dict(name=name, labels=dict(labels), **histogram.snapshot())
+                           for (name, labels), histogram in list(self.histograms.items())],
+            'counters': [dict(name=name, labels=dict(labels), value=value) for (name, labels), value in list(self.counters.items())],
+            'gauges': [dict(name=name, labels=dict(labels), value=value) for (name, labels), value in gauges.items()],
+        }
+
+    @staticmethod
+    def _escape(value):
+        return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+    @classmethod
+    def _format_labels(cls, labels, **extra):
+        labels = dict(labels, **extra)
+        if not labels: return ''
+        return '{' + ','.join(f'{k}="{cls._escape(v)}"' for k, v in labels.items()) + '}'
+
+    def to_prometheus(self):
+        """
+        同一个 metric family 的样本必须连续， 且只有一行 # TYPE： 先按 family 分组， 再依次输出
+        """
+        snapshot = self.snapshot()
+        families = dict()
+
+        def add(family, metric_type, line):
+            families.setdefault(family, (metric_type, list()))[1].append(line)
+
+        for item in snapshot['histograms']:
+            name, labels = item['name'], item['labels']
+            add(name, 'summary', f"{name}{self._format_labels(labels, quantile='0.5')} {item['p50']}")
+            add(name, 'summary', f"{name}{self._format_labels(labels, quantile='0.99')} {item['p99']}")
+            add(name, 'summary', f"{name}_sum{self._format_labels(labels)} {item['sum']}")
+            add(name, 'summary', f"{name}_count{self._format_labels(labels)} {item['count']}")
+            add(f"{name}_max", 'gauge', f"{name}_max{self._format_labels(labels)} {item['max']}")
+        for item in snapshot['counters']:
+            add(item['name'], 'counter', f"{item['name']}{self._format_labels(item['labels'])} {item['value']}")
+        for item in snapshot['gauges']:
+            add(item['name'], 'gauge', f"{item['name']}{self._format_labels(item['labels'])} {item['value']}")
+        lines = list()
+        for family, (metric_type, samples) in families.items():
+            lines.append(f"# TYPE {family} {metric_type}")
+            lines.extend(samples)
+        return '\n'.join(lines) + '\n'
+
+    def write_snapshot(self, path):
+        with open(path, 'w') as f:
+            json.dump(self.snapshot(), f)
+
+    def on_timer(self, path, period):
+        while self.working:
+            time.sleep(period)
+            try:
+                self.write_snapshot(path)
+            except Exception:
+                s = traceback.format_exc()
+                logger.info(f"(Metrics) write snapshot error: {s}")
+
+    def start(self):
+        """
+        metrics_port: Prometheus 文本格式的 http 端口（只监听 127.0.0.1）， 0 表示不开启
+        metrics_snapshot_path / metrics_snapshot_period: 定期写入 json 快照的文件和周期（秒）， 路径为空表示不写
+        """
+        if self.working: return
+        self.working = True
+        self.register_gauge('logger_queue_depth', logger.qsize)
+        self.register_gauge('logger_dropped_messages', lambda: logger.dropped)
+
+        port = self.config.get('metrics_port', 9108)
+        if port:
+            try:
+                MetricsHandler.registry = self
+                self._server = ThreadingHTTPServer(('127.0.0.1', port), MetricsHandler)
+                self._server.daemon_threads = True
+                server_thread = threading.Thread(target=self._server.serve_forever)
+                server_thread.daemon = True
+                server_thread.start()
+                logger.info(f"(Metrics) serving on http://127.0.0.1:{port}/metrics")
+            except OSError as e:
+                logger.info(f"(Metrics) start http server on port {port} failed: {e}")
+
+        path = self.config.get('metrics_snapshot_path', './Logs/metrics.json')
+        if path:
+            self._thread = threading.Thread(target=self.on_timer, args=(path, self.config.get('metrics_snapshot_period', 60)))
+            self._thread.daemon = True
+            self._thread.start()
+
+    def stop(self):
+        self.working = False
+        if self._server:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+
+
+metrics = Metrics()
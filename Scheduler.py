@@ -0,0 +1,231 @@
+import heapq
+import itertools
+import math
+import queue
+import threading
+import time
+import traceback
+
+import Settings
+from Logger import logger
+from Metrics import metrics
+
+
+def single(cls):
+    cls_dict = dict()
+
+    def wrapper(*args, **kwargs):
+        if cls not in cls_dict:
+            cls_dict.update({cls: cls(*args, **kwargs)})
+        return cls_dict[cls]
+
+    return wrapper
+
+
+class Task(object):
+    """
+    调度器中的一个任务， 同一个任务不会并发执行。
+
+    period: 固定频率执行的周期（秒）， 下一次的计划时间 = 上一次的计划时间 + period， 不随回调耗时漂移；
+            回调耗时超过 period 时跳过错过的轮次， 计入 overruns；
+            0 表示执行完立即再执行； None 表示只在 wake() 时执行（事件触发）
+    """
+
+    def __init__(self, scheduler, name, callback, period=None, params=None, error_interval=5):
+        self.name = name
+        self.period = period
+        self.error_interval = error_interval
+        self.state = 'stopped'  # stopped, scheduled, paused
+        self.running = False
+        self.runs = 0
+        self.overruns = 0
+        self.errors = 0
+
+        self._scheduler = scheduler
+        self._callback = callback
+        self._params = params if params else dict()
+        self._due = None
+        self._generation = 0
+        self._woken = False
+        self._idle = threading.Event()
+        self._idle.set()
+
+    def wake(self):
+        self._scheduler.wake(self)
+
+    def pause(self):
+        self._scheduler.pause(self)
+
+    def resume(self):
+        self._scheduler.resume(self)
+
+    def stop(self):
+        self._scheduler.stop(self)
+
+    def join(self, timeout=None):
+        # 等到任务停止且当前的回调执行完
+        return self._idle.wait(timeout)
+
+    def run(self):
+        start_time = time.time()
+        metrics.observe('scheduler_lag_seconds', max(start_time - self._due, 0), task=self.name)
+        try:
+            self._callback(**self._params)
+            return True
+        except Exception:
+            self.errors += 1
+            s = traceback.format_exc()
+            logger.info(f"({self.name}) caught error: {s}")
+            return False
+        finally:
+            self.runs += 1
+            metrics.observe('worker_loop_seconds', time.time() - start_time, worker=self.name)
+
+
+@single
+class Scheduler(object):
+    """
+    所有周期任务和事件触发任务共用一个调度线程和一个小线程池:
+    调度线程按计划时间维护一个最小堆， 到期的任务交给线程池执行， 执行完再按周期重新入堆。
+    暂停 / 停止的任务不在堆里， 不占线程也不轮询； 堆里作废的条目按 generation 惰性丢弃。
+    线程数至少是注册的任务数（同一个任务不会并发执行）， 卡在 HTTP 超时或限频等待的交易循环不会让紧急退出、 命令处理等任务排队。
+    """
+
+    def __init__(self, pool_size=None):
+        # 线程数的下限， 实际线程数随注册的任务数增加
+        self.pool_size = pool_size or Settings.configs.get('scheduler_pool_size', 4)
+        self.tasks = dict()
+
+        self._heap = list()
+        self._cond = threading.Condition()
+        self._seq = itertools.count()
+        self._ready = queue.Queue()
+        self._threads = list()
+        self._started = False
+
+    def add(self, name, callback, period=None, params=None, error_interval=5):
+        task = Task(self, name, callback, period=period, params=params, error_interval=error_interval)
+        with self._cond:
+            self.tasks[name] = task
+            if self._started: self._add_workers()
+        return task
+
+    def _add_workers(self):
+        # 调用方持有 self._cond； self._threads 的第一个是调度线程
+        for i in range(len(self._threads) - 1, max(self.pool_size, len(self.tasks))):
+            thread = threading.Thread(target=self._work, name=f'Scheduler-{i}')
+            thread.daemon = True
+            self._threads.append(thread)
+            thread.start()
+
+    def _start(self):
+        # 第一个任务启动时才创建线程
+        if self._started: return
+        self._started = True
+        dispatcher = threading.Thread(target=self._dispatch, name='Scheduler')
+        dispatcher.daemon = True
+        self._threads.append(dispatcher)
+        dispatcher.start()
+        self._add_workers()
+
+    def _push(self, task, due):
+        # 调用方持有 self._cond
+        task._generation += 1
+        task._due = due
+        heapq.heappush(self._heap, (due, next(self._seq), task._generation, task))
+        self._cond.notify()
+
+    def start(self, task, delay=0):
+        with self._cond:
+            self._start()
+            if task.state == 'scheduled': return
+            task.state = 'scheduled'
+            task._idle.clear()
+            if task.running: return
+            if task.period is None:
+                task._due = time.time()
+            else:
+                self._push(task, time.time() + delay)
+
+    def wake(self, task):
+        with self._cond:
+            if task.state != 'scheduled': return
+            if task.running:
+                task._woken = True
+            else:
+                self._push(task, time.time())
+
+    def pause(self, task):
+        with self._cond:
+            if task.state != 'scheduled': return
+            task.state = 'paused'
+            task._generation += 1
+
+    def resume(self, task):
+        with self._cond:
+            if task.state != 'paused': return
+            task.state = 'scheduled'
+            if not task.running: self._push(task, time.time())
+
+    def stop(self, task):
+        with self._cond:
+            if task.state == 'stopped': return
+            task.state = 'stopped'
+            task._generation += 1
+            if not task.running: task._idle.set()
+
+    def _dispatch(self):
+        while True:
+            with self._cond:
+                while True:
+                    now = time.time()
+                    # 丢掉已作废的条目
+                    while self._heap and self._heap[0][2] != self._heap[0][3]._generation:
+                        heapq.heappop(self._heap)
+                    if self._heap and self._heap[0][0] <= now: break
+                    self._cond.wait(self._heap[0][0] - now if self._heap else None)
+                _, _, _, task = heapq.heappop(self._heap)
+                task.running = True
+                task._generation += 1
+            self._ready.put(task)
+
+    def _work(self):
+        while True:
+            task = self._ready.get()
+            ok = task.run()
+            self._reschedule(task, ok)
+
+    def _reschedule(self, task, ok):
+        with self._cond:
+            task.running = False
+            if task.state == 'stopped':
+                task._idle.set()
+                return
+            if task.state != 'scheduled': return
+            now = time.time()
+            if task._woken:
+                task._woken = False
+                self._push(task, now)
+            elif not ok:
+                self._push(task, now + task.error_interval)
+            elif task.period is None:
+                return
+            elif task.period == 0:
+                self._push(task, now)
+            else:
+                due = task._due + task.period
+                if due <= now:
+                    # 回调超时， 跳过错过的轮次， 保持原来的相位
+                    missed = math.floor((now - due) / task.period) + 1
+                    task.overruns += missed
+                    metrics.inc('scheduler_overruns_total', missed, task=task.name)
+                    due += missed * task.period
+                self._push(task, due)
+
+    def status(self):
+        with self._cond:
+            return {name: {'state': task.state, 'running': task.running, 'period': task.period, 'runs': task.runs,
+                           'overruns': task.overruns, 'errors': task.errors} for name, task in self.tasks.items()}
+
+
+scheduler = Scheduler()
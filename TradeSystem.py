@@ -1,53 +1,134 @@
-import time
+import importlib
 
 import Settings
 from ApiBuilder import api_builder
 
+import ControlServer
+from ExchangeFailureManager import exchange_failure_manager
 from Logger import logger
 from Worker import Worker
-from strategies import GridTrading
+
+
+def get_strategy_configs(config, shard=0, num_shards=1):
+    """
+    config['strategies']: 策略列表， 每一项覆盖全局配置中的同名项， 比如
+        [{'strategy': 'GridTrading', 'symbol': 'ETHUSDT', 'base_currency': 'eth', 'quote_currency': 'usdt'}, ...]
+    没有 strategies 时按全局配置跑一个 GridTrading。
+    多进程时第 i 项默认分到 i % num_shards 号进程， 也可以用 'shard' 指定。
+    """
+    items = config.get('strategies') or [dict()]
+    configs = list()
+    for index, item in enumerate(items):
+        if item.get('shard', index) % num_shards != shard: continue
+        strategy_config = {k: v for k, v in config.items() if k != 'strategies'}
+        strategy_config.update(item)
+        strategy_config.setdefault('strategy', 'GridTrading')
+        if len(items) > 1: strategy_config.setdefault('strategy_name', f"{strategy_config['strategy']}_{strategy_config['symbol']}")
+        configs.append(strategy_config)
+    return configs
 
 
 class TradeSystem:
-    def __init__(self, name=None):
+    def __init__(self, name=None, shard=0, num_shards=1):
         self.name = self.__class__.__name__ if not name else name
         self.config = Settings.configs
-        self.api = api_builder.get_default_api()
+        self.shard = shard
+        self.num_shards = num_shards
+        # 多进程时每个进程有自己的命令文件和 socket
+        suffix = f".{shard}" if num_shards > 1 else ""
 
-        self.worker_process_command = Worker(name="ProcessCommand", callback=self.process_command)
-        self.command_file_name = "Command.txt"
+        # Command.txt 保留兼容， 立即生效的命令走 control_socket_path（unix domain socket）
+        self.worker_process_command = Worker(name="ProcessCommand", callback=self.process_command_file, period=5)
+        self.command_file_name = f"Command{suffix}.txt"
+        self.control_socket_path = self.config.get('control_socket_path', './Command.sock')
+        if self.control_socket_path: self.control_socket_path += suffix
+        self.control_server = None
         self.support_command = {
             "exit": self.process_command_exit,
-            "stop": self.process_command_exit
+            "stop": self.process_command_exit,
+            "pause": self.process_command_pause,
+            "resume": self.process_command_resume,
+            "status": self.process_command_status,
+            "cancel_all": self.process_command_cancel_all,
+            "set": self.process_command_set,
         }
         with open(self.command_file_name, 'w'): pass
 
-        # 第一版只支持 GridTrading
-        self.strategy = GridTrading.GridTrading(config=self.config, api=self.api)
+        # 同一账户的策略共用一个 api， 同一交易所的账户共用行情数据
+        self.strategies = dict()
+        for config in get_strategy_configs(self.config, shard, num_shards):
+            strategy = self._build_strategy(config)
+            if strategy.name in self.strategies: raise ValueError(f"({self.name}) duplicate strategy name: {strategy.name}")
+            self.strategies[strategy.name] = strategy
+
+    @staticmethod
+    def _build_strategy(config):
+        module = importlib.import_module(f"strategies.{config['strategy']}")
+        return getattr(module, config['strategy'])(config=config, api=api_builder.get_config_api(config))
 
-    def process_command(self):
+    def _get_strategies(self, name=None):
+        if name is None: return list(self.strategies.values())
+        if name not in self.strategies: raise KeyError(f"unknown strategy: {name}, strategies: {list(self.strategies)}")
+        return [self.strategies[name]]
+
+    def process_command_file(self):
         with open(self.command_file_name) as f:
             commands = f.readline().split()
         if commands:
             with open(self.command_file_name, 'w') as f:
                 pass
-            if len(commands) == 1 and commands[0] in self.support_command:
-                logger.info(f"({self.name}) process command: {commands[0]}")
-                self.support_command[commands[0]]()
-            else:
-                logger.info(f"({self.name}) command error: {''.join(commands)}")
-        time.sleep(5)
+            try:
+                self.process_command(commands)
+            except Exception as e:
+                logger.info(f"({self.name}) command error: {' '.join(commands)}, {e}")
+
+    def process_command(self, commands):
+        if not commands or commands[0] not in self.support_command:
+            raise ValueError(f"unsupported command: {' '.join(commands)}, supported: {list(self.support_command)}")
+        logger.info(f"({self.name}) process command: {' '.join(commands)}")
+        return self.support_command[commands[0]](*commands[1:])
 
     def process_command_exit(self):
         self.stop()
 
+    def process_command_pause(self, name=None):
+        for strategy in self._get_strategies(name):
+            strategy.pause()
+
+    def process_command_resume(self, name=None):
+        for strategy in self._get_strategies(name):
+            strategy.resume()
+
+    def process_command_status(self, name=None):
+        return {strategy.name: strategy.status() for strategy in self._get_strategies(name)}
+
+    def process_command_cancel_all(self, name=None):
+        return {strategy.name: strategy.api.cancel_all(strategy.symbol) for strategy in self._get_strategies(name)}
+
+    def process_command_set(self, key, value, name=None):
+        return {strategy.name: strategy.set_param(key, value) for strategy in self._get_strategies(name)}
+
     def start(self):
-        logger.info(f"({self.name}) start")
+        logger.info(f"({self.name}) start, shard {self.shard}/{self.num_shards}, strategies: {list(self.strategies)}")
         self.worker_process_command.start()
-        self.strategy.start()
+        if self.control_socket_path and ControlServer.is_supported():
+            self.control_server = ControlServer.ControlServer(self.control_socket_path, self.process_command)
+            self.control_server.start()
+        exchange_failure_manager.set_command_handler(self.process_command)
+        for strategy in self.strategies.values():
+            strategy.start()
 
     def stop(self):
-        self.strategy.stop()
+        for strategy in self.strategies.values():
+            strategy.stop()
+        # 策略都撤完单以后再停 api 的 ws 和后台任务
+        for api in list(api_builder.apis.values()):
+            api.stop()
+        exchange_failure_manager.set_command_handler(None)
+        if self.control_server:
+            self.control_server.stop()
+            self.control_server = None
+        # 最后停 ProcessCommand， join() 返回时其他部分都已停止
         self.worker_process_command.stop()
         logger.info(f"({self.name}) stop")
 
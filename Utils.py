@@ -1,90 +1,200 @@
-import json
 import time
 import threading
-import traceback
 import requests
 
+from collections import deque
 from datetime import datetime
 
+from Codec import codec
 from Settings import ROBOT_URL, configs
 
-RATE_LIMIT = ([0] * 15, threading.Lock())
 TIMEOUT = 5
 
 
+class Notifier:
+    """
+    告警通知（钉钉机器人 webhook）。
+
+    notify 只在锁内更新一次字典就返回， 不做网络请求、 不等限频， 日志线程和 worker 线程可以放心调用；
+    相同的告警合并为一条并计数， 按级别分批： critical 尽快发出， 其余级别至少间隔 batch_period 秒发一批；
+    后台线程按 webhook 的限频（每 rate_window 秒最多 rate_limit 条）发送， 限频时等待的也是后台线程。
+    每个级别最多缓存 max_pending 条不同的告警， 超出的只计数； 一条消息最长 max_message_size 个字符。
+    """
+
+    SEVERITIES = ('critical', 'error', 'warning')
+
+    def __init__(self, url, name='', batch_period=120, rate_limit=15, rate_window=60, max_pending=1000,
+                 max_message_size=4000, timeout=TIMEOUT):
+        self.url = url
+        self.name = name
+        self.batch_period = batch_period
+        self.rate_limit = rate_limit
+        self.rate_window = rate_window
+        self.max_pending = max_pending
+        self.max_message_size = max_message_size
+        self.timeout = timeout
+
+        # severity -> {message: [count, first_time, last_time]}， dict 保持插入顺序
+        self.pending = {severity: dict() for severity in self.SEVERITIES}
+        self.dropped = dict.fromkeys(self.SEVERITIES, 0)
+        self.sent = 0
+        self.errors = 0
+        self.last_sent = dict.fromkeys(self.SEVERITIES, 0)
+
+        self._sent_times = deque(maxlen=rate_limit)
+        self._cond = threading.Condition()
+        self._thread = None
+        self._post_lock = threading.Lock()
+        self._session = requests.Session()
+
+    def notify(self, message, severity='warning'):
+        if severity not in self.pending: severity = 'warning'
+        now = time.time()
+        with self._cond:
+            pending = self.pending[severity]
+            item = pending.get(message)
+            if item is not None:
+                item[0] += 1
+                item[2] = now
+            elif len(pending) < self.max_pending:
+                pending[message] = [1, now, now]
+            else:
+                self.dropped[severity] += 1
+            if severity == 'critical' or item is None: self._cond.notify()
+        self._start()
+
+    def _start(self):
+        # 第一次有告警时才启动发送线程
+        if self._thread: return
+        with self._cond:
+            if self._thread: return
+            self._thread = threading.Thread(target=self._run, name='Notifier')
+            self._thread.daemon = True
+            self._thread.start()
+
+    def _due(self, severity, now):
+        if not self.pending[severity] and not self.dropped[severity]: return None
+        return now if severity == 'critical' else self.last_sent[severity] + self.batch_period
+
+    def _rate_limited_until(self, now):
+        # 最近 rate_limit 条里最早的一条过了 rate_window 秒才能再发
+        if len(self._sent_times) < self.rate_limit: return now
+        return self._sent_times[0] + self.rate_window
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while True:
+                    now = time.time()
+                    dues = [(due, severity) for severity in self.SEVERITIES
+                            for due in [self._due(severity, now)] if due is not None]
+                    if dues:
+                        due = max(min(dues)[0], self._rate_limited_until(now))
+                        if due <= now: break
+                    self._cond.wait(due - now if dues else None)
+                # 到期的级别里最高的一个
+                severity = next(severity for due, severity in sorted(dues, key=lambda item: self.SEVERITIES.index(item[1]))
+                                if due <= now)
+                batch = self._take(severity, now)
+            self._post(batch)
+
+    def _take(self, severity, now):
+        # 调用方持有 self._cond
+        pending, dropped = self.pending[severity], self.dropped[severity]
+        self.pending[severity], self.dropped[severity] = dict(), 0
+        self.last_sent[severity] = now
+        self._sent_times.append(now)
+        return self.format_batch(severity, pending, dropped)
+
+    def format_batch(self, severity, pending, dropped=0):
+        """
+        一批告警拼成一条消息， 超过 max_message_size 的部分只保留条数
+        """
+        text, separator = f"[{severity.upper()}] {self.name}", '\n===============\n'
+        items = list(pending.items())
+        for index, (message, (count, first_time, last_time)) in enumerate(items):
+            if count > 1:
+                line = f"{message} [x{count}, {datetime.fromtimestamp(first_time):%F %X} ~ {datetime.fromtimestamp(last_time):%X}]"
+            else:
+                line = f"{message} [{datetime.fromtimestamp(first_time):%F %X}]"
+            if len(text) + len(line) + 200 > self.max_message_size:
+                rest = items[index:]
+                text += f"{separator}... {len(rest)} more ({sum(item[0] for _, item in rest)} alerts) truncated"
+                break
+            text += ('\n' if index == 0 else separator) + line
+        if dropped: text += f"{separator}... {dropped} more {severity} dropped"
+        return text
+
+    def _post(self, text):
+        try:
+            with self._post_lock:
+                self.post(text)
+            self.sent += 1
+        except Exception:
+            # 发送失败不重试， 告警不能反过来影响交易； 这里不能写 logger.warning， 否则会再产生告警
+            self.errors += 1
+
+    def post(self, text, msgtype='text', atMobiles=None, isAtAll=True, title='======'):
+        data = {
+            "msgtype": msgtype,
+            "at": {"atMobiles": atMobiles or list(), "isAtAll": isAtAll}
+        }
+        if msgtype == 'markdown':
+            data["markdown"] = {"title": title, "text": text}
+        else:
+            data["text"] = {"content": text}
+        header = {"Content-Type": "application/json; charset=utf-8"}
+        return codec.loads(self._session.post(self.url, timeout=self.timeout, data=codec.dumps(data), headers=header).content)
+
+    def flush(self):
+        """
+        退出前把缓存的告警全部发出， 不等 batch_period， 限频时在调用方线程等待
+        """
+        for severity in self.SEVERITIES:
+            with self._cond:
+                if not self.pending[severity] and not self.dropped[severity]: continue
+                now = time.time()
+                wait = self._rate_limited_until(now) - now
+            if wait > 0: time.sleep(wait)
+            with self._cond:
+                batch = self._take(severity, time.time())
+            self._post(batch)
+
+    def status(self):
+        with self._cond:
+            return {
+                'pending': {severity: sum(item[0] for item in pending.values()) for severity, pending in self.pending.items()},
+                'dropped': dict(self.dropped),
+                'sent': self.sent,
+                'errors': self.errors,
+            }
+
+
 class Utils:
     # MakerWarning
     TIMEOUT = 5
 
     def __init__(self):
         self.remote_server = None
-        self.send_warning_period = 120
-        self.send_warning_last_time = 0
-        self.warnings = list()
-        self.thread_send_warning = threading.Thread(target=self.worker)
-        self.thread_send_warning.daemon = True
-        self.thread_send_warning.start()
-
         self._configs = configs.copy()
         self.name = self._configs.get('name', "")
-
-    def send(self, warning, label="MarketMaker"):
-        c_time = datetime.now().strftime("%F %X")
-        warning = f"({label}@ {self.name}@ {c_time}) {warning}"
-        self.warnings.append(warning)
-
-    def worker(self):
-        from Logger import logger
-        self.logger = logger
-        while True:
-            try:
-                cur_time = time.time()
-                if self.warnings and (cur_time - self.send_warning_last_time > self.send_warning_period):
-                    warnings = '\n===============\n'.join(self.warnings)
-                    self.warnings = list()
-                    self._send(warnings)
-                    self.send_warning_last_time = cur_time
-                else:
-                    time.sleep(1)
-            except Exception as e:
-                s = traceback.format_exc()
-                self.logger.info(f"send info error: {s}")
-                time.sleep(10)
-
-    def _send(self, warning, msgtype='text', atMobiles=None, isAtAll=True, title='======'):
-        with RATE_LIMIT[1]:
-            pre, cur = RATE_LIMIT[0].pop(0), time.time()
-            if cur - pre < 60: time.sleep(pre + 60 - cur)
-            RATE_LIMIT[0].append(time.time())
-            if atMobiles is None: atMobiles = list()
-            data = {
-                "msgtype": msgtype,
-                "at": {"atMobiles": atMobiles, "isAtAll": isAtAll}
-            }
-
-            if msgtype == 'markdown':
-                data.update(self.markdown_info(warning, title))
-            else:
-                data.update(self.text_info(warning))
-
-            header = {"Content-Type": "application/json; charset=utf-8"}
-            response = requests.post(ROBOT_URL, timeout=self.TIMEOUT, data=json.dumps(data), headers=header).json()
-
-    def text_info(self, warning):
-        return {"text": {"content": warning}}
-
-    def markdown_info(self, warning, title):
-        return {"markdown": {
-            "title": title,
-            "text": warning}}
+        self.notifier = Notifier(url=ROBOT_URL,
+                                 name=self.name,
+                                 batch_period=self._configs.get('alert_batch_period', 120),
+                                 rate_limit=self._configs.get('alert_rate_limit', 15),
+                                 rate_window=self._configs.get('alert_rate_window', 60),
+                                 max_pending=self._configs.get('alert_max_pending', 1000),
+                                 timeout=self.TIMEOUT)
+
+    def send(self, warning, label="MarketMaker", severity='warning'):
+        # 时间放在合并计数里， 消息本身不带时间， 相同的告警才能合并
+        self.notifier.notify(f"({label}@ {self.name}) {warning}", severity=severity)
 
     def get_now_time(self):
         return datetime.now().strftime('%F %H:%M')
 
     def immediate_send_all_info(self):
-        if self.warnings:
-            warnings = '\n===============\n'.join(self.warnings)
-            self._send(warnings)
+        self.notifier.flush()
 
 
 utils = Utils()
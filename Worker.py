@@ -1,53 +1,51 @@
-
-import queue
-import threading
-import time
-import traceback
-
 from Logger import logger
+from Scheduler import scheduler
 from typing import Callable, Any
 
 
 class Worker:
+    """
+    周期任务， 运行在共享的 Scheduler 上， 不再单独占一个线程。
+    period 为固定频率（不随 callback 耗时漂移）， period=None 表示只在 wake() 时执行。
+    """
+
     def __init__(self, name: str, callback: Callable, msg: str = "", period: int = 0, params: Any = None, enable=True, pause_period=1):
         self.name = name
         self.working = False
         self.pause = False
+        # 兼容旧参数， 暂停的任务不再轮询
         self.pause_period = pause_period
 
-        self._callback = callback
         self._msg = msg
-        self._params = params if params else dict()
-        self._period = period if period >= 0 else 0
-
-        self._thread = threading.Thread(target=self._run)
-        self._thread.daemon = True
-        self._error_interval = 5
+        self._period = period if period is None or period >= 0 else 0
         self._enable = enable
+        self._task = scheduler.add(name, callback, period=self._period, params=params)
 
-    def _run(self):
-        while self.working:
-            try:
-                if not self.pause:
-                    self._callback(**self._params)
-                else:
-                    time.sleep(self.pause_period)
-                time.sleep(self._period)
-            except queue.Empty:
-                pass
-            except Exception:
-                s = traceback.format_exc()
-                logger.info(f"({self.name}) caught error: {s}")
-                time.sleep(self._error_interval)
+    @property
+    def overruns(self):
+        return self._task.overruns
+
+    def set_period(self, period):
+        # 从下一次调度开始生效
+        self._period = period
+        self._task.period = period
+
+    def wake(self):
+        # 跳过本轮剩余的 period， 立即执行下一次 callback
+        self._task.wake()
 
     def set_pause(self, info=''):
         self.pause = True
+        self._task.pause()
         logger.info(f"({self.name}) set_pause: {self.pause}, {info}")
 
     def restart(self, info=''):
         self.pause = False
         logger.info(f"({self.name}) restart set_pause: {self.pause}, {info}")
-        self.start()
+        if self.working:
+            self._task.resume()
+        else:
+            self.start()
 
     def start(self):
         if not self._enable:
@@ -57,15 +55,15 @@ class Worker:
 
         if not self.working:
             self.working = True
-            self._thread.start()
+            scheduler.start(self._task)
             logger.info(f"({self.name}) Worker started {self._msg}")
 
     def stop(self):
         if self.working:
             self.working = False
-            # self._thread.join()
+            self._task.stop()
             logger.info(f"({self.name}) Worker stopped {self._msg} enable is {self._enable}")
 
     def join(self, timeout=None):
-        self._thread.join(timeout=timeout)
-
+        # 等到 stop() 之后当前的 callback 执行完
+        return self._task.join(timeout=timeout)
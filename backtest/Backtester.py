@@ -0,0 +1,166 @@
+import argparse
+import time
+
+import numpy as np
+import pandas as pd
+
+import Settings
+from backtest.SimExchangeApi import SimExchangeApi
+from strategies.GridTrading import GridTrading
+
+
+def load_klines(path):
+    """
+    csv / parquet， columns: ['timestamp', 'open', 'high', 'low', 'close', 'volume']， timestamp 单位 秒
+    """
+    klines = pd.read_parquet(path) if path.endswith('.parquet') else pd.read_csv(path)
+    return klines.rename(columns={'id': 'timestamp', 'amount': 'volume'}).sort_values('timestamp').reset_index(drop=True)
+
+
+class Backtester:
+    """
+    在虚拟时钟上驱动 GridTrading.trade： 每根 bar 先撮合挂单， 再在 bar 收盘时调用一次 trade。
+
+    fast_forward: 当挂单不会被撤、 没有挂单的一边余额也不够下单时， trade 在之后的 bar 上什么都不会做，
+    直到某根 bar 触发成交、 目标价偏离挂单价超过 reorder_rate 或者可以下新单。 这里用 NumPy 一次算出所有 bar 的目标价，
+    向量化地找到下一根需要处理的 bar， 直接跳过中间的 bar， 结果与逐根回放相同。
+    多档网格（max_num_active_order >= 4）不快进； 假设 min_quote_lifetime 不超过一根 bar 的时长， 否则跳过的 bar 上挂单的 "太新不撤" 判断会不同。
+    """
+
+    def __init__(self, config, klines, balances, symbol_details, maker_fee=0.002, taker_fee=0.002, fast_forward=True):
+        self.name = self.__class__.__name__
+        self.config = config
+        self.fast_forward = fast_forward
+        self.api = SimExchangeApi(klines,
+                                  symbol=config['symbol'],
+                                  base_currency=config['base_currency'],
+                                  quote_currency=config['quote_currency'],
+                                  balances=balances,
+                                  symbol_details=symbol_details,
+                                  maker_fee=maker_fee,
+                                  taker_fee=taker_fee)
+        self.strategy = GridTrading(config=config, api=self.api)
+        self.steps = list()
+        self._target_buy, self._target_sell = self._target_prices()
+        self._min_order_size = self.api.get_min_limit_order_size(self.api.symbol)
+        self._min_order_value = self.api.get_min_order_value(self.api.symbol)
+
+    def _target_prices(self):
+        # 与 GridTrading.update_current_price 相同的计算， 对所有 bar 一次完成
+        strategy = self.strategy
+        ma = self.api.rolling_mean(strategy.ma_kline_size, strategy.ma_kline_source)
+        bid, ask = self.api.bid_ask()
+        sell = ma * (1 + strategy.spread_rate)
+        buy = ma * (1 - strategy.spread_rate)
+        buy = np.where(buy >= bid, bid + 2 * strategy.tick_size, buy)
+        sell = np.where(sell <= ask, ask - 2 * strategy.tick_size, sell)
+        return buy, sell
+
+    def _is_idle(self):
+        # 有挂单的一边余额不会触发撤单， 且每边最多一个挂单
+        strategy, api = self.strategy, self.api
+        # 多档网格不快进， 逐根回放
+        if strategy.grid_levels > 1: return False
+        orders = list(api.orders.values())
+        sides = [order['side'] for order in orders]
+        if len(orders) > strategy.max_num_active_order or len(sides) != len(set(sides)): return False
+        # 挂单数量不变时与价格无关（可用余额占总资金的比例）， 跳过的 bar 上结果相同
+        return all(strategy.keeps_size(order['side'], api.balances, order) for order in orders)
+
+    def _hits(self, start, end):
+        """
+        [start, end) 中 trade 需要动作的 bar： 挂单成交、 目标价偏离挂单价超过 reorder_rate，
+        或者没有挂单的一边余额足够下单（与 check_order_size 相同的条件）
+        """
+        api, strategy = self.api, self.strategy
+        target_buy, target_sell = self._target_buy[start:end], self._target_sell[start:end]
+        prices = {order['side']: order['order_price'] for order in api.orders.values()}
+        hit = np.zeros(end - start, dtype=bool)
+        if 'buy' in prices:
+            hit |= (api.low[start:end] <= prices['buy']) | (np.abs(1 - target_buy / prices['buy']) >= strategy.reorder_rate)
+        else:
+            quote = api.balances[strategy.quote_currency]['free']
+            hit |= (quote / target_buy >= self._min_order_size) & (quote >= self._min_order_value)
+        if 'sell' in prices:
+            hit |= (api.high[start:end] >= prices['sell']) | (np.abs(1 - target_sell / prices['sell']) >= strategy.reorder_rate)
+        else:
+            base = api.balances[strategy.base_currency]['free']
+            hit |= (base >= self._min_order_size) & (base * target_sell >= self._min_order_value)
+        return hit
+
+    def _next_index(self, index, chunk=4096):
+        if not self.fast_forward or not self._is_idle(): return index + 1
+        start, total = index + 1, len(self.api)
+        while start < total:
+            end = min(start + chunk, total)
+            hit = self._hits(start, end)
+            if hit.any(): return start + int(np.argmax(hit))
+            start, chunk = end, chunk * 2
+        return total
+
+    def run(self):
+        api, strategy = self.api, self.strategy
+        index = strategy.ma_kline_size - 1
+        start_time = time.time()
+        while index < len(api):
+            api.set_index(index)
+            api.match_orders(index)
+            strategy.trade()
+            self.steps.append((index, api.balances[strategy.base_currency]['total'], api.balances[strategy.quote_currency]['total']))
+            index = self._next_index(index)
+        return self.report(time.time() - start_time)
+
+    def equity_curve(self):
+        # 跳过的 bar 上余额不变， 用 searchsorted 把每次 trade 后的余额前向填充到所有 bar
+        steps = np.array(self.steps)
+        indexes = np.arange(int(steps[0, 0]), len(self.api))
+        positions = np.searchsorted(steps[:, 0], indexes, side='right') - 1
+        return steps[positions, 2] + steps[positions, 1] * self.api.close[indexes]
+
+    def report(self, elapsed):
+        equity = self.equity_curve()
+        drawdown = 1 - equity / np.maximum.accumulate(equity)
+        return {
+            'bars': len(self.api),
+            'trade_calls': len(self.steps),
+            'elapsed': elapsed,
+            'fills': len(self.api.trades),
+            'fees': self.api.fees,
+            'start_equity': float(equity[0]),
+            'end_equity': float(equity[-1]),
+            'return': float(equity[-1] / equity[0] - 1),
+            'max_drawdown': float(drawdown.max()),
+            'balances': self.api.get_balances(),
+        }
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Replay GridTrading over historical klines')
+    parser.add_argument('klines', help='csv / parquet with timestamp, open, high, low, close, volume')
+    parser.add_argument('--base', type=float, default=0.0, help='initial base currency balance')
+    parser.add_argument('--quote', type=float, default=10000.0, help='initial quote currency balance')
+    parser.add_argument('--maker-fee', type=float, default=0.002)
+    parser.add_argument('--taker-fee', type=float, default=0.002)
+    parser.add_argument('--price-precision', type=int, default=2)
+    parser.add_argument('--size-precision', type=int, default=6)
+    parser.add_argument('--min-order-value', type=float, default=5)
+    parser.add_argument('--min-order-size', type=float, default=0.0001)
+    parser.add_argument('--no-fast-forward', action='store_true')
+    args = parser.parse_args()
+
+    configs = Settings.configs
+    backtester = Backtester(config=configs,
+                            klines=load_klines(args.klines),
+                            balances={configs['base_currency']: args.base, configs['quote_currency']: args.quote},
+                            symbol_details={
+                                "price_precision": args.price_precision,
+                                "size_precision": args.size_precision,
+                                "tick_size": 10 ** -args.price_precision,
+                                "min_order_value": args.min_order_value,
+                                "min_limit_order_size": args.min_order_size,
+                            },
+                            maker_fee=args.maker_fee,
+                            taker_fee=args.taker_fee,
+                            fast_forward=not args.no_fast_forward)
+    for k, v in backtester.run().items():
+        print(f"{k}: {v}")
@@ -0,0 +1,295 @@
+import numpy as np
+import pandas as pd
+
+from Exchanges.BaseExchangeApi import BaseExchangeApi
+
+
+class SimExchangeApi(BaseExchangeApi):
+    """
+    回测用的模拟交易所， 行情来自历史 K 线， 当前时刻由 set_index 推进（虚拟时钟）。
+
+    - 每根 bar 收盘时策略看到的 ticker: bid = close, ask = close + tick_size
+    - 挂单在之后的 bar 中按 high/low 撮合： 买单 low <= price， 卖单 high >= price， 以挂单价成交， 收 maker_fee
+    - 下单时已可成交的（买价 >= ask / 卖价 <= bid）立即以对手价成交， 收 taker_fee
+    """
+
+    def __init__(self, klines: pd.DataFrame, symbol, base_currency, quote_currency, balances, symbol_details,
+                 maker_fee=0.002, taker_fee=0.002, name='sim', **kwargs):
+        """
+        klines: columns ['timestamp', 'open', 'high', 'low', 'close', 'volume']， 按时间升序
+        balances: {'btc': 1.0, 'usdt': 10000.0}
+        symbol_details: 同 format_symbol_details 中单个交易对的格式
+        """
+        super().__init__(name=name, symbol=symbol, **kwargs)
+        self.symbol = symbol.upper()
+        self.base_currency = base_currency
+        self.quote_currency = quote_currency
+        self.symbol_details = {self.symbol: dict(symbol_details, symbol=self.symbol)}
+        self.maker_fee = maker_fee
+        self.taker_fee = taker_fee
+
+        self.timestamps = klines['timestamp'].to_numpy(dtype=np.int64)
+        self.open = klines['open'].to_numpy(dtype=np.float64)
+        self.high = klines['high'].to_numpy(dtype=np.float64)
+        self.low = klines['low'].to_numpy(dtype=np.float64)
+        self.close = klines['close'].to_numpy(dtype=np.float64)
+        self.volume = klines['volume'].to_numpy(dtype=np.float64)
+        self.tick_size = self.get_tick_size(self.symbol)
+        self.index = 0
+
+        self.balances = {currency: {"currency": currency, "frozen": 0.0, "free": float(balances.get(currency, 0)), "total": float(balances.get(currency, 0))}
+                         for currency in (base_currency, quote_currency)}
+        self.orders = dict()
+        self.trades = list()
+        self.fees = 0.0
+        self._ma = dict()
+        self._order_id = 0
+
+    def __len__(self):
+        return len(self.close)
+
+    def set_index(self, index):
+        self.index = index
+
+    def now(self):
+        # 虚拟时钟， 当前 bar 的时间
+        return float(self.timestamps[self.index]) * 1000
+
+    def rolling_mean(self, size, source='close'):
+        """
+        所有 bar 的 size 周期均线， 一次 cumsum 算完， 不足 size 根的位置为 nan
+        """
+        key = (size, source)
+        if key not in self._ma:
+            values = getattr(self, source)
+            cumsum = np.concatenate(([0.0], np.cumsum(values)))
+            ma = np.full(len(values), np.nan)
+            ma[size - 1:] = (cumsum[size:] - cumsum[:-size]) / size
+            self._ma[key] = ma
+        return self._ma[key]
+
+    def bid_ask(self):
+        return self.close, self.close + self.tick_size
+
+    # ---------------- 撮合 ----------------
+
+    def match_orders(self, index):
+        """
+        用第 index 根 bar 的 high/low 撮合挂单
+        """
+        if not self.orders: return
+        low, high = self.low[index], self.high[index]
+        for order in list(self.orders.values()):
+            if (order['side'] == 'buy' and low <= order['order_price']) or (order['side'] == 'sell' and high >= order['order_price']):
+                self._fill(order, order['order_price'], self.maker_fee)
+
+    def _fill(self, order, price, fee_rate):
+        base, quote = self.balances[self.base_currency], self.balances[self.quote_currency]
+        size = order['order_size']
+        if order['side'] == 'buy':
+            reserved = order['order_price'] * size
+            quote['frozen'] -= reserved
+            quote['free'] += reserved - price * size
+            quote['total'] -= price * size
+            fee = size * fee_rate
+            base['free'] += size - fee
+            base['total'] += size - fee
+            self.fees += fee * price
+        else:
+            base['frozen'] -= size
+            base['total'] -= size
+            fee = price * size * fee_rate
+            quote['free'] += price * size - fee
+            quote['total'] += price * size - fee
+            self.fees += fee
+        order.update(status='closed', filled_size=size, average_price=price)
+        self.orders.pop(order['order_id'], None)
+        self.trades.append((self.index, order['side'], price, size))
+
+    def _submit(self, symbol, side, size, order_type, price, client_order_id=None, **kwargs):
+        base, quote = self.balances[self.base_currency], self.balances[self.quote_currency]
+        reserve_balance, reserve = (quote, price * size) if side == 'buy' else (base, size)
+        if reserve > reserve_balance['free'] + 1e-12: return None
+        reserve_balance['free'] -= reserve
+        reserve_balance['frozen'] += reserve
+
+        self._order_id += 1
+        order = {
+            'symbol': symbol,
+            'order_id': self._order_id,
+            'status': 'open',
+            'filled_size': 0.0,
+            'side': side,
+            'average_price': 0,
+            'client_order_id': client_order_id,
+            'order_price': price,
+            'order_size': size,
+            'created_at': self.now(),
+            'order_type': order_type,
+        }
+        bid, ask = self.close[self.index], self.close[self.index] + self.tick_size
+        if side == 'buy' and price >= ask:
+            self._fill(order, float(ask), self.taker_fee)
+        elif side == 'sell' and price <= bid:
+            self._fill(order, float(bid), self.taker_fee)
+        else:
+            self.orders[order['order_id']] = order
+        return dict(order)
+
+    def _cancel(self, order_id):
+        order = self.orders.pop(order_id, None)
+        if not order: return False
+        if order['side'] == 'buy':
+            balance, reserved = self.balances[self.quote_currency], order['order_price'] * order['order_size']
+        else:
+            balance, reserved = self.balances[self.base_currency], order['order_size']
+        balance['frozen'] -= reserved
+        balance['free'] += reserved
+        return True
+
+    def equity(self, index=None):
+        index = self.index if index is None else index
+        return self.balances[self.quote_currency]['total'] + self.balances[self.base_currency]['total'] * self.close[index]
+
+    # ---------------- BaseExchangeApi ----------------
+
+    def format_symbol_details(self, symbol_details):
+        return symbol_details
+
+    def format_ticker(self, ticker):
+        return ticker
+
+    def format_depth(self, depth):
+        return depth
+
+    def format_ws_ticker(self, ticker):
+        return ticker
+
+    def format_kline(self, data):
+        return pd.DataFrame(data)
+
+    def format_kline_bar(self, bar):
+        return bar
+
+    def format_balance(self, balance):
+        return balance
+
+    def format_order(self, order):
+        return order
+
+    def format_active_orders(self, orders):
+        return orders
+
+    def format_ws_order(self, order):
+        return order
+
+    def format_ws_balance(self, balance):
+        return balance
+
+    def format_active_place_order_res(self, res):
+        return res
+
+    def format_place_orders_res(self, res, orders):
+        return res
+
+    def format_cancel_orders_res(self, res):
+        return res
+
+    def gather(self, *coros):
+        # 模拟接口的协程从不挂起， 直接驱动， 省掉事件循环
+        results = list()
+        for coro in coros:
+            try:
+                coro.send(None)
+            except StopIteration as e:
+                results.append(e.value)
+            except Exception as e:
+                results.append(e)
+            else:
+                coro.close()
+                raise RuntimeError(f"({self.name}) simulated coroutine suspended")
+        return results
+
+    def get_ticker(self, symbol):
+        close = float(self.close[self.index])
+        return {
+            'ask_price': close + self.tick_size,
+            'bid_price': close,
+            'ask_size': 0.0,
+            'bid_size': 0.0,
+            'timestamp': float(self.timestamps[self.index]) * 1000,
+            'symbol': symbol.upper()
+        }
+
+    def get_kline(self, symbol, period, size):
+        start = max(0, self.index + 1 - size)
+        return pd.DataFrame({
+            'timestamp': self.timestamps[start:self.index + 1],
+            'open': self.open[start:self.index + 1],
+            'high': self.high[start:self.index + 1],
+            'low': self.low[start:self.index + 1],
+            'close': self.close[start:self.index + 1],
+            'volume': self.volume[start:self.index + 1],
+        })
+
+    def get_ma(self, symbol, period, size, source='close'):
+        return float(self.rolling_mean(size, source)[self.index])
+
+    def get_balances(self):
+        return {currency: dict(balance) for currency, balance in self.balances.items()}
+
+    def get_active_orders(self, symbol):
+        return [dict(order) for order in self.orders.values()]
+
+    def is_order_state_synced(self, symbol):
+        # 模拟撮合的挂单就在本地
+        return True
+
+    def get_order(self, order_id=None, client_order_id=None, symbol=None):
+        order = self.orders.get(order_id)
+        return dict(order) if order else None
+
+    def place_order(self, symbol, side, size, order_type, price=None, client_order_id=None, time_in_force=None, post_only=False):
+        request = self._format_order_request(symbol, side, size, price)
+        if not request: return
+        symbol, size, price = request
+        return self._submit(symbol, side, size, order_type, price, client_order_id=client_order_id)
+
+    def place_orders(self, orders):
+        results = [None] * len(orders)
+        for index, request in self._format_order_requests(orders):
+            results[index] = self._submit(**request)
+        return results
+
+    def cancel_order(self, order_id=None, client_order_id=None, symbol=None):
+        return self._cancel(order_id)
+
+    def cancel_orders(self, order_ids, symbol=None):
+        return {order_id: self._cancel(order_id) for order_id in order_ids}
+
+    def cancel_all(self, symbol):
+        return self.cancel_orders(list(self.orders))
+
+    async def async_get_ticker(self, symbol):
+        return self.get_ticker(symbol)
+
+    async def async_get_ma(self, symbol, period, size, source='close'):
+        return self.get_ma(symbol, period, size, source)
+
+    async def async_get_balances(self):
+        return self.get_balances()
+
+    async def async_get_active_orders(self, symbol):
+        return self.get_active_orders(symbol)
+
+    async def async_place_order(self, *args, **kwargs):
+        return self.place_order(*args, **kwargs)
+
+    async def async_place_orders(self, orders):
+        return self.place_orders(orders)
+
+    async def async_cancel_order(self, order_id=None, client_order_id=None, symbol=None):
+        return self.cancel_order(order_id=order_id)
+
+    async def async_cancel_orders(self, order_ids, symbol=None):
+        return self.cancel_orders(order_ids)
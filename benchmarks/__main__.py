@@ -0,0 +1,84 @@
+"""
+跑全部 benchmark， 结果写入 json， 可以和保存的基线对比， 有退化时退出码为 1。
+
+    python -m benchmarks                                   # 跑一遍， 写 benchmarks/results.json
+    python -m benchmarks --save-baseline                   # 把本次结果存为基线
+    python -m benchmarks --baseline benchmarks/baseline.json --tolerance 0.25
+
+基线和机器相关， 应该在同一台机器上生成和对比。
+"""
+import argparse
+import json
+import platform
+import sys
+import time
+
+from benchmarks import micro, trade_loop
+
+
+def compare(results, baseline, tolerance):
+    """
+    返回退化的项： better 为 lower 的超过基线 (1 + tolerance) 倍， 为 higher 的低于基线 (1 - tolerance) 倍
+    """
+    regressions = list()
+    for name, result in results.items():
+        if name not in baseline: continue
+        value, base = result['value'], baseline[name]['value']
+        if result['better'] == 'lower':
+            regressed = value > base * (1 + tolerance)
+        else:
+            regressed = value < base * (1 - tolerance)
+        if regressed:
+            regressions.append((name, base, value))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Run the benchmark suite')
+    parser.add_argument('--output', default='benchmarks/results.json')
+    parser.add_argument('--baseline', default='benchmarks/baseline.json')
+    parser.add_argument('--save-baseline', action='store_true', help='store this run as the baseline instead of comparing')
+    parser.add_argument('--tolerance', type=float, default=0.25, help='allowed relative slowdown before failing')
+    parser.add_argument('--skip-macro', action='store_true', help='only run the microbenchmarks')
+    parser.add_argument('--iterations', type=int, default=50, help='trade loop iterations')
+    parser.add_argument('--latency', type=float, default=0.005, help='injected server latency for the trade loop, seconds')
+    args = parser.parse_args()
+
+    results = micro.run()
+    if not args.skip_macro:
+        results.update(trade_loop.run(args.iterations, args.latency))
+
+    report = {
+        'time': time.time(),
+        'python': platform.python_version(),
+        'machine': platform.node(),
+        'results': results,
+    }
+    with open(args.output, 'w') as f:
+        json.dump(report, f, indent=2)
+    for name, result in results.items():
+        print(f"{name:>36}: {result['value']:.9f} {result['unit']}")
+    print(f"results written to {args.output}")
+
+    if args.save_baseline:
+        with open(args.baseline, 'w') as f:
+            json.dump(report, f, indent=2)
+        print(f"baseline saved to {args.baseline}")
+        return 0
+
+    try:
+        with open(args.baseline) as f:
+            baseline = json.load(f)['results']
+    except FileNotFoundError:
+        print(f"no baseline at {args.baseline}, run with --save-baseline to create one")
+        return 0
+
+    regressions = compare(results, baseline, args.tolerance)
+    for name, base, value in regressions:
+        print(f"REGRESSION {name}: {base:.9f} -> {value:.9f} ({value / base - 1 if base else float('inf'):+.1%})")
+    if not regressions: print(f"no regressions against {args.baseline} (tolerance {args.tolerance:.0%})")
+    return 1 if regressions else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,64 @@
+"""
+ErrorManager 在错误风暴下的吞吐： 多个线程同时 add_error_info， 另一个线程每秒清理过期错误。
+
+    python -m benchmarks.bench_error_manager
+"""
+import threading
+import time
+
+from ExchangeFailureManager import ErrorManager
+
+
+class PandasErrorManager(object):
+    # 旧版基于 DataFrame 的实现， 仅用于对比； 旧版多线程并发 add 会损坏 DataFrame， 这里加了锁
+    def __init__(self, error_limit, error_expired):
+        import pandas as pd
+        self.error_limit = error_limit
+        self.error_expired = error_expired
+        self.error_info_df = pd.DataFrame(columns=['time', 'exchange', 'info'])
+        self._lock = threading.Lock()
+
+    def add_error_info(self, exchange, info):
+        with self._lock:
+            self.error_info_df.loc[self.error_info_df.shape[0]] = [time.time(), exchange, info]
+
+    def delete_expired_error_info(self):
+        expired_time = time.time() - self.error_expired
+        with self._lock:
+            self.error_info_df = self.error_info_df.loc[self.error_info_df['time'] > expired_time].reset_index(drop=True)
+
+
+def storm(manager, num_threads=4, duration=2.0):
+    working = True
+    counts = [0] * num_threads
+
+    def add(index):
+        while working:
+            manager.add_error_info('huobi', 'Get_Active_Orders')
+            counts[index] += 1
+
+    def expire():
+        while working:
+            manager.delete_expired_error_info()
+            time.sleep(1)
+
+    threads = [threading.Thread(target=add, args=(i,)) for i in range(num_threads)] + [threading.Thread(target=expire)]
+    for thread in threads: thread.start()
+    time.sleep(duration)
+    working = False
+    for thread in threads: thread.join()
+    return sum(counts) / duration
+
+
+def run():
+    results = {'deque': storm(ErrorManager(60, 1))}
+    try:
+        results['pandas'] = storm(PandasErrorManager(60, 1))
+    except ImportError:
+        pass
+    return results
+
+
+if __name__ == '__main__':
+    for name, adds_per_second in run().items():
+        print(f"{name:>8}: {adds_per_second:,.0f} adds/s")
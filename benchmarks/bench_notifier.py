@@ -0,0 +1,115 @@
+"""
+告警风暴下的 Notifier： 多个线程同时发告警（大部分相同）， webhook 用本地替身， 带注入的延迟和限频，
+统计调用方单次 notify 的耗时、 实际发出的消息数和最大的消息长度， 以及合并计数是否和发出的告警数对得上。
+
+    python -m benchmarks.bench_notifier --threads 4 --messages 50000 --latency 0.2
+"""
+import argparse
+import json
+import re
+import threading
+import time
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+from Utils import Notifier
+
+
+class LocalWebhook(object):
+    """
+    webhook 替身： 记录收到的每条消息， 每个请求延迟 latency 秒后返回 {"errcode": 0}
+    """
+
+    def __init__(self, port=0, latency=0.0):
+        self.latency = latency
+        self.messages = list()
+        self._lock = threading.Lock()
+        webhook = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+                with webhook._lock:
+                    webhook.messages.append(json.loads(body)['text']['content'])
+                if webhook.latency: time.sleep(webhook.latency)
+                data = b'{"errcode": 0, "errmsg": "ok"}'
+                self.send_response(200)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def log_message(self, format, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(('127.0.0.1', port), Handler)
+        self.url = f"http://127.0.0.1:{self.server.server_address[1]}/robot"
+        self._thread = threading.Thread(target=self.server.serve_forever, name='LocalWebhook', daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+def count_alerts(messages):
+    # 每行告警后面是 [xN, ...] 或者 [时间]， 后者计 1 条； 加上截断和丢弃的条数
+    total = 0
+    for message in messages:
+        for line in message.split('\n===============\n'):
+            repeated = re.search(r'\[x(\d+), [^\]]*\]$', line)
+            truncated = re.search(r'\((\d+) alerts\) truncated$', line)
+            dropped = re.search(r'^\.\.\. (\d+) more \w+ dropped$', line)
+            match = repeated or truncated or dropped
+            total += int(match.group(1)) if match else 1 if line.endswith(']') else 0
+    return total
+
+
+def run(threads=4, messages=50000, latency=0.2, distinct=20):
+    webhook = LocalWebhook(latency=latency)
+    webhook.start()
+    notifier = Notifier(url=webhook.url, name='bench', batch_period=0.5, rate_limit=5, rate_window=1)
+    durations = list()
+
+    def storm(index):
+        local = list()
+        for i in range(messages):
+            severity = 'critical' if i % 10000 == 0 else 'warning'
+            start_time = time.perf_counter()
+            notifier.notify(f"(bench) thread {index} error {i % distinct}", severity=severity)
+            local.append(time.perf_counter() - start_time)
+        durations.extend(local)
+
+    try:
+        start_time = time.perf_counter()
+        workers = [threading.Thread(target=storm, args=(i,)) for i in range(threads)]
+        for worker in workers: worker.start()
+        for worker in workers: worker.join()
+        elapsed = time.perf_counter() - start_time
+        notifier.flush()
+        time.sleep(latency)
+    finally:
+        webhook.stop()
+
+    durations.sort()
+    return {
+        'notify_p50': durations[len(durations) // 2],
+        'notify_max': durations[-1],
+        'storm_seconds': elapsed,
+        'alerts': threads * messages,
+        'alerts_delivered': count_alerts(webhook.messages),
+        'posts': len(webhook.messages),
+        'max_post_chars': max(map(len, webhook.messages), default=0),
+        'status': notifier.status(),
+    }
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Notifier under an alert storm against a local webhook stand-in')
+    parser.add_argument('--threads', type=int, default=4)
+    parser.add_argument('--messages', type=int, default=50000, help='alerts per thread')
+    parser.add_argument('--latency', type=float, default=0.2, help='injected webhook latency per request, seconds')
+    args = parser.parse_args()
+    for k, v in run(args.threads, args.messages, args.latency).items():
+        print(f"{k:>18}: {v}")
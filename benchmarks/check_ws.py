@@ -0,0 +1,124 @@
+"""
+对着本地替身服务器（Exchanges/Huobi/LocalServer.py）检查 MarketWs / AccountWs：
+gzip 推送和 ping / pong、 断线重连后重新订阅、 推送卡住时判定过期、 mbp 增量丢失后重新请求快照、 私有 ws 鉴权和订单 / 余额推送。
+每一项失败都会打印出来， 有失败时退出码为 1。
+
+    python -m benchmarks.check_ws
+"""
+import sys
+import time
+
+from Exchanges.Huobi.LocalServer import LocalServer
+from Exchanges.Huobi.Ws import MarketWs, AccountWs
+from Metrics import metrics
+
+SYMBOL = 'BTCUSDT'
+KEY, SECRET = 'check', 'check'
+
+
+def wait_for(condition, timeout=5.0, interval=0.02):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if condition(): return True
+        time.sleep(interval)
+    return bool(condition())
+
+
+def resync_count():
+    return sum(value for (name, labels), value in list(metrics.counters.items())
+               if name == 'order_book_resync_total' and dict(labels).get('exchange') == 'check_market')
+
+
+def book_matches(ws, server):
+    # 本地订单簿的买一卖一和替身已推送的 mbp 状态一致
+    book = ws.get_order_book(SYMBOL)
+    if book is None: return False
+    snapshot = server._mbp_snapshot(SYMBOL.lower(), 1)
+    return [list(book.best_bid() or ()), list(book.best_ask() or ())] == [snapshot['bids'][0], snapshot['asks'][0]]
+
+
+def order_events(orders, order_id):
+    return [item['eventType'] for item in orders if item['orderId'] == order_id]
+
+
+def check_market(server, results, stale_after=1.0):
+    connected, klines = list(), list()
+    ws = MarketWs(name='check_market', url=server.ws_url, stale_after=stale_after, reconnect_interval=0.2,
+                  on_kline=lambda *args: klines.append(args), on_connected=lambda: connected.append(time.time()))
+    ws.subscribe_ticker(SYMBOL)
+    ws.subscribe_kline(SYMBOL, '1min')
+    ws.subscribe_order_book(SYMBOL, 20)
+    ws.start()
+    try:
+        results['market_ticker'] = wait_for(lambda: ws.get_ticker(SYMBOL) is not None)
+        results['market_kline'] = wait_for(lambda: ws.is_kline_fresh(SYMBOL, '1min') and klines)
+        results['market_order_book'] = wait_for(lambda: book_matches(ws, server))
+        results['market_pong'] = wait_for(lambda: server.ws_status()['pongs'] > 0)
+
+        resyncs = resync_count()
+        server.skip_mbp_updates(SYMBOL)
+        results['market_mbp_gap_resync'] = wait_for(lambda: resync_count() > resyncs) and wait_for(lambda: book_matches(ws, server))
+
+        count = len(connected)
+        server.drop_ws()
+        results['market_reconnect'] = wait_for(lambda: len(connected) > count)
+        # 重连时本地状态清空， 重新订阅以后才有新的推送
+        results['market_resubscribe'] = (wait_for(lambda: ws.get_ticker(SYMBOL) is not None) and
+                                         wait_for(lambda: book_matches(ws, server)))
+
+        server.pause_ws(stale_after * 3)
+        results['market_stale'] = wait_for(lambda: not ws.is_fresh() and ws.get_ticker(SYMBOL) is None, timeout=stale_after * 2)
+        results['market_stale_recover'] = wait_for(lambda: ws.get_ticker(SYMBOL) is not None, timeout=stale_after * 3)
+    finally:
+        ws.stop()
+
+
+def check_account(server, results, account_id):
+    connected, orders, balances = list(), list(), list()
+    ws = AccountWs(name='check_account', url=server.account_ws_url, stale_after=2, reconnect_interval=0.2, key=KEY,
+                   secret=SECRET, account_id=account_id, on_order=orders.append, on_balance=balances.append,
+                   on_connected=lambda: connected.append(time.time()))
+    ws.subscribe_orders(SYMBOL)
+    ws.start()
+    try:
+        results['account_auth'] = wait_for(lambda: ws.is_fresh() and server.ws_status()['authenticated'] > 0)
+        # 订阅回复到了以后再下单， 否则推送可能先于订阅
+        time.sleep(0.2)
+
+        bid = server.engine.get_ticker(SYMBOL)['bid'][0]
+        order = server.engine.place_order(account_id, SYMBOL, 'buy', round(bid * 0.9, 2), 0.001, client_order_id='check_1')
+        server.engine.cancel_order(order['id'], account_id)
+        results['account_order_push'] = wait_for(lambda: order_events(orders, order['id']) == ['creation', 'cancellation'])
+        results['account_balance_push'] = wait_for(lambda: any(item['currency'] == 'usdt' and item['changeType'] == 'order.cancel'
+                                                               for item in balances))
+
+        ask = server.engine.get_ticker(SYMBOL)['ask'][0]
+        order = server.engine.place_order(account_id, SYMBOL, 'buy', ask, 0.001)
+        results['account_trade_push'] = wait_for(lambda: order_events(orders, order['id'])[-1:] == ['trade'] and
+                                                         orders[-1]['orderStatus'] == 'filled')
+
+        count = len(connected)
+        server.drop_ws()
+        results['account_reconnect'] = wait_for(lambda: len(connected) > count and ws.is_fresh())
+    finally:
+        ws.stop()
+
+
+def run():
+    server = LocalServer(port=0, keys={KEY: SECRET}, balances={'usdt': 10000.0, 'btc': 0.2},
+                         simulator_options={'tick_interval': 0.05}, ws_push_interval=0.05, ws_ping_interval=0.2)
+    server.start()
+    results = dict()
+    try:
+        check_market(server, results)
+        check_account(server, results, server.keys[KEY]['account_id'])
+    finally:
+        server.stop()
+    return results
+
+
+if __name__ == '__main__':
+    results = run()
+    for name, ok in results.items():
+        print(f"{name:>24}: {'ok' if ok else 'FAILED'}")
+    sys.exit(0 if all(results.values()) else 1)
@@ -0,0 +1,324 @@
+"""
+热路径上的单个函数： 每个用例返回单次调用耗时（秒）， 取多轮中最快的一轮。
+
+    python -m benchmarks.micro
+"""
+import base64
+import contextlib
+import hashlib
+import hmac
+import itertools
+import json
+import logging
+import random
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime
+from urllib import parse
+
+from Codec import codec
+from Exchanges.BaseExchangeApi import BaseExchangeApi
+from Exchanges.KlineStore import KlineStore
+from Exchanges.OrderBook import OrderBook
+from Exchanges.Huobi.Schemas import KLINE_SCHEMA, OPEN_ORDERS_SCHEMA
+from Exchanges.Huobi.ExchangeApi import ExchangeApi
+from Exchanges.Huobi.Rest import Rest, SigningContext
+from ExchangeFailureManager import ErrorManager
+from Logger import MyLogger
+from Utils import Notifier
+
+
+def measure(func, number=10000, repeat=5):
+    best = float('inf')
+    for _ in range(repeat):
+        start_time = time.perf_counter()
+        for _ in range(number):
+            func()
+        best = min(best, (time.perf_counter() - start_time) / number)
+    return best
+
+
+def make_kline_data(size=150, period=60):
+    now = int(time.time()) // period * period
+    return [{'id': now - i * period, 'open': 30000.0 + i, 'close': 30001.0 + i, 'low': 29990.0 + i, 'high': 30010.0 + i,
+             'amount': 1.5, 'vol': 45000.0, 'count': 10} for i in range(size)]
+
+
+class KlineRest(object):
+    # 固定返回同一组 kline， 只测本地处理， 不含网络
+    kline_size_limit = 2000
+
+    def __init__(self, data):
+        self.data = data
+
+    def get_kline(self, symbol, period, size, *args, **kwargs):
+        return self.data[:size]
+
+
+def make_api():
+    # 不走 ExchangeApi.__init__， 避免请求交易所； 不用本地 K 线库， 需要的用例自己加
+    api = ExchangeApi.__new__(ExchangeApi)
+    BaseExchangeApi.__init__(api, name='bench', symbol='BTCUSDT', kline_store_path=None)
+    return api
+
+
+SIGN_PARAMS = {'account-id': 1, 'symbol': 'btcusdt', 'size': 500}
+
+
+def bench_sign_legacy():
+    # 改用 SigningContext 之前的签名方式， 留作对比
+    key, secret, host = 'bench-key', 'bench-secret', 'api.huobi.pro'
+
+    def sign(path, method, params):
+        params = dict(params)
+        params.update({"AccessKeyId": key, "SignatureMethod": "HmacSHA256", "SignatureVersion": 2,
+                       "Timestamp": datetime.utcnow().strftime("%FT%X")})
+        params = {k: params[k] for k in sorted(params)}
+        msg = "\n".join([method, host, path, parse.urlencode(params.copy())])
+        params["Signature"] = base64.b64encode(hmac.new(secret.encode('utf-8'), msg.encode('utf-8'), digestmod=hashlib.sha256).digest()).decode()
+        return path + '?' + parse.urlencode(params)
+
+    return measure(lambda: sign('/v1/order/openOrders', 'GET', SIGN_PARAMS))
+
+
+def bench_sign():
+    rest = Rest.__new__(Rest)
+    rest.url = 'https://api.huobi.pro'
+    rest._signing = SigningContext('bench-key', 'bench-secret', 'api.huobi.pro')
+    return measure(lambda: rest._get_request_url('/v1/order/openOrders', 'GET', SIGN_PARAMS))
+
+
+HUOBI_ORDER = {'id': 180286878676697, 'symbol': 'btcusdt', 'account-id': 17155432, 'client-order-id': 'buy_1609501207',
+               'amount': '0.040000000000000000', 'price': '29000.000000000000000000', 'created-at': 1609501207342,
+               'type': 'buy-limit', 'filled-amount': '0.0', 'filled-cash-amount': '0.0', 'filled-fees': '0.0',
+               'source': 'spot-api', 'state': 'submitted'}
+
+
+def format_order_legacy(api, order):
+    # 改用 Order 记录之前的解析方式， 留作对比
+    order_id = order['id']
+    order = api.dict_value_to_float(order)
+    order = {k.replace('field', 'filled'): v for k, v in order.items()}
+    return {
+        'symbol': order['symbol'].upper(),
+        'order_id': order_id,
+        'status': 'closed' if order.get('finished-at', 0) - order['created-at'] >= 0 else 'open',
+        'filled_size': order['filled-amount'],
+        'side': order['type'].split('-')[0],
+        'average_price': order['filled-cash-amount'] / order['filled-amount'] if order['filled-amount'] else 0,
+        'client_order_id': order['client-order-id'],
+        'order_price': order['price'],
+        'order_size': order['amount'],
+        'created_at': order['created-at'],
+        'order_type': order['type'].split('-')[1],
+    }
+
+
+def bench_format_order_legacy():
+    api = make_api()
+    return measure(lambda: format_order_legacy(api, HUOBI_ORDER))
+
+
+def bench_format_order():
+    api = make_api()
+    return measure(lambda: api.format_order(HUOBI_ORDER))
+
+
+def measure_memory(func, number=500):
+    # number 个解析结果一直持有时新增的内存（字节 / 个）
+    tracemalloc.start()
+    try:
+        before = tracemalloc.get_traced_memory()[0]
+        results = [func() for _ in range(number)]
+        used = tracemalloc.get_traced_memory()[0] - before
+    finally:
+        tracemalloc.stop()
+    del results
+    return used / number
+
+
+def bench_order_memory_legacy():
+    api = make_api()
+    return measure_memory(lambda: format_order_legacy(api, HUOBI_ORDER))
+
+
+def bench_order_memory():
+    api = make_api()
+    return measure_memory(lambda: api.format_order(HUOBI_ORDER))
+
+
+def make_open_orders_body(size=500):
+    orders = [dict(HUOBI_ORDER, id=HUOBI_ORDER['id'] + i, price=f"{29000 + i}.000000000000000000") for i in range(size)]
+    return json.dumps({'status': 'ok', 'data': orders}).encode('utf-8')
+
+
+def make_kline_body(size=2000):
+    return json.dumps({'status': 'ok', 'ch': 'market.btcusdt.kline.1min', 'ts': 1609459200000, 'data': make_kline_data(size)}).encode('utf-8')
+
+
+def bench_decode_open_orders_stdlib():
+    # 500 个活跃订单的响应： 标准库 json 解码 + 格式化
+    api, body = make_api(), make_open_orders_body()
+    return measure(lambda: api.format_active_orders(json.loads(body)['data']), number=20)
+
+
+def bench_decode_open_orders():
+    api, body, decode = make_api(), make_open_orders_body(), codec.decoder(OPEN_ORDERS_SCHEMA)
+    return measure(lambda: api.format_active_orders(decode(body)['data']), number=20)
+
+
+def bench_decode_kline_stdlib():
+    # 2000 根 kline 的响应： 解码 + 格式化成 bar
+    api, body = make_api(), make_kline_body()
+    return measure(lambda: [api.format_kline_bar(bar) for bar in json.loads(body)['data']], number=20)
+
+
+def bench_decode_kline():
+    api, body, decode = make_api(), make_kline_body(), codec.decoder(KLINE_SCHEMA)
+    return measure(lambda: [api.format_kline_bar(bar) for bar in decode(body)['data']], number=20)
+
+
+def bench_format_kline():
+    api = make_api()
+    data = make_kline_data()
+    return measure(lambda: api.format_kline(data), number=500)
+
+
+def bench_get_ma():
+    # 缓存已热， 每次增量拉 2 根
+    api = make_api()
+    api.rest = KlineRest(make_kline_data())
+    api.get_ma('BTCUSDT', '1min', 120)
+    return measure(lambda: api.get_ma('BTCUSDT', '1min', 120), number=5000)
+
+
+def bench_get_ma_cold():
+    api = make_api()
+    api.rest = KlineRest(make_kline_data())
+
+    def get_ma():
+        api.kline_caches.clear()
+        api.get_ma('BTCUSDT', '1min', 120)
+
+    return measure(get_ma, number=1000)
+
+
+def bench_get_ma_cold_store():
+    # 缓存为空， 本地 K 线库已有历史： 只拉最新 2 根， 其余从 memmap 读
+    api = make_api()
+    api.rest = KlineRest(make_kline_data())
+    with tempfile.TemporaryDirectory() as path:
+        api.kline_store_path = path
+        api.kline_stores[('BTCUSDT', '1min')] = KlineStore(path, 'bench', 60)
+        api.get_kline_bars('BTCUSDT', '1min', 120)
+
+        def get_ma():
+            api.kline_caches.clear()
+            api.get_ma('BTCUSDT', '1min', 120)
+
+        return measure(get_ma, number=1000)
+
+
+def make_depth_updates(size=10000, levels=150, tick=0.01, mid=30000.0):
+    # MBP 增量： 每条改动买卖各一个价位， 集中在盘口附近， 约 1/4 是删除
+    rng = random.Random(0)
+    updates = list()
+    for _ in range(size):
+        bid = round(mid - tick * int(rng.expovariate(1 / 10) % levels + 1), 2)
+        ask = round(mid + tick * int(rng.expovariate(1 / 10) % levels + 1), 2)
+        updates.append(([[bid, 0.0 if rng.random() < 0.25 else rng.uniform(0.1, 5)]],
+                        [[ask, 0.0 if rng.random() < 0.25 else rng.uniform(0.1, 5)]]))
+    return updates
+
+
+def bench_order_book_update():
+    # 150 档订单簿上应用一条增量（含 seq 检查）
+    book = OrderBook('BTCUSDT', levels=150)
+    book.apply_snapshot([[round(30000.0 - 0.01 * i, 2), 1.0] for i in range(1, 151)],
+                        [[round(30000.0 + 0.01 * i, 2), 1.0] for i in range(1, 151)], seq=0)
+    updates, seq = itertools.cycle(make_depth_updates()), itertools.count(1)
+
+    def apply():
+        bids, asks = next(updates)
+        n = next(seq)
+        book.apply_update(bids, asks, n, n - 1)
+
+    return measure(apply, number=100000)
+
+
+def bench_add_error_info():
+    manager = ErrorManager(error_limit=60, error_expired=60)
+    return measure(lambda: manager.add_error_info('huobi', 'Get_Active_Orders'), number=100000)
+
+
+@contextlib.contextmanager
+def _make_logger(level):
+    # 只测入队， 不往终端输出； 日志文件写到临时目录， 不留在 ./Logs
+    with tempfile.TemporaryDirectory() as log_dir:
+        logger = MyLogger(name='bench', level=level, log_dir=log_dir)
+        logger.removeHandler(logger._sh)
+        logger.start()
+        try:
+            yield logger
+        finally:
+            logger.stop()
+            logger._th.close()
+
+
+def bench_logger_put():
+    with _make_logger('INFO') as logger:
+        return measure(lambda: logger.info('(%s) active order: %s', 'GridTrading', {'order_id': 1, 'side': 'buy'}), number=20000)
+
+
+def bench_logger_put_filtered():
+    with _make_logger('WARNING') as logger:
+        return measure(lambda: logger.put(logging.DEBUG, 'filtered %s', (1,)), number=100000)
+
+
+def bench_notifier_notify():
+    # 重复的告警只在锁内计数； webhook 地址不可达， 发送失败只计入 errors
+    notifier = Notifier(url='http://127.0.0.1:1/robot', name='bench', batch_period=3600, timeout=0.1)
+    return measure(lambda: notifier.notify('(GridTrading) active orders exceed the limit'), number=100000)
+
+
+BENCHMARKS = {
+    'rest_sign_legacy': bench_sign_legacy,
+    'rest_sign': bench_sign,
+    'format_order_legacy': bench_format_order_legacy,
+    'format_order': bench_format_order,
+    'decode_open_orders_stdlib': bench_decode_open_orders_stdlib,
+    'decode_open_orders': bench_decode_open_orders,
+    'decode_kline_stdlib': bench_decode_kline_stdlib,
+    'decode_kline': bench_decode_kline,
+    'format_kline': bench_format_kline,
+    'get_ma_incremental': bench_get_ma,
+    'get_ma_cold': bench_get_ma_cold,
+    'get_ma_cold_store': bench_get_ma_cold_store,
+    'order_book_update': bench_order_book_update,
+    'error_manager_add': bench_add_error_info,
+    'logger_put': bench_logger_put,
+    'logger_put_filtered': bench_logger_put_filtered,
+    'notifier_notify': bench_notifier_notify,
+}
+
+
+# 返回字节数
+MEMORY_BENCHMARKS = {
+    'order_memory_legacy': bench_order_memory_legacy,
+    'order_memory': bench_order_memory,
+}
+
+
+def run():
+    results = {name: {'value': func(), 'unit': 'seconds', 'better': 'lower'} for name, func in BENCHMARKS.items()}
+    results.update({name: {'value': func(), 'unit': 'bytes', 'better': 'lower'} for name, func in MEMORY_BENCHMARKS.items()})
+    return results
+
+
+if __name__ == '__main__':
+    for name, result in run().items():
+        if result['unit'] == 'seconds':
+            print(f"{name:>26}: {result['value'] * 1e6:10.2f} us {1 / result['value']:12.0f} /s")
+        else:
+            print(f"{name:>26}: {result['value']:10.0f} {result['unit']}")
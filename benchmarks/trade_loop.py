@@ -0,0 +1,88 @@
+"""
+完整的 GridTrading.trade 循环， 对着本地替身服务器（Exchanges/Huobi/LocalServer.py）跑， 统计每轮耗时和请求数。
+
+    python -m benchmarks.trade_loop --iterations 100 --latency 0.005
+    python -m benchmarks.trade_loop --grid-levels 100    # 每边 100 档的网格
+"""
+import argparse
+import time
+
+from Exchanges.Huobi.ExchangeApi import ExchangeApi
+from Exchanges.Huobi.LocalServer import LocalServer
+from Exchanges.Huobi.Rest import Rest
+from Metrics import metrics
+from strategies.GridTrading import GridTrading
+
+CONFIG = {
+    'symbol': 'BTCUSDT',
+    'base_currency': 'btc',
+    'quote_currency': 'usdt',
+    'ma_kline_period': '1min',
+    'ma_kline_size': 120,
+    'max_num_active_order': 2,
+    'trade_loop_period': 1,
+    'spread_rate': 0.002,
+    'reorder_rate': 0.0005,
+    'use_market_ws': False,
+    'use_account_ws': False,
+}
+
+
+def count_requests(exchange):
+    return sum(histogram.count for (name, labels), histogram in list(metrics.histograms.items())
+               if name == 'rest_latency_seconds' and dict(labels).get('exchange') == exchange)
+
+
+def count_errors(exchange):
+    return sum(value for (name, labels), value in list(metrics.counters.items())
+               if name == 'rest_errors_total' and dict(labels).get('exchange') == exchange)
+
+
+def quantile(values, q):
+    return values[min(int(q * len(values)), len(values) - 1)]
+
+
+def run(iterations=50, latency=0.005, warmup=3, grid_levels=1):
+    server = LocalServer(port=0, keys={'bench': 'bench'}, balances={'usdt': 10000.0, 'btc': 0.2}, latency=latency,
+                         simulator_options={'volatility': 0.0005, 'tick_interval': 0.05})
+    server.start()
+    name = 'bench_trade_loop'
+    try:
+        # trade 循环背靠背地跑， 远超交易所限频， 关掉客户端限频只测循环本身的耗时； 服务器端口每次不同， 不写磁盘缓存和 K 线库
+        api = ExchangeApi(key='bench', secret='bench', name=name, symbol=CONFIG['symbol'], rest_url=server.url,
+                          rate_limits={group: None for group in Rest.rate_limits}, cache_path=None,
+                          kline_store_path=None)
+        config = dict(CONFIG, max_num_active_order=2 * grid_levels)
+        strategy = GridTrading(config=config, api=api)
+        for _ in range(warmup):
+            strategy.trade()
+
+        durations = list()
+        requests, errors = count_requests(name), count_errors(name)
+        for _ in range(iterations):
+            start_time = time.perf_counter()
+            strategy.trade()
+            durations.append(time.perf_counter() - start_time)
+        requests, errors = count_requests(name) - requests, count_errors(name) - errors
+        api.cancel_all(CONFIG['symbol'])
+        api.stop()
+    finally:
+        server.stop()
+
+    durations.sort()
+    return {
+        'trade_loop_p50': {'value': quantile(durations, 0.5), 'unit': 'seconds', 'better': 'lower'},
+        'trade_loop_p99': {'value': quantile(durations, 0.99), 'unit': 'seconds', 'better': 'lower'},
+        'trade_loop_requests_per_iteration': {'value': requests / iterations, 'unit': 'requests', 'better': 'lower'},
+        'trade_loop_errors_per_iteration': {'value': errors / iterations, 'unit': 'errors', 'better': 'lower'},
+    }
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='GridTrading.trade loop against the local Huobi stand-in')
+    parser.add_argument('--iterations', type=int, default=50)
+    parser.add_argument('--latency', type=float, default=0.005, help='injected server latency per request, seconds')
+    parser.add_argument('--grid-levels', type=int, default=1, help='grid levels per side')
+    args = parser.parse_args()
+    for k, v in run(args.iterations, args.latency, grid_levels=args.grid_levels).items():
+        print(f"{k:>36}: {v['value']:.6f} {v['unit']}")
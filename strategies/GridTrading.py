@@ -1,23 +1,49 @@
+import math
+import threading
+import time
+
+import numpy as np
+
 from Worker import Worker
 from .Base import Base
+from .QuoteReconciler import QuoteReconciler
 from Exchanges.BaseExchangeApi import BaseExchangeApi
 
 from Logger import logger
+from Metrics import metrics
 
 
 class GridTrading(Base):
+    # 运行时可以修改的配置项； symbol、 币种、 K 线周期等决定订阅和挂单归属的不能改
+    TUNABLE_PARAMS = ('ma_kline_size', 'max_num_active_order', 'trade_loop_period', 'spread_rate', 'reorder_rate',
+                      'min_avail_base_coin', 'min_avail_quote_coin', 'size_tolerance', 'grid_level_spacing', 'grid_size_ratio',
+                      'min_quote_lifetime', 'max_actions_per_loop')
+    # 可以设为 none（不限）的配置项
+    NULLABLE_PARAMS = ('max_actions_per_loop',)
+
     def __init__(self, config, api: BaseExchangeApi):
         super().__init__()
-        self.name = self.__class__.__name__
         self.api = api
         self.config = config
+        self.name = self.config.get('strategy_name', self.__class__.__name__)
+        self.reconciler = None
         self._initialize_config(self.config)
+        # set_param 在控制线程调用， 修改先放在这里， 下一轮 trade 开始时再生效
+        self._pending_params = dict()
+        self._params_lock = threading.Lock()
 
         self.worker_trade = Worker(name=self.name, callback=self.trade, msg='worker_trade', period=self.trade_loop_period)
         self._reset_active_orders()
+        # 网格： 价位 -> 挂单， order_id -> (side, 价位)
+        self.levels = {'buy': dict(), 'sell': dict()}
+        self.order_levels = dict()
+        self._level_step = None
+        # 每边实际的档数， 价格跌到网格放不下时少于 grid_levels
+        self._level_counts = None
 
         self.current_sell_price = None
         self.current_buy_price = None
+        self.num_cancelled_orders = 0
         self.tick_size = self.api.get_tick_size(symbol=self.symbol)
 
     def _reset_active_orders(self):
@@ -39,29 +65,49 @@ class GridTrading(Base):
         self.reorder_rate = self.config['reorder_rate']
         self.min_avail_base_coin = self.config.get('min_avail_base_coin', 0.1)
         self.min_avail_quote_coin = self.config.get('min_avail_quote_coin', 0.1)
+        # 挂单数量与期望数量相差不超过 size_tolerance 时不改单； 挂单不到 min_quote_lifetime 秒不撤； 每轮最多 max_actions_per_loop 个撤单 + 下单
+        self.size_tolerance = self.config.get('size_tolerance', 0.1)
+        # max_num_active_order 大于 2 时是多档网格： 每边 max_num_active_order // 2 档， 相邻两档价格相差 grid_level_spacing，
+        # 从中间价往外数第 i 档的资金占比正比于 grid_size_ratio ** i（1 为平均分配）
+        self.grid_levels = max(1, self.max_num_active_order // 2)
+        self.grid_level_spacing = self.config.get('grid_level_spacing', self.spread_rate)
+        self.grid_size_ratio = self.config.get('grid_size_ratio', 1.0)
+        self.min_quote_lifetime = self.config.get('min_quote_lifetime', 0)
+        self.max_actions_per_loop = self.config.get('max_actions_per_loop', None)
+        reconciler_options = dict(price_tolerance=self.reorder_rate, size_tolerance=self.size_tolerance,
+                                  min_lifetime=self.min_quote_lifetime, max_actions=self.max_actions_per_loop)
+        if self.reconciler is None:
+            self.reconciler = QuoteReconciler(name=self.name, **reconciler_options)
+        else:
+            # 运行时修改参数， 保留上一轮推迟的动作
+            for key, value in reconciler_options.items():
+                setattr(self.reconciler, key, value)
 
         self.ma_kline_source = self.config.get('ma_kline_source', 'close')
+        self.use_market_ws = self.config.get('use_market_ws', True)
+        self.use_account_ws = self.config.get('use_account_ws', True)
 
-    def update_active_orders(self):
-        orders = self.api.get_active_orders(symbol=self.symbol)
+    def update_active_orders(self, orders=None):
+        orders = self.api.get_active_orders(symbol=self.symbol) if orders is None else orders
         if len(orders) > self.max_num_active_order:
             logger.warning(f"({self.name}) active orders {orders} exceed the limit {self.max_num_active_order}")
             self.api.cancel_all(symbol=self.symbol)
             return False
 
         for order in orders:
-            if order['side'] == 'sell' and abs(1 - self.current_sell_price / order['order_price']) >= self.reorder_rate:
-                self.api.cancel_order(order_id=order['order_id'])
-            elif order['side'] == 'buy' and abs(1 - self.current_buy_price / order['order_price']) >= self.reorder_rate:
-                self.api.cancel_order(order_id=order['order_id'])
-            else:
-                logger.info(f"({self.name}) active order: {order}")
-                self.active_orders[order['side']] = order
+            self.active_orders[order['side']] = order
         return True
 
-    def update_current_price(self):
-        ma = self.api.get_ma(symbol=self.symbol, period=self.ma_kline_period, size=self.ma_kline_size, source=self.ma_kline_source)
-        ticker = self.api.get_ticker(self.symbol)
+    def cancel_orders(self, order_ids):
+        self.num_cancelled_orders = len(order_ids)
+        if order_ids:
+            self.api.cancel_orders(order_ids, symbol=self.symbol)
+
+    def update_current_price(self, ma=None, ticker=None):
+        if ma is None:
+            ma = self.api.get_ma(symbol=self.symbol, period=self.ma_kline_period, size=self.ma_kline_size, source=self.ma_kline_source)
+        if ticker is None:
+            ticker = self.api.get_ticker(self.symbol)
         self.current_sell_price = ma * (1 + self.spread_rate)
         self.current_buy_price = ma * (1 - self.spread_rate)
         if self.current_buy_price >= ticker['bid_price']:
@@ -75,19 +121,265 @@ class GridTrading(Base):
         }
         logger.info(f'({self.name}) current prices: {data}')
 
-    def place_orders(self):
-        balances = self.api.get_balances()
+    def keeps_size(self, side, balances, order):
+        """
+        有挂单的一边， 可用余额不到 min_avail 或者不到总资金的 size_tolerance 时不为它改单
+        """
+        if side == 'buy':
+            free, committed, min_free = balances[self.quote_currency]['free'], order['order_price'] * (order['order_size'] - order['filled_size']), self.min_avail_quote_coin
+        else:
+            free, committed, min_free = balances[self.base_currency]['free'], order['order_size'] - order['filled_size'], self.min_avail_base_coin
+        return free <= min_free or free <= self.size_tolerance * (free + committed)
+
+    def gen_quotes(self, balances):
+        """
+        期望的报价： 每边一个， 数量是 可用余额 + 挂单占用的， 能按当前价格下的单； 资金不够下单的一边没有报价
+        """
+        quotes = list()
+        for side, price in (('buy', self.current_buy_price), ('sell', self.current_sell_price)):
+            order = self.active_orders[side]
+            if order and self.keeps_size(side, balances, order):
+                size = order['order_size'] - order['filled_size']
+            elif side == 'buy':
+                committed = order['order_price'] * (order['order_size'] - order['filled_size']) if order else 0.0
+                size = (balances[self.quote_currency]['free'] + committed) / price
+            else:
+                committed = order['order_size'] - order['filled_size'] if order else 0.0
+                size = balances[self.base_currency]['free'] + committed
+            # 数量不够最小下单量 / 最小下单金额的报价下不出去， 不交给对账， 免得占掉每轮的动作预算
+            if self.api.check_order_size(self.symbol, size, price):
+                quotes.append(dict(side=side, price=price, size=size))
+        return quotes
+
+    def place_orders(self, orders, balances, now):
+        """
+        期望报价和当前挂单对账， 只撤掉偏离的、 只补缺的； 撤单会释放冻结的余额， 撤单后重新查询余额再下单
+        """
+        actions = self.reconciler.reconcile(self.gen_quotes(balances), orders, now)
+        self.cancel_orders([order['order_id'] for order in actions['cancel']])
+        if self.num_cancelled_orders:
+            balances = self.api.get_balances()
         base_balance = balances[self.base_currency]
         quote_balance = balances[self.quote_currency]
-        for side, order in self.active_orders.items():
-            if not order:
-                self.api.place_order(**self.gen_order_info(side, base_balance['free'], quote_balance['free']))
-            elif order['side'] == 'buy' and quote_balance['free'] > self.min_avail_quote_coin:
-                self.api.cancel_order(order['order_id'])
-            elif order['side'] == 'sell' and base_balance['free'] > self.min_avail_base_coin:
-                self.api.cancel_order(order['order_id'])
+        requests = [self.gen_order_info(quote['side'], base_balance['free'], quote_balance['free']) for quote in actions['place']]
+        if requests: self.api.place_orders(requests)
+        for order in actions['keep']:
+            logger.info(f"({self.name}) active order: {order}")
+        logger.info(f"({self.name}) quotes: keep {len(actions['keep'])}, cancel {len(actions['cancel'])}, "
+                    f"place {len(actions['place'])}, saved {actions['saved']}, deferred {actions['deferred']}")
         logger.info(f"({self.name}) current balances: {base_balance} {quote_balance}")
 
+    def level_prices(self):
+        """
+        整个网格的价位一次算出： 价位 k 的价格是 (1 + grid_level_spacing) ** k， 与均线无关，
+        价格变化时只有移出 / 移入区间的几档需要撤单 / 下单； 相邻两档不到 2 个 tick 的档不挂（见 grid_level_count）
+        :return: {side: [(level, price), ...]}， 从中间价往外
+        """
+        step = math.log1p(self.grid_level_spacing)
+        counts = {'buy': self.grid_level_count(self.current_buy_price, 'buy'),
+                  'sell': self.grid_level_count(self.current_sell_price, 'sell')}
+        if counts != self._level_counts:
+            if self._level_counts is not None or min(counts.values()) < self.grid_levels:
+                logger.info(f"({self.name}) grid levels {counts} of {self.grid_levels}, spacing {self.grid_level_spacing}, "
+                            f"tick {self.tick_size}")
+            self._level_counts = counts
+        buys = counts['buy']
+        levels = np.concatenate([math.floor(math.log(self.current_buy_price) / step) - np.arange(buys),
+                                 math.ceil(math.log(self.current_sell_price) / step) + np.arange(counts['sell'])])
+        # 买单向下、 卖单向上取整到 tick， 不越过当前的买卖价
+        prices = np.exp(levels * step) / self.tick_size
+        prices = np.concatenate([np.floor(prices[:buys]), np.ceil(prices[buys:])]) * self.tick_size
+        levels, prices = levels.astype(int).tolist(), prices.tolist()
+        return {'buy': list(zip(levels[:buys], prices[:buys])), 'sell': list(zip(levels[buys:], prices[buys:]))}
+
+    def grid_level_count(self, price, side):
+        """
+        从 price 往外， 相邻两档至少相差 2 个 tick 的档数（同 check_grid_spacing）。 启动和 set_param 时已经检查过，
+        运行中价格跌到最低几档放不下时不再报错， 只是不挂这几档； 卖单往上间隔越来越大， 第一档放得下就都放得下
+        """
+        room = price * self.grid_level_spacing / (2 * self.tick_size)
+        if room < 1: return 0
+        if side == 'sell': return self.grid_levels
+        return min(self.grid_levels, math.floor(math.log(room) / math.log1p(self.grid_level_spacing)) + 1)
+
+    def check_grid_spacing(self, price, grid_levels=None, spacing=None):
+        """
+        最低一档的相邻两档至少相差 2 个 tick： 价位取整到 tick（不超过 1 个 tick）、 下单时再向外移 1 个 tick 后，
+        相邻的档不会落到同一个价格上， 也能从挂单价格反推出价位
+        grid_levels / spacing: 默认用当前的配置， set_param 检查还没生效的配置时传入
+        """
+        grid_levels = self.grid_levels if grid_levels is None else grid_levels
+        spacing = self.grid_level_spacing if spacing is None else spacing
+        if grid_levels <= 1 or price is None: return
+        lowest = price * (1 + spacing) ** -(grid_levels - 1)
+        if lowest * spacing < 2 * self.tick_size:
+            raise ValueError(f"({self.name}) grid_level_spacing {spacing} is less than 2 ticks ({self.tick_size}) "
+                             f"at price {lowest}")
+
+    def grid_client_order_id(self, side, level):
+        # 价位写在 client_order_id 里， 重启后按它找回挂单所在的档； 负数用 n 表示
+        return f"g{'n' if level < 0 else ''}{abs(level)}_{self.api.generate_client_order_id(side)}"
+
+    @staticmethod
+    def parse_grid_level(client_order_id):
+        if not client_order_id or not client_order_id.startswith('g'): return None
+        head = client_order_id.split('_', 1)[0][1:]
+        try:
+            return -int(head[1:]) if head.startswith('n') else int(head)
+        except ValueError:
+            return None
+
+    def order_level(self, order, step):
+        """
+        挂单所在的价位。 按价格反推： 下单时买单价格向下取整到 tick 再减 1 个 tick（_format_order_request），
+        所以档位价格在 挂单价 + 1 ~ 2 个 tick 之间， 取中点（卖单对称）； client_order_id 里有价位且和反推的相差不超过 1 档时用它
+        """
+        offset = 1.5 * self.tick_size if order['side'] == 'buy' else -1.5 * self.tick_size
+        estimate = round(math.log(order['order_price'] + offset) / step)
+        level = self.parse_grid_level(order.get('client_order_id'))
+        # 修改过 grid_level_spacing 时， client_order_id 里的价位已经不对了
+        return level if level is not None and abs(level - estimate) <= 1 else estimate
+
+    def _add_level(self, side, level, order):
+        self.levels[side][level] = order
+        self.order_levels[order['order_id']] = (side, level)
+
+    def _remove_level(self, order_id):
+        side, level = self.order_levels.pop(order_id, (None, None))
+        if side is not None: self.levels[side].pop(level, None)
+
+    def sync_levels(self, orders):
+        """
+        价位索引在下单、 撤单时直接更新， 这里只去掉不在活跃订单里的（成交了）， 补上索引里没有的（比如重启前下的单）
+        :return: 同一价位上多出来的挂单， 需要撤掉
+        """
+        step = math.log1p(self.grid_level_spacing)
+        if step != self._level_step:
+            # 修改了 grid_level_spacing， 价位全部重新计算
+            self.levels, self.order_levels, self._level_step = {'buy': dict(), 'sell': dict()}, dict(), step
+        live = {order['order_id']: order for order in orders}
+        for order_id in self.order_levels.keys() - live.keys():
+            self._remove_level(order_id)
+        duplicates = list()
+        for order_id, order in live.items():
+            if order_id in self.order_levels:
+                side, level = self.order_levels[order_id]
+                self.levels[side][level] = order
+                continue
+            level = self.order_level(order, step)
+            if level in self.levels[order['side']]:
+                duplicates.append(order)
+            else:
+                self._add_level(order['side'], level, order)
+        return duplicates
+
+    def grid_funds(self, balances):
+        """
+        每边的 可用余额 和 总资金（可用余额 + 挂单占用的）， 买单用计价币、 卖单用基础币计
+        """
+        free, funds = dict(), dict()
+        for side, orders in self.levels.items():
+            if side == 'buy':
+                free[side] = balances[self.quote_currency]['free']
+                committed = sum(order['order_price'] * (order['order_size'] - order['filled_size']) for order in orders.values())
+            else:
+                free[side] = balances[self.base_currency]['free']
+                committed = sum(order['order_size'] - order['filled_size'] for order in orders.values())
+            funds[side] = free[side] + committed
+        return free, funds
+
+    def grid_weights(self):
+        weights = self.grid_size_ratio ** np.arange(self.grid_levels)
+        return (weights / weights.sum()).tolist()
+
+    def gen_grid_quotes(self, balances):
+        """
+        期望的各档报价。 某一边有闲置的余额（同 keeps_size 的条件， 比如另一边成交换来的币）时， 从近到远找数量不足的档，
+        带上目标数量让它撤单重下， 直到闲置的余额分完； 其余的档只看价位， 不为资金的小变化改单
+        """
+        free, funds = self.grid_funds(balances)
+        weights = self.grid_weights()
+        min_free = {'buy': self.min_avail_quote_coin, 'sell': self.min_avail_base_coin}
+        quotes = dict()
+        for side, levels in self.level_prices().items():
+            quotes[side] = {level: dict(side=side, price=price, rank=rank, level=level) for rank, (level, price) in enumerate(levels)}
+            idle = free[side] if free[side] > max(min_free[side], self.size_tolerance * funds[side]) else 0.0
+            for level, quote in quotes[side].items():
+                if idle <= 0: break
+                order = self.levels[side].get(level)
+                if not order: continue
+                target = funds[side] * weights[quote['rank']]
+                current = order['order_size'] - order['filled_size']
+                if side == 'buy': current *= order['order_price']
+                if current >= target * (1 - self.size_tolerance): continue
+                quote['size'] = target / quote['price'] if side == 'buy' else target
+                idle -= target - current
+            # 没有挂单的档按 gen_grid_order_infos 的方式试分配资金（包括移出区间、 要撤掉的挂单释放的），
+            # 分不到最小下单量 / 最小下单金额的档下不出去， 不交给对账， 免得占掉每轮的动作预算
+            available = free[side] + sum(order['order_price'] * (order['order_size'] - order['filled_size']) if side == 'buy'
+                                         else order['order_size'] - order['filled_size']
+                                         for level, order in self.levels[side].items() if level not in quotes[side])
+            for level, quote in list(quotes[side].items()):
+                if level in self.levels[side]: continue
+                value = min(funds[side] * weights[quote['rank']], available)
+                size = value / quote['price'] if side == 'buy' else value
+                if self.api.check_order_size(self.symbol, size, quote['price']):
+                    available -= value
+                else:
+                    del quotes[side][level]
+        return quotes
+
+    def gen_grid_order_infos(self, quotes, balances):
+        """
+        新下的各档按 rank 从近到远分配资金： 每边的总资金按 grid_size_ratio 分到各档， 可用余额用完为止
+        """
+        free, funds = self.grid_funds(balances)
+        weights = self.grid_weights()
+        requests = list()
+        for quote in quotes:
+            side = quote['side']
+            value = min(funds[side] * weights[quote['rank']], free[side])
+            free[side] -= value
+            requests.append(dict(
+                symbol=self.symbol,
+                side=side,
+                size=value / quote['price'] if side == 'buy' else value,
+                order_type='limit',
+                price=quote['price'],
+                client_order_id=self.grid_client_order_id(side, quote['level']),
+            ))
+        return requests
+
+    def place_grid_orders(self, orders, balances, now):
+        """
+        多档网格： 期望的价位和挂单的价位对账， 只撤移出区间的、 只补缺的档； 批量撤单 / 下单按交易所的批量上限拆分后并发发出，
+        每轮的请求数取决于变化的档数， 与总档数无关
+        """
+        duplicates = self.sync_levels(orders)
+        actions = self.reconciler.reconcile_levels(self.gen_grid_quotes(balances), self.levels, now)
+        cancel_order_ids = [order['order_id'] for order in actions['cancel'] + duplicates]
+        self.num_cancelled_orders = len(cancel_order_ids)
+        if cancel_order_ids:
+            results = self._gather(self.api.async_cancel_orders(cancel_order_ids, symbol=self.symbol))[0]
+            # 撤掉的单释放冻结的余额， 本地加回可用余额， 不用重新查询； 被拒绝的（多半已经成交）留在索引里， 下一轮按活跃订单去掉
+            balances = {currency: dict(balance) for currency, balance in balances.items()}
+            for order in actions['cancel'] + duplicates:
+                if not results.get(order['order_id']): continue
+                self._remove_level(order['order_id'])
+                remaining = order['order_size'] - order['filled_size']
+                if order['side'] == 'buy':
+                    balances[self.quote_currency]['free'] += order['order_price'] * remaining
+                else:
+                    balances[self.base_currency]['free'] += remaining
+        if actions['place']:
+            requests = self.gen_grid_order_infos(actions['place'], balances)
+            results = self._gather(self.api.async_place_orders(requests))[0]
+            for quote, order in zip(actions['place'], results):
+                if order and order['status'] == 'open': self._add_level(quote['side'], quote['level'], order)
+        logger.info(f"({self.name}) grid: buy {len(self.levels['buy'])}, sell {len(self.levels['sell'])} levels; "
+                    f"keep {len(actions['keep'])}, cancel {len(cancel_order_ids)}, place {len(actions['place'])}, "
+                    f"saved {actions['saved']}, deferred {actions['deferred']}")
+
     def gen_order_info(self, side, base_balance, quote_balance):
         if side == 'buy':
             price = self.current_buy_price
@@ -103,20 +395,114 @@ class GridTrading(Base):
             price=price,
         )
 
+    def on_order_update(self, order):
+        # 有成交时不等下一个 trade_loop_period， 立即重新挂单
+        if order['symbol'] == self.symbol.upper() and order['filled_size'] > 0:
+            self.worker_trade.wake()
+
+    def _gather(self, *coros):
+        if not coros: return list()
+        results = self.api.gather(*coros)
+        for res in results:
+            if isinstance(res, Exception): raise res
+        return results
+
     def trade(self):
+        start_time = time.time()
+        self._apply_params()
         self._reset_active_orders()
-        self.update_current_price()
-        if self.update_active_orders():
-            self.place_orders()
+        # 行情、 活跃订单和余额互不依赖， 并发查询， 一轮的耗时约等于最慢的一个请求
+        ma, ticker, orders, balances = self._gather(
+            self.api.async_get_ma(symbol=self.symbol, period=self.ma_kline_period, size=self.ma_kline_size, source=self.ma_kline_source),
+            self.api.async_get_ticker(self.symbol),
+            self.api.async_get_active_orders(symbol=self.symbol),
+            self.api.async_get_balances()
+        )
+        self.update_current_price(ma, ticker)
+        if not self.api.is_order_state_synced(self.symbol):
+            # 活跃订单来自本地记录， 而余额显示有成交（冻结对不上）， 重新查询交易所
+            orders = self.api.get_active_orders(symbol=self.symbol)
+        if self.update_active_orders(orders):
+            place_orders = self.place_grid_orders if self.grid_levels > 1 else self.place_orders
+            place_orders(orders, balances, self.api.now())
+        metrics.observe('trade_iteration_seconds', time.time() - start_time, strategy=self.name, symbol=self.symbol)
         logger.info(f"({self.name}) {'*'*50}")
 
+    def pause(self):
+        # 暂停下单， 已有的挂单保留
+        self.worker_trade.set_pause()
+
+    def resume(self):
+        self.worker_trade.restart()
+
+    def status(self):
+        balances = self.api.get_balances() or dict()
+        return {
+            'symbol': self.symbol,
+            'paused': self.worker_trade.pause,
+            'current_buy_price': self.current_buy_price,
+            'current_sell_price': self.current_sell_price,
+            'balances': {currency: balances.get(currency) for currency in (self.base_currency, self.quote_currency)},
+            'active_orders': self.api.get_active_orders(symbol=self.symbol),
+            'grid_levels': {side: sorted(levels) for side, levels in self.levels.items()},
+            'trade_iteration_seconds': metrics.histogram('trade_iteration_seconds', strategy=self.name, symbol=self.symbol).snapshot(),
+            'overruns': self.worker_trade.overruns,
+        }
+
+    @staticmethod
+    def _convert_param(old, value, nullable=False):
+        # value 按当前值的类型转换； 当前值为 None（比如 max_actions_per_loop）时按数字转换
+        if isinstance(old, bool):
+            return value.lower() in ('1', 'true', 'yes', 'on')
+        if nullable and value.lower() == 'none':
+            return None
+        if (old is None or isinstance(old, int)) and float(value).is_integer():
+            return int(float(value))
+        return float(value)
+
+    def set_param(self, key, value):
+        """
+        运行时修改配置， 只允许修改 TUNABLE_PARAMS。 在控制线程调用， 只检查并记下修改， 下一轮 trade 开始时生效，
+        同一轮里的价位、 资金分配和对账用的是同一组参数
+        """
+        if key not in self.TUNABLE_PARAMS: raise KeyError(f"param {key} can not be set at runtime, tunable: {list(self.TUNABLE_PARAMS)}")
+        with self._params_lock:
+            config = dict(self.config, **self._pending_params)
+            old = config.get(key, getattr(self, key))
+            value = self._convert_param(old, value, nullable=key in self.NULLABLE_PARAMS)
+            config[key] = value
+            self.check_grid_spacing(self.current_buy_price, grid_levels=max(1, config['max_num_active_order'] // 2),
+                                    spacing=config.get('grid_level_spacing', config['spread_rate']))
+            self._pending_params[key] = value
+        logger.info(f"({self.name}) set {key}: {old} -> {value}, applied next loop")
+        return {key: value}
+
+    def _apply_params(self):
+        with self._params_lock:
+            params, self._pending_params = self._pending_params, dict()
+        if not params: return
+        self.config.update(params)
+        self._initialize_config(self.config)
+        if 'trade_loop_period' in params: self.worker_trade.set_period(self.trade_loop_period)
+        logger.info(f"({self.name}) params applied: {params}")
+
     def start(self):
         logger.info(f'({self.name}) Starting')
+        if self.use_market_ws:
+            self.api.subscribe_market_data(self.symbol, kline_periods=[self.ma_kline_period])
+        if self.use_account_ws:
+            self.api.subscribe_account_data(self.symbol, on_order=self.on_order_update)
+        if self.grid_levels > 1:
+            # 网格的间隔只在启动和 set_param 时检查， 运行中价格变化导致放不下的档在 level_prices 里去掉
+            self.check_grid_spacing(self.api.get_ticker(self.symbol)['bid_price'])
         self.worker_trade.start()
         logger.info(f'({self.name}) Started')
 
-    def stop(self):
+    def stop(self, timeout=10):
         logger.info(f"({self.name}) Stopping")
         self.worker_trade.stop()
+        # 等正在执行的 trade 结束， 否则它在 cancel_all 之后还可能下单
+        if not self.worker_trade.join(timeout):
+            logger.warning(f"({self.name}) trade still running after {timeout}s, cancel all anyway")
         self.api.cancel_all(self.symbol)
         logger.info(f"({self.name}) Stopped")
@@ -0,0 +1,132 @@
+from Metrics import metrics
+
+
+class QuoteReconciler:
+    """
+    比较期望报价和当前挂单， 算出最少的撤单 / 下单动作， 代替每轮 撤单 + 重新下单：
+    - 价格偏离在 price_tolerance 以内、 数量偏离在 size_tolerance 以内的挂单保留， 不丢排队位置；
+    - 挂单时间不到 min_lifetime 秒的不撤， 它占着的报价也不重复下；
+    - 每轮最多 max_actions 个动作（撤单 + 下单）， 偏离大的先做， 其余留到下一轮， 上一轮被推迟的动作下一轮优先。
+    """
+
+    def __init__(self, price_tolerance, size_tolerance=0.0, min_lifetime=0, max_actions=None, name=''):
+        self.price_tolerance = price_tolerance
+        self.size_tolerance = size_tolerance
+        self.min_lifetime = min_lifetime
+        self.max_actions = max_actions
+        self.name = name
+        # 上一轮超出预算被推迟的动作
+        self._deferred = set()
+
+    @staticmethod
+    def _action_key(action, item):
+        if action == 'cancel': return action, item['order_id']
+        return action, item['side'], item.get('level', 0)
+
+    @staticmethod
+    def _deviation(price, order):
+        return abs(1 - price / order['order_price'])
+
+    def _size_ok(self, size, order):
+        remaining = order['order_size'] - order.get('filled_size', 0)
+        return abs(size - remaining) <= self.size_tolerance * size
+
+    def _match(self, quotes, orders):
+        """
+        同一边的报价和挂单按价格偏离从小到大配对， 价格、 数量都在容忍带内的才算匹配
+        :return: (matched 挂单, 未匹配的报价, 未匹配的挂单)
+        """
+        pairs = sorted(((self._deviation(quote['price'], order), i, j) for i, quote in enumerate(quotes)
+                        for j, order in enumerate(orders)), key=lambda pair: pair[0])
+        used_quotes, used_orders = set(), set()
+        for deviation, i, j in pairs:
+            if deviation >= self.price_tolerance: break
+            if i in used_quotes or j in used_orders or not self._size_ok(quotes[i]['size'], orders[j]): continue
+            used_quotes.add(i)
+            used_orders.add(j)
+        return ([orders[j] for j in sorted(used_orders)],
+                [quote for i, quote in enumerate(quotes) if i not in used_quotes],
+                [order for j, order in enumerate(orders) if j not in used_orders])
+
+    def reconcile(self, quotes, orders, now):
+        """
+        quotes: 期望的报价 [dict(side, price, size), ...]
+        orders: 当前挂单， 格式同 format_order
+        now: 当前时间 ms， 用 api.now()， 和本地下单的 created_at 同一个时钟， 回测时就是虚拟时钟
+        :return: dict(keep=[保留的挂单], cancel=[要撤的挂单], place=[要下的报价], deferred=超出预算留到下一轮的动作数,
+                      saved=比撤单重下少做的动作数)
+        """
+        keep, cancels, places = list(), list(), list()
+        for side in ('buy', 'sell'):
+            side_quotes = [quote for quote in quotes if quote['side'] == side]
+            side_orders = [order for order in orders if order['side'] == side]
+            matched, side_quotes, side_orders = self._match(side_quotes, side_orders)
+            keep.extend(matched)
+            for order in side_orders:
+                if now - order.get('created_at', 0) < self.min_lifetime * 1000:
+                    # 太新的单先不撤， 它占着一个报价的位置
+                    keep.append(order)
+                    if side_quotes:
+                        side_quotes.remove(min(side_quotes, key=lambda quote: self._deviation(quote['price'], order)))
+                    continue
+                deviation = min((self._deviation(quote['price'], order) for quote in side_quotes), default=float('inf'))
+                cancels.append((deviation, order))
+            places.extend(side_quotes)
+        return self._finish(keep, cancels, places, len(orders) + len(quotes))
+
+    def reconcile_levels(self, desired, live, now):
+        """
+        网格按价位对账， 每一边只按价位查字典， 不用两两比较价格： 挂单的价位不在期望里的撤掉， 期望的价位没有挂单的补上；
+        报价带 size 的价位还要检查数量， 超出 size_tolerance 的撤掉重下。
+        desired: {side: {level: quote}}， 按离中间价从近到远排序
+        live: {side: {level: order}}
+        :return: 同 reconcile
+        """
+        keep, cancels, places = list(), list(), list()
+        total = 0
+        for side in ('buy', 'sell'):
+            quotes, orders = desired.get(side, dict()), live.get(side, dict())
+            total += len(quotes) + len(orders)
+            low, high = (min(quotes), max(quotes)) if quotes else (0, 0)
+            vacated = set()
+            for level, order in orders.items():
+                quote = quotes.get(level)
+                if quote is not None and ('size' not in quote or self._size_ok(quote['size'], order)):
+                    keep.append(order)
+                elif now - order.get('created_at', 0) < self.min_lifetime * 1000:
+                    keep.append(order)
+                elif quote is not None:
+                    # 期望的价位上数量不对， 撤掉重下
+                    cancels.append((0, order))
+                    vacated.add(level)
+                else:
+                    # 离期望区间越远的越先撤
+                    cancels.append((min(abs(level - low), abs(level - high)), order))
+            places.extend(quote for level, quote in quotes.items() if level not in orders or level in vacated)
+        return self._finish(keep, cancels, places, total)
+
+    def _finish(self, keep, cancels, places, total):
+        """
+        按预算截断， 统计动作数
+        total: 撤单重下要做的动作数， 每个挂单都撤掉、 每个报价都重新下
+        """
+        # 偏离最大的撤单先做； 下单按 rank（网格里离中间价的档数）， 两边交替
+        cancels = [order for _, order in sorted(cancels, key=lambda item: -item[0])]
+        places = sorted(places, key=lambda quote: quote.get('rank', 0))
+        deferred = 0
+        if self.max_actions is not None:
+            actions = [('cancel', order) for order in cancels] + [('place', quote) for quote in places]
+            # 上一轮被推迟的排在前面（稳定排序， 其余顺序不变）， 预算不会每轮都被同一边用完
+            actions.sort(key=lambda action: self._action_key(*action) not in self._deferred)
+            actions, rest = actions[:self.max_actions], actions[self.max_actions:]
+            self._deferred = {self._action_key(*action) for action in rest}
+            cancels = [item for action, item in actions if action == 'cancel']
+            places = [item for action, item in actions if action == 'place']
+            deferred = len(rest)
+        saved = total - len(cancels) - len(places) - deferred
+
+        metrics.inc('quote_actions_total', len(cancels), strategy=self.name, action='cancel')
+        metrics.inc('quote_actions_total', len(places), strategy=self.name, action='place')
+        metrics.inc('quote_actions_total', saved, strategy=self.name, action='saved')
+        metrics.inc('quote_actions_total', deferred, strategy=self.name, action='deferred')
+        return dict(keep=keep, cancel=cancels, place=places, deferred=deferred, saved=saved)